@@ -0,0 +1,50 @@
+# Benchmark: parseig d'imports vectoritzat (utils.amounts) vs les lambdes antigues del Dashboard.
+# Execució des de daily-data-app/src:  python -m benchmarks.bench_amounts [n_linies]
+import random
+import sys
+import time
+
+import pandas as pd
+
+from utils.amounts import parse_amounts
+
+
+def genera_imports(n, seed=0):
+    # Imports sintètics en els formats que accepta el codi antic (símbol davant, coma o punt decimal)
+    rnd = random.Random(seed)
+    formats = ['€{:.2f}', '${:.2f}', '{:.2f}', '{:.2f}€']
+    valors = []
+    for _ in range(n):
+        text = rnd.choice(formats).format(rnd.uniform(0, 999))
+        if rnd.random() < 0.3:
+            text = text.replace('.', ',')
+        valors.append(text)
+    return pd.Series(valors, dtype=object)
+
+
+def parse_antic(x):
+    # Còpia del parseig per element que feia Dashboard.show (ImportTotal / suma_imports)
+    return float(str(x).replace('€', '').replace('$', '').replace(',', '.'))
+
+
+def main(n=1_000_000):
+    imports = genera_imports(n)
+    t0 = time.perf_counter()
+    antic = imports.apply(parse_antic)
+    t_antic = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    nou = parse_amounts(imports)
+    t_nou = time.perf_counter() - t0
+    diferents = int((antic.round(6) != nou['Import'].round(6)).sum())
+    print(f"Línies: {n}")
+    print(f"Lambdes antigues : {t_antic:.3f} s ({n / t_antic:,.0f} línies/s)")
+    print(f"parse_amounts    : {t_nou:.3f} s ({n / t_nou:,.0f} línies/s)")
+    print(f"Acceleració      : x{t_antic / t_nou:.2f}")
+    print(f"Resultats diferents: {diferents}")
+    # Formats que el codi antic no suportava
+    exemples = pd.Series(['£1,234.56', '1.234,56 €', 'USD 2,000', '1.234.567,89'])
+    print(pd.concat([exemples.rename('Text'), parse_amounts(exemples)], axis=1).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,332 @@
+# Benchmark d'extrem a extrem: genera factures sintètiques (TXT, PDF amb text i imatges escanejades),
+# les fa passar per la ingesta, l'OCR, l'extracció LLM (contra un Ollama fals), el magatzem i els
+# càlculs del Dashboard sense navegador, i desa throughput, latències p50/p95 i memòria en JSON
+# per poder comparar resultats entre commits.
+# Execució des de daily-data-app/src:
+#   python -m benchmarks.bench_e2e [--factures 20000] [--txt 200] [--pdf 50] [--imatges 10] [--sortida fitxer.json]
+#   python -m benchmarks.bench_e2e --compara resultats_anteriors.json
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from benchmarks.sintetic import (
+    FitxerMemoria, dataframe_factures, factures, imatge_escanejada, linies_factura, pdf_amb_text, txt_factures,
+)
+from benchmarks.stub_ollama import StubOllama
+
+
+RESULTATS = os.path.join(os.path.dirname(__file__), 'resultats')
+
+
+def memoria_max_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def percentil(valors, q):
+    # Percentil pel mètode del rang més proper (valors en segons)
+    if not valors:
+        return None
+    ordenats = sorted(valors)
+    return ordenats[max(0, math.ceil(q / 100 * len(ordenats)) - 1)]
+
+
+class Etapa:
+    # Latències d'una etapa; unitats = elements processats (factures, pàgines...) per calcular el throughput
+    def __init__(self, nom):
+        self.nom = nom
+        self.latencies = []
+        self.unitats = 0
+        self.segons = 0.0
+        self.error = None
+        self.memoria_abans = self.memoria_despres = None
+
+    def mesura(self, funcio, unitats=1):
+        t0 = time.perf_counter()
+        resultat = funcio()
+        durada = time.perf_counter() - t0
+        self.latencies.append(durada)
+        self.segons += durada
+        self.unitats += unitats
+        return resultat
+
+    def as_dict(self):
+        if self.error:
+            return {"error": self.error}
+        return {
+            "crides": len(self.latencies), "unitats": self.unitats, "segons": round(self.segons, 4),
+            "throughput_s": round(self.unitats / self.segons, 2) if self.segons else None,
+            "p50_ms": round(percentil(self.latencies, 50) * 1000, 3) if self.latencies else None,
+            "p95_ms": round(percentil(self.latencies, 95) * 1000, 3) if self.latencies else None,
+            "max_ms": round(max(self.latencies) * 1000, 3) if self.latencies else None,
+            "rss_max_mb": None if self.memoria_despres is None else round(self.memoria_despres, 1),
+            "rss_creixement_mb": None if self.memoria_abans is None else round(self.memoria_despres - self.memoria_abans, 1),
+        }
+
+
+class Harness:
+    def __init__(self, args, directori):
+        self.args = args
+        self.dir = directori
+        self.etapes = {}
+        self._n = 0
+
+    def data_manager(self):
+        # DataManager aïllat (magatzem, memòria cau i plantilles nous) perquè cap etapa aprofiti la cau d'una altra
+        from data.data_manager import DataManager
+        from data.store import SQLiteInvoiceStore
+        from data.templates import TemplateStore
+        from utils.cache import DiskCache
+
+        self._n += 1
+        store = SQLiteInvoiceStore(os.path.join(self.dir, f'bench_{self._n}.db'))
+        return DataManager(store=store, cache=DiskCache(os.path.join(self.dir, f'cache_{self._n}.sqlite')),
+                           templates=TemplateStore(os.path.join(self.dir, f'plantilles_{self._n}.sqlite')))
+
+    def etapa(self, nom, funcio):
+        etapa = Etapa(nom)
+        self.etapes[nom] = etapa
+        etapa.memoria_abans = memoria_max_mb()
+        try:
+            funcio(etapa)
+        except Exception as e:
+            etapa.error = f"{type(e).__name__}: {e}"
+        etapa.memoria_despres = memoria_max_mb()
+        detall = etapa.error or f"{etapa.unitats} unitats en {etapa.segons:.2f} s"
+        print(f"  {nom:<20} {detall}")
+        return etapa
+
+    # --- Etapes ---
+
+    def ingesta_txt(self, etapa):
+        dm = self.data_manager()
+        for i, f in enumerate(factures(self.args.txt, seed=1)):
+            fitxer = FitxerMemoria(txt_factures([f]), f"factura_{i}.txt")
+            etapa.mesura(lambda: dm.load_data_from_any(fitxer, 'txt'))
+
+    def ingesta_txt_massiva(self, etapa):
+        dm = self.data_manager()
+        fitxer = FitxerMemoria(txt_factures(factures(self.args.factures, seed=2)), "massiu.txt")
+        etapa.mesura(lambda: dm.load_data_from_any(fitxer, 'txt'), unitats=self.args.factures)
+
+    def text_pdf(self, etapa):
+        dm = self.data_manager()
+        self.textos = []
+        for f in factures(self.args.pdf, seed=3):
+            dades = pdf_amb_text(linies_factura(f))
+            self.textos.append(etapa.mesura(lambda: dm.extract_text(dades, 'pdf')))
+
+    def ocr_imatges(self, etapa):
+        dm = self.data_manager()
+        rnd = random.Random(4)
+        for f in factures(self.args.imatges, seed=4):
+            dades = imatge_escanejada(linies_factura(f), rnd)
+            etapa.mesura(lambda: dm.extract_text(dades, 'png'))
+
+    def extraccio_llm(self, etapa):
+        dm = self.data_manager()
+        textos = getattr(self, 'textos', None) or ["\n".join(linies_factura(f)) for f in factures(self.args.pdf, seed=3)]
+        for text in textos:
+            etapa.mesura(lambda: dm.extract_fields_llm(text))
+
+    def cua_llm(self, etapa):
+        from data.llm_queue import ExtractionQueue
+
+        dm = self.data_manager()
+        cua = ExtractionQueue(dm, concurrency=self.args.concurrencia, host=self.stub.url)
+        textos = ["\n".join(linies_factura(f)) for f in factures(self.args.pdf, seed=5)]
+        t0 = time.perf_counter()
+        ids = [cua.submit(text, nom=f"factura_{i}") for i, text in enumerate(textos)]
+        while cua.pending():
+            time.sleep(0.01)
+        etapa.segons = time.perf_counter() - t0
+        for job_id in ids:
+            job = cua.job(job_id)
+            etapa.latencies.append(job.acabat - job.creat)
+        etapa.unitats = len(ids)
+
+    def magatzem(self, etapa):
+        dm = self.data_manager()
+        df = dataframe_factures(factures(self.args.factures, seed=6))
+        mida = self.args.bloc
+        for inici in range(0, len(df), mida):
+            bloc = df.iloc[inici:inici + mida]
+            etapa.mesura(lambda: dm.store.append(bloc), unitats=len(bloc))
+        self.dm_magatzem = dm
+
+    def magatzem_concurrent(self, etapa):
+        # Insercions d'una sola factura des de diversos fils (com la cua LLM o diverses sessions):
+        # l'escriptor diferit les agrupa en pocs commits. Latència per inserció i throughput sobre el temps real.
+        from concurrent.futures import ThreadPoolExecutor
+
+        dm = self.data_manager()
+        df = dataframe_factures(factures(self.args.txt, seed=8))
+
+        def insereix(i):
+            t0 = time.perf_counter()
+            dm.append_data(df.iloc[i:i + 1])
+            return time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrencia * 2) as pool:
+            etapa.latencies.extend(pool.map(insereix, range(len(df))))
+        etapa.segons = time.perf_counter() - t0
+        etapa.unitats = len(df)
+        print(f"  {dm.writer.peticions} insercions en {dm.writer.commits} commits")
+
+    def lectura(self, etapa):
+        dm = self.dm_magatzem
+        for _ in range(self.args.repeticions):
+            etapa.mesura(lambda: dm.store.read(), unitats=dm.store.count())
+
+    def edicio(self, etapa):
+        dm = self.dm_magatzem
+        for _ in range(self.args.repeticions):
+            # Es rellegeix a cada repetició: les files porten la versió i una edició sobre dades velles seria un conflicte
+            dades = dm.get_data()
+            mostra = dades.sample(min(100, len(dades)), random_state=len(etapa.latencies)).copy()
+            mostra['TipusFactura'] = mostra['TipusFactura'].astype(str) + '*'
+            etapa.mesura(lambda: dm.store.update(mostra), unitats=len(mostra))
+
+    def dashboard_cache(self, etapa):
+        from ui.dashboard_cache import DashboardCache
+
+        dm = self.dm_magatzem
+        for _ in range(self.args.repeticions):
+            etapa.mesura(lambda: DashboardCache().refresh(dm), unitats=dm.store.count())
+
+    def dashboard_incremental(self, etapa):
+        from ui.dashboard_cache import DashboardCache
+
+        dm = self.dm_magatzem
+        cache = DashboardCache().refresh(dm)
+        for i in range(self.args.repeticions):
+            dm.store.append(dataframe_factures(factures(1, seed=100 + i, inici=10_000_000 + i)))
+            etapa.mesura(lambda: cache.refresh(dm))
+
+    def dashboard_show(self, etapa):
+        # Dashboard.show() sense servidor de Streamlit (mode "bare": els widgets retornen el valor per defecte)
+        from ui.dashboard import Dashboard
+        from ui.dashboard_cache import DashboardCache
+        from utils.geocoding import Geocoder
+
+        class GeocodificadorFals:
+            def geocode(self, postal_code, country):
+                return 41.0 + int(postal_code[-2:]) / 100, 2.0 + int(postal_code[:2]) / 100
+
+        dashboard = Dashboard(self.dm_magatzem, cache=DashboardCache(),
+                              geocoder=Geocoder(provider=GeocodificadorFals(), cache_path=os.path.join(self.dir, 'geo.sqlite')))
+        for _ in range(self.args.repeticions):
+            etapa.mesura(dashboard.show)
+
+    def executa(self):
+        logging.getLogger('streamlit').setLevel(logging.ERROR)
+        with StubOllama(latencia=self.args.latencia_llm) as stub:
+            # El client per defecte d'ollama llegeix OLLAMA_HOST en importar-se: s'ha de fixar abans
+            os.environ['OLLAMA_HOST'] = stub.url
+            self.stub = stub
+            self.etapa("ingesta_txt", self.ingesta_txt)
+            self.etapa("ingesta_txt_massiva", self.ingesta_txt_massiva)
+            self.etapa("text_pdf", self.text_pdf)
+            if self.args.imatges:
+                self.etapa("ocr_imatges", self.ocr_imatges)
+            self.etapa("extraccio_llm", self.extraccio_llm)
+            self.etapa("cua_llm", self.cua_llm)
+            self.etapa("magatzem_append", self.magatzem)
+            self.etapa("magatzem_concurrent", self.magatzem_concurrent)
+            if hasattr(self, 'dm_magatzem'):
+                self.etapa("magatzem_lectura", self.lectura)
+                self.etapa("magatzem_edicio", self.edicio)
+                self.etapa("dashboard_cache", self.dashboard_cache)
+                self.etapa("dashboard_incremental", self.dashboard_incremental)
+                self.etapa("dashboard_show", self.dashboard_show)
+        return {nom: etapa.as_dict() for nom, etapa in self.etapes.items()}
+
+
+def commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compara(actual, anterior):
+    # Taula de canvis per etapa: p50, p95 i throughput (ràtio nou / antic)
+    print(f"\nComparació amb {anterior.get('commit')} ({anterior.get('data')}):")
+    print(f"{'Etapa':<22}{'p50 ms':>22}{'p95 ms':>22}{'throughput/s':>26}")
+    for nom, nou in actual["etapes"].items():
+        antic = anterior.get("etapes", {}).get(nom)
+        if not antic or "error" in nou or "error" in antic:
+            continue
+        columnes = []
+        for clau in ("p50_ms", "p95_ms", "throughput_s"):
+            a, b = antic.get(clau), nou.get(clau)
+            ratio = f"x{b / a:.2f}" if a and b else "-"
+            columnes.append(f"{a} -> {b} ({ratio})")
+        print(f"{nom:<22}" + "".join(f"{c:>24}" for c in columnes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark d'extrem a extrem de la ingesta, l'extracció i el Dashboard")
+    parser.add_argument("--factures", type=int, default=20000, help="Factures per a la ingesta massiva, el magatzem i el Dashboard")
+    parser.add_argument("--txt", type=int, default=200, help="Fitxers TXT d'una factura")
+    parser.add_argument("--pdf", type=int, default=50, help="PDF amb capa de text (i textos per a l'extracció LLM)")
+    parser.add_argument("--imatges", type=int, default=10, help="Imatges escanejades per a l'OCR (0 per ometre-ho)")
+    parser.add_argument("--bloc", type=int, default=1000, help="Factures per escriptura al magatzem")
+    parser.add_argument("--repeticions", type=int, default=5)
+    parser.add_argument("--latencia-llm", dest="latencia_llm", type=float, default=0.05, help="Segons per resposta de l'Ollama fals")
+    parser.add_argument("--concurrencia", type=int, default=4, help="Concurrència de la cua LLM")
+    parser.add_argument("--sortida", default=None, help="Fitxer JSON de resultats (per defecte, benchmarks/resultats/)")
+    parser.add_argument("--compara", default=None, help="JSON d'una execució anterior amb què comparar")
+    args = parser.parse_args(argv)
+
+    print("Executant benchmark d'extrem a extrem...")
+    inici = time.perf_counter()
+    with tempfile.TemporaryDirectory() as directori:
+        etapes = Harness(args, directori).executa()
+    resultat = {
+        "commit": commit_actual(), "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(), "plataforma": platform.platform(),
+        "parametres": vars(args), "segons_totals": round(time.perf_counter() - inici, 2),
+        "rss_max_mb": memoria_max_mb(), "etapes": etapes,
+    }
+
+    sortida = args.sortida
+    if sortida is None:
+        os.makedirs(RESULTATS, exist_ok=True)
+        sortida = os.path.join(RESULTATS, f"e2e_{resultat['commit'] or 'local'}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(sortida, 'w', encoding='utf-8') as f:
+        json.dump(resultat, f, indent=2, ensure_ascii=False)
+
+    print(f"\n{'Etapa':<22}{'unitats':>9}{'throughput/s':>14}{'p50 ms':>11}{'p95 ms':>11}{'RSS MB':>9}")
+    for nom, e in etapes.items():
+        if "error" in e:
+            print(f"{nom:<22} ERROR: {e['error']}")
+            continue
+        print(f"{nom:<22}{e['unitats']:>9}{e['throughput_s'] or 0:>14,.1f}{e['p50_ms'] or 0:>11.2f}{e['p95_ms'] or 0:>11.2f}{e['rss_max_mb'] or 0:>9.0f}")
+    print(f"\nResultats desats a {sortida}")
+
+    if args.compara:
+        with open(args.compara, encoding='utf-8') as f:
+            compara(resultat, json.load(f))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# Pressupost d'arrencada: temps d'importació dels mòduls que carrega main.py, mesurat amb `python -X importtime`.
+# Falla (codi de sortida 1) si l'app afegeix més del llindar sobre streamlit + pandas, o si un backend pesat
+# (OCR, LLM, mapes, gràfics) es torna a importar en arrencar en lloc de fer-ho al primer ús.
+# Execució des de daily-data-app/src:  python -m benchmarks.bench_import [--llindar-ms 500] [--repeticions 5]
+import argparse
+import os
+import subprocess
+import sys
+
+
+# Mòduls que importa main.py abans de pintar la primera pàgina
+MODULS_APP = [
+    "data.csv_import", "data.data_manager", "data.ingest", "data.llm_queue", "data.service",
+    "ui.charts", "ui.dashboard", "ui.dashboard_cache", "utils.telemetria",
+]
+# Dependències inevitables de la UI; el pressupost es mesura per sobre d'aquesta base
+MODULS_BASE = ["streamlit", "pandas"]
+# Backends que s'han de carregar al primer ús (utils.lazy.ModulLazy), mai en arrencar
+BACKENDS_LAZY = ["ollama", "pytesseract", "pdfplumber", "pdf2image", "folium", "streamlit_folium", "plotly", "requests"]
+LLINDAR_MS = float(os.environ.get("IMPORT_BUDGET_MS", 500))
+SRC = os.path.join(os.path.dirname(__file__), '..')
+
+
+def importtime(moduls):
+    # Retorna {mòdul: (propi_us, acumulat_us, nivell)} de tots els mòduls importats en un procés net
+    resultat = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(moduls)],
+        cwd=SRC, capture_output=True, text=True,
+    )
+    if resultat.returncode != 0:
+        raise RuntimeError(resultat.stderr.strip().splitlines()[-1] if resultat.stderr.strip() else "error d'importació")
+    temps = {}
+    for linia in resultat.stderr.splitlines():
+        if not linia.startswith("import time:") or "imported package" in linia:
+            continue
+        propi, acumulat, nom = linia[len("import time:"):].split("|", 2)
+        nom = nom[1:]
+        temps[nom.strip()] = (int(propi), int(acumulat), (len(nom) - len(nom.lstrip())) // 2)
+    return temps
+
+
+def total_ms(temps):
+    # Suma dels temps acumulats dels mòduls de primer nivell (els importats directament per -c)
+    return sum(acumulat for _, acumulat, nivell in temps.values() if nivell == 0) / 1000
+
+
+def backends(temps):
+    return {b for b in BACKENDS_LAZY if any(nom == b or nom.startswith(b + ".") for nom in temps)}
+
+
+def mesura(moduls, repeticions):
+    # El millor de n processos nets (la primera execució també paga la compilació a .pyc)
+    mesures = [importtime(moduls) for _ in range(repeticions)]
+    return min(mesures, key=total_ms)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pressupost de temps d'importació en arrencar la UI")
+    parser.add_argument("--llindar-ms", type=float, default=LLINDAR_MS,
+                        help="Temps màxim que poden afegir els mòduls de l'app sobre streamlit + pandas")
+    parser.add_argument("--repeticions", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Mòduls més lents que es llisten")
+    args = parser.parse_args(argv)
+
+    base = mesura(MODULS_BASE, args.repeticions)
+    app = mesura(MODULS_BASE + MODULS_APP, args.repeticions)
+    extra = total_ms(app) - total_ms(base)
+
+    print(f"Base ({', '.join(MODULS_BASE)}): {total_ms(base):8.1f} ms")
+    print(f"Amb l'app:                 {total_ms(app):8.1f} ms")
+    print(f"Afegit per l'app:          {extra:8.1f} ms (llindar {args.llindar_ms:.0f} ms)")
+    print()
+    nous = sorted(((acumulat, nom) for nom, (_, acumulat, _) in app.items() if nom not in base), reverse=True)
+    print("Mòduls nous més lents (acumulat):")
+    for acumulat, nom in nous[:args.top]:
+        print(f"  {acumulat / 1000:8.1f} ms  {nom}")
+
+    errors = []
+    if extra > args.llindar_ms:
+        errors.append(f"l'arrencada supera el pressupost: {extra:.1f} ms > {args.llindar_ms:.0f} ms")
+    # Un backend que ja carrega la base (p. ex. requests des de streamlit) no es pot evitar des de l'app
+    filtrats = sorted(backends(app) - backends(base))
+    if filtrats:
+        errors.append(f"backends importats en arrencar: {', '.join(filtrats)}")
+    for error in errors:
+        print(f"ERROR: {error}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+# Benchmark: temps i memòria per pàgina de l'etapa d'OCR amb diferents configuracions (DPI i preprocés).
+# Execució des de daily-data-app/src:  python -m benchmarks.bench_ocr [fitxer.pdf] [--dpi 150 200 300] [--threads N]
+import argparse
+import os
+
+import pandas as pd
+
+from utils.ocr import OCR_LANG, OcrConfig, ocr_pdf
+
+
+EXEMPLE = os.path.join(os.path.dirname(__file__), '../../../wordpress-pdf-invoice-plugin-sample.pdf')
+
+# Combinacions de preprocés que es comparen per a cada DPI
+PREPROCESSOS = {
+    "cru": dict(grayscale=False),
+    "grisos": dict(grayscale=True),
+    "grisos+binaritza": dict(grayscale=True, binarize=True),
+    "grisos+binaritza+endreça": dict(grayscale=True, binarize=True, deskew=True),
+    "tot+retall": dict(grayscale=True, binarize=True, deskew=True, text_regions=True),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Temps i memòria de l'OCR per pàgina segons la configuració")
+    parser.add_argument("pdf", nargs="?", default=EXEMPLE, help="PDF escanejat a analitzar")
+    parser.add_argument("--dpi", type=int, nargs="+", default=[150, 200, 300])
+    parser.add_argument("--lang", default=OCR_LANG)
+    parser.add_argument("--threads", type=int, default=1, help="Fils de pdftoppm (pàgines rasteritzades alhora)")
+    args = parser.parse_args(argv)
+
+    files = []
+    for dpi in args.dpi:
+        for nom, opcions in PREPROCESSOS.items():
+            config = OcrConfig(dpi=dpi, lang=args.lang, thread_count=args.threads, **opcions)
+            metriques = []
+            text = ocr_pdf(args.pdf, config, metriques)
+            for m in metriques:
+                files.append({"DPI": dpi, "Preproces": nom, **m, "Caracters": len(text)})
+            print(f"DPI {dpi:>3} {nom:<26} {sum(m['Raster_s'] + m['Preproces_s'] + m['OCR_s'] for m in metriques):7.2f} s")
+
+    df = pd.DataFrame(files)
+    print()
+    print(df.to_string(index=False))
+    print()
+    resum = df.groupby(["DPI", "Preproces"], sort=False).agg(
+        Pagines=("Pagina", "size"), Raster_s=("Raster_s", "mean"), Preproces_s=("Preproces_s", "mean"),
+        OCR_s=("OCR_s", "mean"), Imatge_MB=("Imatge_MB", "max"), Caracters=("Caracters", "first"),
+    )
+    print("Mitjana per pàgina:")
+    print(resum.round(3).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# Benchmark: parser TXT multi-factura (data.txt_invoice) vs el parseig antic d'una factura per crida.
+# Execució des de daily-data-app/src:  python -m benchmarks.bench_txt_parser [n_factures]
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from data.txt_invoice import CAPCALERA_FACTURA, parse_factures_txt
+
+
+EXEMPLE = os.path.join(os.path.dirname(__file__), '../../../Input_Exemple.txt')
+
+
+def genera_fitxer(path, n):
+    # Fitxer sintètic amb n còpies de Input_Exemple.txt, cadascuna amb el seu número de factura
+    with open(EXEMPLE, encoding='utf-8') as f:
+        plantilla = f.read().strip().splitlines()[1:]
+    cos = "\n".join(plantilla) + "\n"
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(n):
+            f.write(f"{CAPCALERA_FACTURA}: {i + 1:06d}\n")
+            f.write(cos)
+
+
+def parse_antic(text):
+    # Còpia del bucle de DataManager.parse_custom_txt anterior (una sola factura per text)
+    data = {}
+    productes = []
+    imports = []
+    for line in text.splitlines():
+        if line.startswith('Numero de Factura:'):
+            data['NumeroFactura'] = line.split(':', 1)[1].strip()
+        elif line.startswith('Tipus Factura:'):
+            data['TipusFactura'] = line.split(':', 1)[1].strip()
+        elif line.startswith('Pagador:'):
+            data['Pagador'] = line.split(':', 1)[1].strip()
+        elif line.startswith('Dades_Pagador:'):
+            dades_pagador = line.split(':', 1)[1].strip()
+            email = re.search(r'[\w\.-]+@[\w\.-]+', dades_pagador)
+            data['AdrecaPagador'] = re.sub(r'[\w\.-]+@[\w\.-]+', '', dades_pagador).strip()
+            data['EmailPagador'] = email.group(0) if email else ''
+        elif line.startswith('Emisor:'):
+            data['Emisor'] = line.split(':', 1)[1].strip()
+        elif line.startswith('Dades_Emisor:'):
+            dades_emisor = line.split(':', 1)[1].strip()
+            email = re.search(r'[\w\.-]+@[\w\.-]+', dades_emisor)
+            data['AdrecaEmisor'] = re.sub(r'[\w\.-]+@[\w\.-]+', '', dades_emisor).strip()
+            data['EmailEmisor'] = email.group(0) if email else ''
+        elif line.startswith('Data:'):
+            data['Data'] = line.split(':', 1)[1].strip()
+        elif re.match(r'Producte \d+:', line):
+            productes.append(line.split(':', 1)[1].strip())
+        elif re.match(r'Import \d+:', line):
+            imports.append(line.split(':', 1)[1].strip())
+    data['Productes'] = ', '.join(productes)
+    data['Imports'] = ', '.join(imports)
+    return data
+
+
+def parse_antic_fitxer(path):
+    # El codi antic només entenia una factura per fitxer: es llegeix tot, es parteix i es crida per factura
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    trossos = text.split(CAPCALERA_FACTURA + ':')[1:]
+    return [parse_antic(CAPCALERA_FACTURA + ':' + tros) for tros in trossos]
+
+
+def pic_memoria(funcio):
+    # Memòria màxima (bytes) assignada durant la crida, per sobre de la que ja hi havia
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    funcio()
+    pic = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return pic
+
+
+def main(n=100_000):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'factures.txt')
+        genera_fitxer(path, n)
+        mida = os.path.getsize(path)
+
+        t0 = time.perf_counter()
+        antic = parse_antic_fitxer(path)
+        t_antic = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        nou = list(parse_factures_txt(path))
+        t_nou = time.perf_counter() - t0
+
+        # Memòria: l'antic necessita el text sencer; el nou es recorre en streaming (sense acumular registres)
+        pic_antic = pic_memoria(lambda: parse_antic_fitxer(path))
+        pic_nou = pic_memoria(lambda: sum(1 for _ in parse_factures_txt(path)))
+
+    diferents = sum(1 for a, b in zip(antic, nou) if a['NumeroFactura'] != b['NumeroFactura'] or a['Data'] != b['Data'])
+    print(f"Factures: {n} ({mida / 1e6:.1f} MB)")
+    print(f"Parser antic (per factura): {t_antic:.3f} s ({n / t_antic:,.0f} factures/s)")
+    print(f"parse_factures_txt        : {t_nou:.3f} s ({n / t_nou:,.0f} factures/s)")
+    print(f"Acceleració               : x{t_antic / t_nou:.2f}")
+    print(f"Memòria màxima: antic {pic_antic / 1e6:.1f} MB, streaming {pic_nou / 1e6:.2f} MB")
+    print(f"Factures llegides: {len(nou)}; diferències de camps: {diferents + abs(len(antic) - len(nou))}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,123 @@
+# Generadors de factures sintètiques per als benchmarks: TXT en el format de Input_Exemple.txt,
+# PDF amb capa de text (generats a mà, sense dependències) i imatges "escanejades" (PIL).
+import io
+import json
+import random
+
+import pandas as pd
+
+from data.txt_invoice import CAPCALERA_FACTURA
+
+
+EMISSORS = [
+    "Peix Fresc S.L", "Carns Vallès S.A", "Fruites Maresme S.L", "Disseny Gràfic Roca", "Obres i Reformes Puig",
+    "Forn de Pa Sant Joan", "Begudes del Nord S.L", "Papereria Central", "Electricitat Ferrer", "Neteges Brillant S.L",
+]
+PAGADORS = ["Entitat 1 S.A", "Restaurant La Barca", "Hotel Miramar", "Bar Central", "Càtering Costa"]
+TIPUS = ["Marisc", "Carn", "Fruita", "Dissenyador gràfic", "Mà d'obra", "Menjar", "Begudes", "Material"]
+PRODUCTES = [
+    "Tela_Marinera", "Dierna", "Equipatge", "Gambes", "Lluç", "Vedella", "Pollastre", "Pomes", "Taronges",
+    "Logotip", "Cartells", "Hores de feina", "Pa de pagès", "Aigua", "Vi negre", "Paper A4", "Tòner", "Cablejat",
+]
+CODIS_POSTALS = ["08001", "08750", "08302", "17001", "25001", "43001", "08202", "08911"]
+
+
+def factura(i, rnd):
+    # Registre sintètic amb les etiquetes del format TXT propi
+    n = rnd.randint(1, 5)
+    return {
+        "Numero de Factura": f"F{i:07d}",
+        "Tipus Factura": rnd.choice(TIPUS),
+        "Pagador": rnd.choice(PAGADORS),
+        "Dades_Pagador": f"Carrer Major {rnd.randint(1, 200)} {rnd.choice(CODIS_POSTALS)} pagador{i}@exemple.cat",
+        "Emisor": rnd.choice(EMISSORS),
+        "Dades_Emisor": f"Avinguda Diagonal {rnd.randint(1, 600)} {rnd.choice(CODIS_POSTALS)}",
+        "Data": f"{rnd.randint(1, 28):02d}-{rnd.randint(1, 12):02d}-{rnd.choice([2023, 2024, 2025])}",
+        "Productes": rnd.sample(PRODUCTES, n),
+        "Imports": [f"{rnd.uniform(1, 900):.2f}" for _ in range(n)],
+    }
+
+
+def linies_factura(f):
+    linies = [f"{clau}: {f[clau]}" for clau in
+              (CAPCALERA_FACTURA, "Tipus Factura", "Pagador", "Dades_Pagador", "Emisor", "Dades_Emisor", "Data")]
+    for k, (producte, imp) in enumerate(zip(f["Productes"], f["Imports"]), start=1):
+        linies.append(f"Producte {k}: {producte}")
+        linies.append(f"Import {k}: {imp}")
+    return linies
+
+
+def factures(n, seed=0, inici=1):
+    rnd = random.Random(seed)
+    return [factura(i, rnd) for i in range(inici, inici + n)]
+
+
+def txt_factures(llista):
+    return ("\n".join("\n".join(linies_factura(f)) for f in llista) + "\n").encode('utf-8')
+
+
+def dataframe_factures(llista):
+    # Les mateixes factures com a files del magatzem (per a proves de magatzem i Dashboard sense parseig)
+    return pd.DataFrame([{
+        "NumeroFactura": f["Numero de Factura"], "TipusFactura": f["Tipus Factura"], "Pagador": f["Pagador"],
+        "AdrecaPagador": f["Dades_Pagador"], "Emisor": f["Emisor"], "AdrecaEmisor": f["Dades_Emisor"],
+        "Data": f["Data"], "Productes": json.dumps(f["Productes"], ensure_ascii=False),
+        "Imports": json.dumps(f["Imports"]),
+    } for f in llista])
+
+
+def _escapa_pdf(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def pdf_amb_text(linies):
+    # PDF d'una pàgina A4 amb capa de text (Helvetica, WinAnsi), com el que genera un programa de facturació
+    contingut = ["BT", "/F1 11 Tf", "15 TL", "50 800 Td"]
+    contingut += [f"({_escapa_pdf(linia)}) Tj T*" for linia in linies]
+    contingut.append("ET")
+    stream = "\n".join(contingut).encode('cp1252', 'replace')
+    objectes = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+    ]
+    sortida = bytearray(b"%PDF-1.4\n")
+    posicions = []
+    for num, objecte in enumerate(objectes, start=1):
+        posicions.append(len(sortida))
+        sortida += b"%d 0 obj\n" % num + objecte + b"\nendobj\n"
+    xref = len(sortida)
+    sortida += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objectes) + 1)
+    sortida += b"".join(b"%010d 00000 n \n" % p for p in posicions)
+    sortida += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objectes) + 1, xref)
+    return bytes(sortida)
+
+
+def imatge_escanejada(linies, rnd=None, amplada=1240, alcada=1754):
+    # PNG d'una factura "escanejada" (A4 a 150 DPI): text negre, lleugera inclinació i soroll
+    from PIL import Image, ImageDraw, ImageFont
+
+    rnd = rnd or random.Random(0)
+    try:
+        font = ImageFont.load_default(size=28)
+    except TypeError:  # Pillow < 10.1
+        font = ImageFont.load_default()
+    imatge = Image.new('L', (amplada, alcada), 255)
+    dibuix = ImageDraw.Draw(imatge)
+    for k, linia in enumerate(linies):
+        dibuix.text((100, 120 + 42 * k), linia, fill=0, font=font)
+    for _ in range(2000):
+        dibuix.point((rnd.randrange(amplada), rnd.randrange(alcada)), fill=rnd.randint(0, 160))
+    imatge = imatge.rotate(rnd.uniform(-2, 2), fillcolor=255)
+    sortida = io.BytesIO()
+    imatge.save(sortida, format='PNG')
+    return sortida.getvalue()
+
+
+class FitxerMemoria(io.BytesIO):
+    # Objecte tipus fitxer amb nom, com l'UploadedFile de Streamlit
+    def __init__(self, dades, name):
+        super().__init__(dades)
+        self.name = name
@@ -0,0 +1,65 @@
+# Servidor HTTP que imita l'API /api/chat d'Ollama per als benchmarks: respon amb els camps de la
+# factura llegits del text del prompt (format TXT propi) després d'una latència configurable.
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from data.txt_invoice import itera_factures
+
+
+MARCA_TEXT = "El text de la factura és:\n"
+
+
+def camps_del_prompt(prompt):
+    text = prompt.split(MARCA_TEXT, 1)[-1]
+    registre = next(itera_factures(text.splitlines()), None) or {}
+    productes = json.loads(registre.get('Productes') or '[]')
+    imports = [f"€{valor}" for valor in json.loads(registre.get('Imports') or '[]')]
+    camps = {c: registre.get(c, '') for c in (
+        "NumeroFactura", "TipusFactura", "Pagador", "AdrecaPagador", "EmailPagador",
+        "Emisor", "AdrecaEmisor", "EmailEmisor", "Data")}
+    camps.update(DadesPagador='', DadesEmisor='', Productes=productes, Imports=imports)
+    return camps
+
+
+class StubOllama:
+    def __init__(self, latencia=0.05, host='127.0.0.1', port=0):
+        self.latencia = latencia
+        self.peticions = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                cos = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                stub.peticions += 1
+                time.sleep(stub.latencia)
+                prompt = cos.get('messages', [{}])[-1].get('content', '')
+                contingut = json.dumps(camps_del_prompt(prompt), ensure_ascii=False)
+                resposta = json.dumps({
+                    "model": cos.get('model', ''), "created_at": "2024-01-01T00:00:00Z",
+                    "message": {"role": "assistant", "content": contingut},
+                    "done": True, "done_reason": "stop",
+                    "prompt_eval_count": len(prompt) // 4, "eval_count": len(contingut) // 4,
+                }).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(resposta)))
+                self.end_headers()
+                self.wfile.write(resposta)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True, name="stub-ollama")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
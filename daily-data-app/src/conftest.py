@@ -0,0 +1 @@
+# Arrel de pytest: els tests importen els mòduls de l'app des d'aquí (data, utils...), com l'app
@@ -0,0 +1,135 @@
+import argparse
+import sys
+import time
+
+import pandas as pd
+
+from data.line_items import linies_de_factures
+from data.store import COLUMNES
+from utils.file_parser import CHUNK_ROWS, blocs_delimitats
+
+
+# Exemples de línies rebutjades que es guarden a l'informe (el total sempre es compta sencer)
+MAX_REBUTJADES = 1000
+MAX_TEXT_REBUTJADA = 200
+
+
+class InformeImportacio:
+    def __init__(self, nom):
+        self.nom = nom
+        self.linies = 0
+        self.importades = 0
+        self.rebutjades = 0
+        self.blocs = 0
+        self.segons = 0.0
+        # [(num_linia, motiu, text)] de les primeres MAX_REBUTJADES línies rebutjades
+        self.exemples = []
+
+    def rebutja(self, num_linia, motiu, camps):
+        self.rebutjades += 1
+        if len(self.exemples) < MAX_REBUTJADES:
+            self.exemples.append((num_linia, motiu, ';'.join(camps)[:MAX_TEXT_REBUTJADA]))
+
+    def rebutjades_df(self):
+        return pd.DataFrame(self.exemples, columns=["Linia", "Motiu", "Contingut"])
+
+    def as_dict(self):
+        return {"Fitxer": self.nom, "Linies": self.linies, "Importades": self.importades,
+                "Rebutjades": self.rebutjades, "Blocs": self.blocs, "Segons": round(self.segons, 2)}
+
+
+def _es_capcalera(camps, columnes):
+    return [c.strip() for c in camps[:len(columnes)]] == list(columnes)
+
+
+def valida_bloc(bloc, informe, columnes=COLUMNES):
+    # Converteix un bloc de (num_linia, camps) en un DataFrame de factures vàlides i
+    # registra a l'informe les línies rebutjades amb el motiu
+    n = len(columnes)
+    bones, nums = [], []
+    for num, camps in bloc:
+        # Tolera un separador sobrant al final de la línia
+        if len(camps) == n + 1 and not camps[-1].strip():
+            camps = camps[:n]
+        if len(camps) != n:
+            if not (num == 1 and _es_capcalera(camps, columnes)):
+                informe.rebutja(num, f"{len(camps)} camps (se n'esperaven {n})", camps)
+            continue
+        if num == 1 and _es_capcalera(camps, columnes):
+            continue
+        bones.append(camps)
+        nums.append(num)
+    informe.linies += len(bloc)
+    if not bones:
+        return pd.DataFrame(columns=list(columnes))
+
+    crues = dict(zip(nums, bones))
+    df = pd.DataFrame(bones, columns=list(columnes), index=nums)
+    df = df.apply(lambda col: col.str.strip())
+    df = df.where(df != '', None)
+    motius = pd.Series(None, index=df.index, dtype=object)
+    motius[df['NumeroFactura'].isna()] = "NumeroFactura buit"
+    # Imports que no es poden convertir a número (es fa el mateix càlcul que en desar les línies)
+    linies = linies_de_factures(df, df.index)
+    ambigues = linies.loc[linies['Revisar'] == 1, 'factura_id'].unique()
+    motius[df.index.isin(ambigues) & motius.isna()] = "Imports ambigus o que no quadren amb els productes"
+    imports_dolents = linies.loc[linies['Import'].isna(), 'factura_id'].unique()
+    motius[df.index.isin(imports_dolents) & motius.isna()] = "Import no numèric"
+    for num in motius.dropna().index:
+        # El text rebutjat és el de la línia original (les cel·les buides del DataFrame poden ser NaN)
+        informe.rebutja(num, motius[num], crues[num])
+    return df[motius.isna()].reset_index(drop=True)
+
+
+def importa_delimitat(store, font, nom=None, fitxers=None, sep=';', chunksize=CHUNK_ROWS, progress=None):
+    # Importa en streaming un fitxer delimitat (export de l'ERP): cada bloc es valida i s'insereix per separat,
+    # de manera que la memòria no creix amb la mida del fitxer. Tot el fitxer es desa en una sola transacció:
+    # si un bloc falla no en queda cap de desat ni el fitxer registrat, i es pot tornar a importar sencer.
+    informe = InformeImportacio(nom or (font if isinstance(font, str) else getattr(font, 'name', '')))
+    inici = time.perf_counter()
+
+    def blocs_valids():
+        for bloc in blocs_delimitats(font, sep=sep, chunksize=chunksize):
+            df = valida_bloc(bloc, informe)
+            informe.blocs += 1
+            informe.importades += len(df)
+            if progress is not None:
+                progress(informe)
+            yield df
+
+    informe.importades = store.append_stream(blocs_valids(), fitxers=fitxers)
+    informe.segons = time.perf_counter() - inici
+    return informe
+
+
+def main(argv=None):
+    # Ús (des de daily-data-app/src): python -m data.csv_import <fitxer> [--sep ;] [--chunksize N]
+    parser = argparse.ArgumentParser(description="Importació en streaming de fitxers delimitats (exports de l'ERP)")
+    parser.add_argument("fitxer", help="Fitxer TXT/CSV amb les columnes de factura en ordre")
+    parser.add_argument("--sep", default=";", help="Separador de camps (per defecte ';')")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_ROWS, help="Files per bloc")
+    parser.add_argument("--rebutjades", default=None, help="Desa les línies rebutjades en aquest CSV")
+    args = parser.parse_args(argv)
+
+    from data.data_manager import DataManager
+    from utils.cache import sha256_fitxer
+
+    dm = DataManager()
+    sha = sha256_fitxer(args.fitxer)
+    if dm.store.known_files([sha]):
+        print(f"El fitxer {args.fitxer} ja s'havia importat.")
+        return 0
+
+    def progress(informe):
+        print(f"[bloc {informe.blocs}] {informe.linies} línies llegides, {informe.rebutjades} rebutjades")
+
+    informe = importa_delimitat(dm.store, args.fitxer, fitxers=[(sha, args.fitxer)], sep=args.sep,
+                                chunksize=args.chunksize, progress=progress)
+    print(f"Importades {informe.importades} factures en {informe.segons:.1f} s; {informe.rebutjades} línies rebutjades.")
+    if args.rebutjades and informe.rebutjades:
+        informe.rebutjades_df().to_csv(args.rebutjades, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,90 +1,145 @@
 import pandas as pd
+import logging
+import math
 import os
+import threading
 import streamlit as st
-import re
-import pdfplumber
-import pytesseract
-from PIL import Image
-import requests
-import pdf2image
-import json, re
-import ollama
+import json
+from data.csv_import import InformeImportacio, importa_delimitat
+from data.extraction import ErrorExtraccio, json_schema, missatges_reintent, parse_resposta, strip_think, valida_camps
+from data.store import COLUMNA_VERSIO, COLUMNES, COLUMNES_DERIVADES, ConflicteEdicio, SQLiteInvoiceStore
+from data.templates import TemplateStore
+from data.txt_invoice import blocs_factures, es_txt_factura, parse_factures_txt
+from data.write_batcher import WriteBatcher
+from utils import llm
+from utils.cache import DiskCache, clau_composta, sha256_bytes, sha256_fitxer
+from utils.ocr import OcrConfig, ocr_imatge, text_pdf
+from utils.telemetria import span
+
+log = logging.getLogger(__name__)
+
+IMAGE_TYPES = ["png", "jpg", "jpeg"]
+EDIT_PAGE_SIZE = 50
+# Bytes de l'inici d'un TXT que es miren per distingir una factura d'un export delimitat
+TXT_CAPCALERA_BYTES = 64 * 1024
+LLM_MODEL = 'deepseek-r1'
+# Cal incrementar-la cada cop que canviï el prompt, per invalidar els resultats LLM en memòria cau
+PROMPT_VERSION = 2
+
+
+class FitxerDuplicat(RuntimeError):
+    pass
 
 
 class DataManager:
-    def __init__(self):
+    def __init__(self, store=None, cache=None, structured=True, ocr_config=None, templates=None):
         self.csv_path = os.path.join(os.path.dirname(__file__), '../registro_total.csv')
-        self.data = self.load_csv()
+        self.db_path = os.path.join(os.path.dirname(__file__), '../registro_total.db')
+        if store is None:
+            store = SQLiteInvoiceStore(self.db_path)
+            # Migració única del CSV antic al magatzem
+            store.migrate_csv(self.csv_path)
+        self.store = store
+        # Un sol escriptor per procés: les insercions concurrents s'agrupen en una transacció
+        self.writer = WriteBatcher(store)
+        # Memòria cau de text OCR (per SHA-256 del fitxer) i de resultats LLM
+        self.cache = cache if cache is not None else DiskCache()
+        # Mode estructurat: sortida JSON restringida per esquema; si és False, es rasca el JSON de text lliure
+        self.structured = structured
+        # Paràmetres d'OCR (DPI, preprocés, fils...); per defecte, els de les variables d'entorn OCR_*
+        self.ocr_config = ocr_config or OcrConfig.from_env()
+        # Plantilles apreses dels emissors recurrents: si n'hi ha una que encaixa, no cal cridar el LLM
+        self.templates = templates if templates is not None else TemplateStore()
+        self._data = None
+        self._lines = None
+        self._versio = None
+        self._lock = threading.Lock()
+        # Mètode d'extracció ('text' o 'ocr') de cada pàgina de l'últim PDF processat
+        self.last_pdf_pages = []
 
-    def load_csv(self):
-        if os.path.exists(self.csv_path):
-            return pd.read_csv(self.csv_path)
-        else:
-            return pd.DataFrame(columns=[
-                "NumeroFactura", "TipusFactura", "Pagador",
-                "DadesPagador", "AdrecaPagador", "EmailPagador",
-                "Emisor", "DadesEmisor", "AdrecaEmisor", "EmailEmisor",
-                "Data", "Productes", "Imports"
-            ])
+    @property
+    def data(self):
+        # Lectura mandrosa: només es llegeix el magatzem quan algú necessita les dades
+        self._refresh()
+        return self._data
+
+    def data_version(self):
+        # Testimoni de versió de les dades: canvia a cada inserció, edició o esborrat
+        return self.store.version()[0]
 
-    def save_csv(self):
-        self.data.to_csv(self.csv_path, index=False)
+    def _refresh(self):
+        with self._lock:
+            versio, versio_destructiva = self.store.version()
+            if self._data is not None and versio == self._versio:
+                return
+            if self._data is not None and versio_destructiva <= self._versio:
+                # Des de l'última lectura només hi ha hagut insercions: es llegeixen només les files noves
+                max_id = int(self._data.index.max()) if not self._data.empty else 0
+                self._data = pd.concat([self._data, self.store.read(since_id=max_id)])
+                self._lines = pd.concat([self._lines, self.store.read_lines(since_id=max_id)], ignore_index=True)
+            else:
+                self._data = self.store.read()
+                self._lines = self.store.read_lines()
+            self._versio = versio
+
+    def append_data(self, new_data, fitxers=None, origens=None):
+        # Afegeix files al magatzem sense reescriure'l; la còpia en memòria s'actualitza a la següent lectura.
+        # Passa per l'escriptor diferit: si altres fils també hi escriuen, es desa tot en un sol commit.
+        # origens: text i mètode d'extracció de cada fila, per aprendre'n la plantilla quan es confirmi a l'editor.
+        ids = self.writer.append(new_data, fitxers=fitxers)
+        if origens:
+            self.templates.record_origins(ids, origens)
+        return ids
 
     def parse_custom_txt(self, uploaded_file):
-        content = uploaded_file.read().decode('utf-8')
-        lines = content.splitlines()
-        data = {}
-        productes = []
-        imports = []
-        for line in lines:
-            if line.startswith('Numero de Factura:'):
-                data['NumeroFactura'] = line.split(':',1)[1].strip()
-            elif line.startswith('Tipus Factura:'):
-                data['TipusFactura'] = line.split(':',1)[1].strip()
-            elif line.startswith('Pagador:'):
-                data['Pagador'] = line.split(':',1)[1].strip()
-            elif line.startswith('Dades_Pagador:'):
-                dades_pagador = line.split(':',1)[1].strip()
-                import re as _re
-                email = _re.search(r'[\w\.-]+@[\w\.-]+', dades_pagador)
-                data['DadesPagador'] = dades_pagador
-                data['AdrecaPagador'] = _re.sub(r'[\w\.-]+@[\w\.-]+', '', dades_pagador).strip()
-                data['EmailPagador'] = email.group(0) if email else ''
-            elif line.startswith('Emisor:'):
-                data['Emisor'] = line.split(':',1)[1].strip()
-            elif line.startswith('Dades_Emisor:'):
-                dades_emisor = line.split(':',1)[1].strip()
-                email = _re.search(r'[\w\.-]+@[\w\.-]+', dades_emisor)
-                data['DadesEmisor'] = dades_emisor
-                data['AdrecaEmisor'] = _re.sub(r'[\w\.-]+@[\w\.-]+', '', dades_emisor).strip()
-                data['EmailEmisor'] = email.group(0) if email else ''
-            elif line.startswith('Data:'):
-                data['Data'] = line.split(':',1)[1].strip()
-            elif re.match(r'Producte \d+:', line):
-                productes.append(line.split(':',1)[1].strip())
-            elif re.match(r'Import \d+:', line):
-                imports.append(line.split(':',1)[1].strip())
-        data['Productes'] = ', '.join(productes)
-        data['Imports'] = ', '.join(imports)
-        # Elimina antics camps plans si existeixen
-        data.pop('DadesPagador', None)
-        data.pop('DadesEmisor', None)
-        return pd.DataFrame([data])
+        # Fitxer TXT amb una o més factures en el format propi ('Numero de Factura: ...'); una fila per factura
+        return pd.DataFrame(list(parse_factures_txt(uploaded_file))).reindex(columns=COLUMNES)
 
-    def load_data_from_txt(self, uploaded_file):
-        content = uploaded_file.read()
+    def es_txt_factura(self, uploaded_file):
+        # Només se'n mira l'inici: els exports delimitats poden ser de diversos GB
+        inici = uploaded_file.read(TXT_CAPCALERA_BYTES)
         uploaded_file.seek(0)
-        if b'Numero de Factura:' in content:
-            uploaded_file.seek(0)
-            new_data = self.parse_custom_txt(uploaded_file)
-        else:
-            uploaded_file.seek(0)
-            new_data = pd.read_csv(uploaded_file, sep=';', names=self.data.columns)
-        self.data = pd.concat([self.data, new_data], ignore_index=True)
-        self.save_csv()
+        return es_txt_factura(inici.decode('utf-8', errors='replace'))
 
-    def extract_fields_llm(self, input_data):
-        # Extracció de camps amb Ollama local i prompt enriquit
+    def parse_txt(self, uploaded_file):
+        # TXT amb el format de factura propi o bé CSV separat per ';'
+        if self.es_txt_factura(uploaded_file):
+            return self.parse_custom_txt(uploaded_file)
+        return pd.read_csv(uploaded_file, sep=';', names=COLUMNES)
+
+    def import_delimited(self, uploaded_file, fitxers=None, progress=None):
+        # Importació en streaming per blocs (validats un a un i desats en una sola transacció); retorna l'informe amb les línies rebutjades
+        return importa_delimitat(self.store, uploaded_file, fitxers=fitxers, progress=progress)
+
+    def load_data_from_txt(self, uploaded_file):
+        self.append_data(self.parse_txt(uploaded_file))
+
+    def ocr_cache_key(self, sha):
+        # El text OCR depèn del fitxer i dels paràmetres d'OCR amb què s'ha obtingut
+        return clau_composta(sha, self.ocr_config.clau())
+
+    def extract_text(self, dades, file_type):
+        # Text d'un PDF o imatge, reutilitzant el de la memòria cau si el fitxer ja s'havia processat
+        if file_type == "txt":
+            return dades.decode('utf-8')
+        clau = self.ocr_cache_key(sha256_bytes(dades))
+        cached = self.cache.get('ocr', clau)
+        if cached is not None:
+            log.info("Text recuperat de la memòria cau")
+            self.last_pdf_pages = cached['pagines']
+            return cached['text']
+        with span("extraccio_text", tipus=file_type, bytes=len(dades)) as atributs:
+            if file_type == "pdf":
+                text, pagines = text_pdf(dades, self.ocr_config)
+            else:
+                text, pagines = ocr_imatge(dades, self.ocr_config), ['ocr']
+            atributs.update(pagines=len(pagines), ocr=pagines.count('ocr'), caracters=len(text))
+        self.cache.set('ocr', clau, {'text': text, 'pagines': pagines})
+        self.last_pdf_pages = pagines
+        return text
+
+    def llm_messages(self, input_data):
+        # Missatges del prompt d'extracció (si es modifica, cal incrementar PROMPT_VERSION)
         prompt = (
             "Ets un assistent expert en facturació. Analitza el següent text extret d'una factura (pot contenir errors d'OCR o estar desordenat). "
             "Extreu els següents camps en format JSON, amb aquestes claus exactes i seguint aquestes instruccions:\n"
@@ -103,101 +158,246 @@ class DataManager:
             "- Imports: Una llista plana, separada per comes, amb l’import corresponent a cada producte o servei, en el mateix ordre que a Productes, com a exemple de resultat: ['€85.00','€34.00' ... ] . ÉS IMPORTANT QUE ELS IMPORTS APAREGUIN AMB SÍMBOL CORRESPONENT DE MONEDA, € $ O £ davant de l'import, ja que mes endevant es fara una conversió\n"
             "El text de la factura és:\n" + input_data
         )
-        try:
-            print("[Ollama] Enviant prompt a model local deepseek...")
-            response = ollama.chat(
-                model='deepseek-r1',
-                messages=[
-                    {'role': 'system', 'content': 'Ets un assistent expert en facturació.'},
-                    {'role': 'user', 'content': prompt}
-                ]
-            )
-            resposta = response['message']['content']
-            self.last_llm_response = resposta
-            print("[Ollama] Resposta content:", resposta)
+        return [
+            {'role': 'system', 'content': 'Ets un assistent expert en facturació.'},
+            {'role': 'user', 'content': prompt}
+        ]
+
+    def llm_cache_key(self, input_data):
+        return clau_composta(PROMPT_VERSION, LLM_MODEL, self.structured, input_data)
+
+    def llm_request(self, input_data, falten=None):
+        # Arguments de ollama.chat; en mode estructurat la sortida es restringeix a un esquema JSON
+        if falten:
+            return {'model': LLM_MODEL, 'messages': missatges_reintent(input_data, falten),
+                    'format': json_schema(falten), 'options': {'temperature': 0}}
+        request = {'model': LLM_MODEL, 'messages': self.llm_messages(input_data)}
+        if self.structured:
+            request.update(format=json_schema(), options={'temperature': 0})
+        return request
+
+    def parse_llm_response(self, resposta, camps=None):
+        # Retorna (camps, falten); falten són els camps obligatoris que cal tornar a demanar
+        self.last_llm_response = resposta
+        with span("parse_json", bytes=len(resposta or ''), estructurat=self.structured) as atributs:
+            if self.structured:
+                fields, falten = valida_camps(parse_resposta(resposta), camps)
+                atributs["falten"] = len(falten)
+                return fields, falten
             fields = parse_json_robust(resposta)
-            if fields:
-                print("[Ollama] JSON robust trobat:", fields)
-            else:
-                print("[Ollama] No s'ha pogut parsejar JSON robustament!")
-                fields = dict.fromkeys([
-                    "NumeroFactura", "TipusFactura", "Pagador", "DadesPagador", "AdrecaPagador", "EmailPagador",
-                    "Emisor", "DadesEmisor", "AdrecaEmisor", "EmailEmisor", "Data", "Productes", "Imports"
-                ], '')
+            atributs["falten"] = 0 if fields else len(COLUMNES)
+        if fields:
+            return fields, []
+        log.warning("No s'ha pogut parsejar el JSON de la resposta")
+        return dict.fromkeys(COLUMNES, ''), []
+
+    def merge_missing(self, fields, extra):
+        # Completa només els camps buits amb la resposta del reintent
+        fields.update({k: v for k, v in extra.items() if v})
+        return fields
+
+    def cache_fields(self, clau, fields):
+        if any(fields.values()):
+            self.cache.set('llm', clau, fields)
+
+    def llm_chat(self, request):
+        # Una petició a Ollama amb el seu span (model, mida del prompt i tokens)
+        with span("llm_peticio", model=request['model'], bytes_prompt=sum(len(m['content']) for m in request['messages']),
+                  camps=len(request.get('format', {}).get('properties', {}))) as atributs:
+            response = llm.chat(**request)
+            atributs.update(tokens_prompt=response.get('prompt_eval_count'), tokens_resposta=response.get('eval_count'))
+        return response['message']['content']
+
+    def extract_fields_llm(self, input_data):
+        # Extracció de camps amb Ollama local i prompt enriquit; llença ErrorExtraccio si no se n'obté cap camp
+        clau = self.llm_cache_key(input_data)
+        cached = self.cache.get('llm', clau)
+        if cached is not None:
+            log.info("Camps recuperats de la memòria cau")
+            return pd.DataFrame([cached])
+        try:
+            fields, falten = self.parse_llm_response(self.llm_chat(self.llm_request(input_data)))
+            if falten:
+                # Només es tornen a demanar els camps que falten, no tot el prompt
+                log.info("Falten camps, es tornen a demanar: %s", falten)
+                extra, _ = self.parse_llm_response(self.llm_chat(self.llm_request(input_data, falten)), falten)
+                self.merge_missing(fields, extra)
+            self.cache_fields(clau, fields)
         except Exception as e:
-            print("[Ollama] Error Ollama:", e)
+            log.warning("Error d'Ollama: %s", e)
             self.last_llm_response = str(e)
-            fields = dict.fromkeys([
-                "NumeroFactura", "TipusFactura", "Pagador", "DadesPagador", "AdrecaPagador", "EmailPagador",
-                "Emisor", "DadesEmisor", "AdrecaEmisor", "EmailEmisor", "Data", "Productes", "Imports"
-            ], '')
-        print("[Ollama] Camps extrets:", fields)
+            raise ErrorExtraccio(f"No s'han pogut extreure els camps de la factura: {e}") from e
+        if not any(fields.values()):
+            raise ErrorExtraccio("El model no ha retornat cap camp de la factura.")
+        log.debug("Camps extrets: %s", fields)
         return pd.DataFrame([fields])
-        # --- FI: Extracció de camps amb Ollama local ---
 
-    def parse_invoice_ai(self, uploaded_file, file_type):
-        print(f"parse_invoice_ai: file_type={file_type}")
-        if file_type == "pdf":
-            # Convertim el PDF a imatges i fem OCR per obtenir el text
-            images = pdf2image.convert_from_bytes(uploaded_file.read())
-            text = "\n".join([pytesseract.image_to_string(img, lang='cat+spa+eng') for img in images])
-            print(f"parse_invoice_ai: PDF convertit a text, longitud: {len(text)}")
-            result = self.extract_fields_llm(text)
-        elif file_type in ["png", "jpg", "jpeg"]:
-            image = Image.open(uploaded_file)
-            print("parse_invoice_ai: Imatge carregada")
-            text = pytesseract.image_to_string(image, lang='cat+spa+eng')
-            result = self.extract_fields_llm(text)
-        elif file_type == "txt":
-            text = uploaded_file.read().decode('utf-8')
-            print(f"parse_invoice_ai: TXT carregat, longitud text: {len(text)}")
-            result = self.extract_fields_llm(text)
+    def extract_fields_template(self, input_data):
+        # Camps extrets amb la plantilla de l'emissor (sense LLM); None si no n'hi ha cap o no valida
+        with span("plantilla", caracters=len(input_data or '')) as atributs:
+            fields, clau = self.templates.extract(input_data)
+            atributs.update(resultat="encert" if fields is not None else "fallada", plantilla=clau)
+        return fields
+
+    def extract_fields(self, input_data):
+        # Primer la plantilla de l'emissor; el LLM només si no n'hi ha cap o el resultat no valida.
+        # El text i el mètode queden a attrs['origen'] per passar-los a append_data.
+        fields = self.extract_fields_template(input_data)
+        if fields is not None:
+            log.info("Camps extrets amb plantilla")
+            new_data, metode = pd.DataFrame([fields]), 'plantilla'
         else:
-            print(f"parse_invoice_ai: Tipus de fitxer no suportat: {file_type}")
-            return pd.DataFrame([dict.fromkeys([
-                "NumeroFactura", "TipusFactura", "Pagador", "DadesPagador", "AdrecaPagador", "EmailPagador",
-                "Emisor", "DadesEmisor", "AdrecaEmisor", "EmailEmisor", "Data", "Productes", "Imports"
-            ], '')])
-        print(f"parse_invoice_ai: resultat extract_fields_llm: {result}")
-        return result
+            new_data, metode = self.extract_fields_llm(input_data), 'llm'
+        new_data.attrs['origen'] = {'text': input_data, 'metode': metode}
+        return new_data
+
+    def read_upload(self, uploaded_file):
+        with span("lectura", fitxer=getattr(uploaded_file, 'name', None)) as atributs:
+            dades = uploaded_file.read()
+            atributs["bytes"] = len(dades)
+        return dades
+
+    def parse_invoice_ai(self, uploaded_file, file_type):
+        if file_type not in IMAGE_TYPES + ["pdf", "txt"]:
+            log.warning("Tipus de fitxer no suportat: %s", file_type)
+            raise ErrorExtraccio(f"Tipus de fitxer no suportat: {file_type}")
+        # PDF: primer la capa de text; només es fa OCR de les pàgines sense text
+        text = self.extract_text(self.read_upload(uploaded_file), file_type)
+        log.info("%s convertit a text: %d caràcters, pàgines: %s", file_type.upper(), len(text), self.last_pdf_pages)
+        return self.extract_fields(text)
+
+    def check_duplicate(self, uploaded_file):
+        # Detecta fitxers ja ingerits abans de fer cap OCR ni crida al LLM; retorna (sha256, nom)
+        sha = sha256_fitxer(uploaded_file)
+        nom = getattr(uploaded_file, 'name', sha[:12])
+        if self.store.known_files([sha]):
+            raise FitxerDuplicat(f"El fitxer {nom} ja s'havia carregat; no es torna a processar.")
+        return sha, nom
+
+    def enqueue_extraction(self, uploaded_file, file_type, queue):
+        # Fa l'OCR ara i envia l'extracció LLM a la cua asíncrona; retorna l'id de la feina
+        sha, nom = self.check_duplicate(uploaded_file)
+        text = self.extract_text(self.read_upload(uploaded_file), file_type)
+        return queue.submit(text, nom=nom, sha=sha)
+
+    def load_txt(self, uploaded_file, fitxers=None):
+        # TXT de factures (format propi) o export delimitat, desat per blocs en una sola transacció (tot o res).
+        # Retorna l'informe de la importació delimitada o el nombre de factures desades.
+        # El fan servir tant la càrrega individual com la ingesta per lots.
+        if not self.es_txt_factura(uploaded_file):
+            informe = self.import_delimited(uploaded_file, fitxers=fitxers)
+            log.info("Importació delimitada: %s", informe.as_dict())
+            return informe
+        total = self.store.append_stream(blocs_factures(uploaded_file), fitxers=fitxers)
+        log.info("%d factures TXT desades al magatzem", total)
+        return total
 
     def load_data_from_any(self, uploaded_file, file_type):
-        print(f"load_data_from_any: file_type={file_type}")
+        sha, nom = self.check_duplicate(uploaded_file)
         if file_type == "txt":
-            content = uploaded_file.read()
-            uploaded_file.seek(0)
-            if b'Numero de Factura:' in content:
-                uploaded_file.seek(0)
-                new_data = self.parse_custom_txt(uploaded_file)
-            else:
-                uploaded_file.seek(0)
-                new_data = pd.read_csv(uploaded_file, sep=';', names=self.data.columns)
-            print(f"load_data_from_any: new_data={new_data}")
-            self.data = pd.concat([self.data, new_data], ignore_index=True)
-            self.save_csv()
-            print("load_data_from_any: dades desades al CSV")
-            return self.data
+            resultat = self.load_txt(uploaded_file, fitxers=[(sha, nom)])
+            return resultat if isinstance(resultat, InformeImportacio) else self.data
         else:
             new_data = self.parse_invoice_ai(uploaded_file, file_type)
-            print(f"load_data_from_any: new_data={new_data}")
-            self.data = pd.concat([self.data, new_data], ignore_index=True)
-            self.save_csv()
-            print("load_data_from_any: dades desades al CSV")
+            self.append_data(new_data, fitxers=[(sha, nom)], origens=[new_data.attrs.get('origen')])
+            log.info("%d factures desades al magatzem", len(new_data))
             return self.data
 
-    def edit_data(self):
-        # Permet editar i esborrar files directament amb Streamlit Data Editor
-        edited_df = st.data_editor(self.data, num_rows="dynamic", use_container_width=True, key="data_editor")
-        if st.button("Desa canvis al CSV"):
-            self.data = edited_df.reset_index(drop=True)
-            self.save_csv()
-            st.success("Canvis desats correctament!")
+    def edit_data(self, page_size=EDIT_PAGE_SIZE):
+        # Permet editar i esborrar files directament amb Streamlit Data Editor.
+        # Només s'envia al navegador la pàgina visible i només se'n desen les files canviades.
+        total = len(self.data)
+        pagines = max(1, math.ceil(total / page_size))
+        if st.session_state.get("data_editor_pagina", 1) > pagines:
+            st.session_state["data_editor_pagina"] = pagines
+        pagina = st.number_input("Pàgina", min_value=1, max_value=pagines, value=1, step=1, key="data_editor_pagina")
+        inici = (pagina - 1) * page_size
+        # Els canvis de l'editor són posicionals respecte de la pàgina que es va mostrar: mentre n'hi ha de pendents,
+        # es torna a mostrar la mateixa foto (ids i VersioFila inclosos) encara que una altra sessió hagi canviat
+        # les dades, i els canvis i les versions que es desen surten d'aquesta foto. Desar o recarregar la renova.
+        clau = f"data_editor_{pagina}_{st.session_state.get('data_editor_revisio', 0)}"
+        canvis = st.session_state.get(clau) or {}
+        if clau in st.session_state.get("data_editor_fotos", {}) and any(
+                canvis.get(k) for k in ("edited_rows", "added_rows", "deleted_rows")):
+            original = st.session_state["data_editor_fotos"][clau]
+        else:
+            original = self.data.iloc[inici:inici + page_size]
+            st.session_state.setdefault("data_editor_fotos", {})[clau] = original
+        st.caption(f"Factures {min(inici + 1, total)}-{inici + len(original)} de {total}")
+        edited_df = st.data_editor(original, num_rows="dynamic", use_container_width=True, key=clau,
+                                   disabled=list(COLUMNES_DERIVADES) + [COLUMNA_VERSIO])
+        col_desa, col_recarrega = st.columns(2)
+        with col_desa:
+            desa = st.button("Desa canvis")
+        with col_recarrega:
+            if st.button("Descarta els canvis i recarrega"):
+                self._renova_editor()
+                st.rerun()
+        if desa:
+            try:
+                apreses = self.save_edits(original, edited_df)[3]
+                st.success("Canvis desats correctament!" + (f" Plantilles apreses: {apreses}." if apreses else ""))
+                self._renova_editor()
+            except ConflicteEdicio as e:
+                st.error(str(e))
+
+    def _renova_editor(self):
+        # Un editor nou (clau nova) sense canvis pendents: la propera execució torna a llegir la pàgina
+        st.session_state["data_editor_revisio"] = st.session_state.get("data_editor_revisio", 0) + 1
+        st.session_state.pop("data_editor_fotos", None)
+
+    def save_edits(self, original, edited_df):
+        # Escriu només les diferències (files esborrades, modificades i noves) en una sola transacció.
+        # original és la pàgina tal com es va mostrar a l'editor (la foto d'edit_data, no una lectura nova): cada fila
+        # porta la versió amb què es va llegir i, si una altra sessió l'ha canviada mentrestant,
+        # store.apply_edits llença ConflicteEdicio i no es desa res.
+        ids_originals = set(original.index)
+        es_existent = [pd.notnull(i) and i in ids_originals for i in edited_df.index]
+        existents = edited_df[es_existent].reindex(columns=COLUMNES)
+        noves = edited_df[[not e for e in es_existent]]
+        esborrats = ids_originals - set(existents.index)
+        abans = original.loc[existents.index, COLUMNES].fillna('').astype(str)
+        canviats = existents[(abans != existents.fillna('').astype(str)).any(axis=1)]
+        versions = None
+        if COLUMNA_VERSIO in original.columns:
+            versions = original[COLUMNA_VERSIO].to_dict()
+            canviats = canviats.assign(**{COLUMNA_VERSIO: original.loc[canviats.index, COLUMNA_VERSIO]})
+        self.store.apply_edits(esborrats=esborrats, actualitzades=canviats,
+                               noves=noves, versions=versions)
+        apreses = self.learn_templates(self.templates.take_origins(ids_originals), existents, canviats.index)
+        return len(esborrats), len(canviats), len(noves), apreses
+
+    def learn_templates(self, origens, confirmades, corregides):
+        # Desar la pàgina de l'editor confirma les factures que hi queden: se n'aprèn la plantilla de l'emissor
+        # a partir del text d'origen. Les extretes amb plantilla només es tornen a aprendre si s'han corregit.
+        apreses = 0
+        for factura_id, origen in origens.items():
+            if factura_id not in confirmades.index:
+                continue
+            if origen['metode'] == 'plantilla' and factura_id not in corregides:
+                continue
+            try:
+                if self.templates.learn(origen['text'], confirmades.loc[factura_id].to_dict()):
+                    apreses += 1
+            except Exception as e:
+                log.warning("No s'ha pogut aprendre la plantilla de la factura %s: %s", factura_id, e)
+        return apreses
 
     def get_data(self):
         return self.data
 
+    def get_summary(self, mes_inici=None, mes_final=None):
+        # Resum Mes × TipusFactura × Emisor que el magatzem actualitza a cada inserció, edició o esborrat
+        return self.store.read_summary(mes_inici, mes_final)
+
+    def get_lines(self):
+        # Línies de factura normalitzades (factura_id, posicio, Producte, Import, Moneda, ImportBase)
+        self._refresh()
+        return self._lines
+
 def parse_json_robust(text):
-    # Busca el primer bloc JSON balancejat
+    # Busca el primer bloc JSON balancejat (ignorant el bloc <think> dels models de raonament)
+    text = strip_think(text)
     stack = []
     start = None
     for i, c in enumerate(text):
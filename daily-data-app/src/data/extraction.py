@@ -0,0 +1,102 @@
+import json
+import re
+
+from data.line_items import SEPARADOR_LLISTA, parse_imports
+from data.store import COLUMNES
+from utils.amounts import parse_amounts
+
+
+# Camps de llista: el model els retorna com a arrays JSON i es desen com a llista serialitzada
+CAMPS_LLISTA = ["Productes", "Imports"]
+# Camps sense els quals la factura no és útil; si falten es tornen a demanar al model
+CAMPS_OBLIGATORIS = ["NumeroFactura", "Emisor", "Data", "Productes", "Imports"]
+
+THINK_RE = re.compile(r'<think>.*?(</think>|$)', re.S)
+
+
+class ErrorExtraccio(RuntimeError):
+    # El LLM no ha retornat cap camp: la factura no es desa ni el fitxer es registra, i es pot tornar a pujar
+    pass
+
+
+def json_schema(camps=None):
+    # Esquema JSON per al paràmetre format= d'Ollama (sortida restringida a aquest esquema)
+    camps = list(camps or COLUMNES)
+    propietats = {}
+    for camp in camps:
+        if camp in CAMPS_LLISTA:
+            propietats[camp] = {"type": "array", "items": {"type": "string"}}
+        else:
+            propietats[camp] = {"type": "string"}
+    return {"type": "object", "properties": propietats, "required": camps}
+
+
+def strip_think(text):
+    # Els models de raonament (deepseek-r1) inclouen un bloc <think>...</think> abans de la resposta
+    return THINK_RE.sub('', text or '').strip()
+
+
+def parse_resposta(resposta):
+    # La sortida amb esquema és JSON directe; si no ho és, es busca el primer objecte JSON
+    text = strip_think(resposta)
+    try:
+        obj = json.loads(text)
+    except ValueError:
+        inici, final = text.find('{'), text.rfind('}')
+        if inici < 0 or final <= inici:
+            return {}
+        try:
+            obj = json.loads(text[inici:final + 1])
+        except ValueError:
+            return {}
+    return obj if isinstance(obj, dict) else {}
+
+
+def _llista(valor):
+    if isinstance(valor, list):
+        return [str(v).strip() for v in valor if str(v).strip()]
+    if valor is None:
+        return []
+    return [p.strip() for p in SEPARADOR_LLISTA.split(str(valor)) if p.strip()]
+
+
+def valida_camps(obj, camps=None):
+    # Converteix la resposta en un registre amb tots els camps tipats com a text.
+    # Retorna (camps, falten): falten són els obligatoris buits o invàlids.
+    camps = list(camps or COLUMNES)
+    registre = {}
+    ambigus = False
+    for camp in camps:
+        valor = obj.get(camp)
+        if camp == 'Imports' and isinstance(valor, str):
+            # Imports en text: se separen segons el nombre de productes; si és ambigu, es tornen a demanar
+            imports, segur = parse_imports(valor, len(registre.get('Productes') or []) or None)
+            registre[camp], ambigus = [i for i in imports if i], not segur
+        elif camp in CAMPS_LLISTA:
+            registre[camp] = _llista(valor)
+        elif isinstance(valor, (dict, list)):
+            registre[camp] = json.dumps(valor, ensure_ascii=False)
+        else:
+            registre[camp] = '' if valor is None else str(valor).strip()
+    falten = [c for c in camps if c in CAMPS_OBLIGATORIS and not registre[c]]
+    if 'Imports' in camps and registre['Imports']:
+        valors = parse_amounts(registre['Imports'])['Import']
+        if valors.isna().any() or ambigus:
+            falten.append('Imports')
+    for camp in CAMPS_LLISTA:
+        if camp in registre:
+            registre[camp] = json.dumps(registre[camp], ensure_ascii=False) if registre[camp] else ''
+    return registre, falten
+
+
+def missatges_reintent(text, falten):
+    # Prompt curt que demana només els camps que han faltat a la primera resposta
+    prompt = (
+        "Del següent text d'una factura, extreu NOMÉS aquests camps en format JSON: " + ", ".join(falten) + ".\n"
+        "Productes i Imports són llistes en el mateix ordre; cada import porta el símbol de moneda (€, $ o £) davant.\n"
+        "El text de la factura és:\n" + text
+    )
+    return [
+        {'role': 'system', 'content': 'Ets un assistent expert en facturació.'},
+        {'role': 'user', 'content': prompt}
+    ]
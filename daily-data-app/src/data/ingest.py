@@ -0,0 +1,200 @@
+import argparse
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from data.csv_import import InformeImportacio
+from utils.cache import sha256_bytes
+from utils.ocr import llegeix_font, ocr_imatge, pdf_num_pagines, text_pagina_pdf
+
+
+EXTENSIONS = ("txt", "pdf", "png", "jpg", "jpeg")
+
+
+def tipus_fitxer(nom):
+    return nom.rsplit('.', 1)[-1].lower() if '.' in nom else ''
+
+
+def recull_fitxers(rutes):
+    # Expandeix directoris (recursivament) i filtra per extensions suportades
+    fitxers = []
+    for ruta in rutes:
+        if os.path.isdir(ruta):
+            for arrel, _, noms in os.walk(ruta):
+                for nom in sorted(noms):
+                    if tipus_fitxer(nom) in EXTENSIONS:
+                        fitxers.append(os.path.join(arrel, nom))
+        elif tipus_fitxer(ruta) in EXTENSIONS:
+            fitxers.append(ruta)
+    return fitxers
+
+
+class ResultatFitxer:
+    def __init__(self, nom):
+        self.nom = nom
+        self.tipus = tipus_fitxer(nom)
+        self.estat = "pendent"
+        self.error = None
+        self.files = 0
+        self.segons = 0.0
+        # Mètode d'extracció de cada pàgina ('text' incrustat o 'ocr')
+        self.metodes = {}
+
+    def as_dict(self):
+        return {"Fitxer": self.nom, "Tipus": self.tipus, "Estat": self.estat,
+                "Factures": self.files, "Segons": round(self.segons, 2),
+                "Pagines": ", ".join(f"{p}:{m}" for p, m in sorted(self.metodes.items())),
+                "Error": self.error or ""}
+
+
+class BatchIngestor:
+    # Ingesta per lots: l'extracció de text (capa de text o OCR) de totes les pàgines es reparteix en un pool de processos,
+    # l'extracció de camps es fa per fitxer i tot es desa al magatzem d'una sola escriptura.
+    def __init__(self, data_manager, max_workers=None, progress=None):
+        self.data_manager = data_manager
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # progress(resultat, fets, total) es crida cada cop que un fitxer acaba (bé o malament)
+        self.progress = progress
+
+    def _avisa(self, resultat, fets, total):
+        if self.progress is not None:
+            self.progress(resultat, fets, total)
+
+    def run(self, fonts):
+        # fonts: rutes de fitxer o objectes tipus fitxer amb atribut .name (UploadedFile)
+        fonts = list(fonts)
+        resultats = [ResultatFitxer(f if isinstance(f, str) else f.name) for f in fonts]
+        total = len(fonts)
+        fets = 0
+        inici = [time.perf_counter()] * total
+        frames = []
+        ingerits = []
+        hashes = [None] * total
+        vistos = set()
+        # Textos OCR per fitxer (índex): {pagina: text}
+        textos = {}
+        pagines_pendents = {}
+        cache = self.data_manager.cache
+        config = self.data_manager.ocr_config
+
+        def acaba(i, new_data=None, error=None, desades=None):
+            # desades: factures que ja s'han desat pel camí dels TXT (no s'afegeixen a l'escriptura final)
+            nonlocal fets
+            res = resultats[i]
+            res.segons = time.perf_counter() - inici[i]
+            if error is not None:
+                res.estat, res.error = "error", str(error)
+            elif desades is not None:
+                res.estat, res.files = "ok", desades
+            elif new_data is None:
+                res.estat = "duplicat"
+            else:
+                res.estat, res.files = "ok", len(new_data)
+                frames.append(new_data)
+                ingerits.append((hashes[i], res.nom))
+            fets += 1
+            self._avisa(res, fets, total)
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            futurs = {}
+            for i, font in enumerate(fonts):
+                inici[i] = time.perf_counter()
+                tipus = resultats[i].tipus
+                try:
+                    dades = llegeix_font(font)
+                    hashes[i] = sha256_bytes(dades)
+                    # Duplicats: ja ingerits abans o repetits dins del mateix lot
+                    if hashes[i] in vistos or self.data_manager.store.known_files([hashes[i]]):
+                        acaba(i)
+                        continue
+                    vistos.add(hashes[i])
+                    if tipus == "txt":
+                        # Mateix carregador que la pujada individual: blocs, validació i informe de rebutjades
+                        resultat = self.data_manager.load_txt(io.BytesIO(dades), fitxers=[(hashes[i], resultats[i].nom)])
+                        if isinstance(resultat, InformeImportacio):
+                            if resultat.rebutjades:
+                                resultats[i].error = f"{resultat.rebutjades} línies rebutjades"
+                            resultat = resultat.importades
+                        acaba(i, desades=resultat)
+                        continue
+                    cached = cache.get('ocr', self.data_manager.ocr_cache_key(hashes[i]))
+                    if cached is not None:
+                        resultats[i].metodes = dict(enumerate(cached['pagines'], start=1))
+                        acaba(i, self.data_manager.extract_fields(cached['text']))
+                        continue
+                    # Les fonts que no són rutes es passen als processos com a bytes
+                    font_pool = font if isinstance(font, str) else dades
+                    if tipus == "pdf":
+                        n = pdf_num_pagines(font_pool)
+                        pagines_pendents[i] = n
+                        textos[i] = {}
+                        for pagina in range(1, n + 1):
+                            futurs[pool.submit(text_pagina_pdf, font_pool, pagina, config)] = (i, pagina)
+                    elif tipus in EXTENSIONS:
+                        pagines_pendents[i] = 1
+                        textos[i] = {}
+                        futurs[pool.submit(ocr_imatge, font_pool, config)] = (i, 1)
+                    else:
+                        acaba(i, error=f"Tipus de fitxer no suportat: {tipus}")
+                except Exception as e:
+                    acaba(i, error=e)
+
+            for futur in as_completed(futurs):
+                i, pagina = futurs[futur]
+                if resultats[i].estat == "error":
+                    continue
+                try:
+                    if resultats[i].tipus == "pdf":
+                        textos[i][pagina], resultats[i].metodes[pagina] = futur.result()
+                    else:
+                        textos[i][pagina], resultats[i].metodes[pagina] = futur.result(), 'ocr'
+                except Exception as e:
+                    acaba(i, error=e)
+                    continue
+                pagines_pendents[i] -= 1
+                if pagines_pendents[i] == 0:
+                    text = "\n".join(textos[i][p] for p in sorted(textos[i]))
+                    metodes = [resultats[i].metodes[p] for p in sorted(textos[i])]
+                    cache.set('ocr', self.data_manager.ocr_cache_key(hashes[i]), {'text': text, 'pagines': metodes})
+                    try:
+                        acaba(i, self.data_manager.extract_fields(text))
+                    except Exception as e:
+                        acaba(i, error=e)
+
+        if frames:
+            # Text d'origen de cada fila extreta (les dels TXT no en tenen): les plantilles s'aprenen en confirmar-les
+            origens = [f.attrs.get('origen') for f in frames for _ in range(len(f))]
+            self.data_manager.append_data(pd.concat(frames, ignore_index=True), fitxers=ingerits, origens=origens)
+        return [res.as_dict() for res in resultats]
+
+
+def main(argv=None):
+    # Ús (des de daily-data-app/src): python -m data.ingest <directori o fitxers...> [--workers N]
+    parser = argparse.ArgumentParser(description="Ingesta per lots de factures (TXT, PDF i imatges)")
+    parser.add_argument("rutes", nargs="+", help="Fitxers o directoris a processar")
+    parser.add_argument("--workers", type=int, default=None, help="Processos d'OCR (per defecte, nuclis de la CPU)")
+    args = parser.parse_args(argv)
+
+    from data.data_manager import DataManager
+
+    fitxers = recull_fitxers(args.rutes)
+    if not fitxers:
+        print("No s'ha trobat cap fitxer compatible.")
+        return 1
+
+    def progress(res, fets, total):
+        detall = f"{res.files} factures" if res.estat == "ok" else f"ERROR: {res.error}"
+        print(f"[{fets}/{total}] {res.nom} ({res.segons:.1f} s) {detall}")
+
+    informe = BatchIngestor(DataManager(), max_workers=args.workers, progress=progress).run(fitxers)
+    errors = [r for r in informe if r["Estat"] == "error"]
+    print(f"Processats {len(informe)} fitxers, {len(errors)} amb errors.")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
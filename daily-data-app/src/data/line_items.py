@@ -0,0 +1,139 @@
+import ast
+import json
+import re
+import unicodedata
+from itertools import zip_longest
+
+import pandas as pd
+
+from utils.amounts import parse_amounts
+
+
+# Import és en la moneda original de la línia; ImportBase, convertit a la moneda base (utils.currency).
+# Revisar = 1 si els imports de la factura no es poden separar sense ambigüitat o no quadren amb els productes.
+LINE_COLUMNS = ["factura_id", "posicio", "Producte", "ProducteNorm", "Import", "Moneda", "ImportBase", "Revisar"]
+# Separador de les llistes en text: una coma que no és entre dues xifres ("1.234,56 €" i "12,5" són un sol import)
+SEPARADOR_LLISTA = re.compile(r',(?!\d)|(?<!\d),')
+# Un import sol, sense moneda ni espais: enter, amb 1-2 decimals o amb separadors de milers
+IMPORT_SOL_RE = re.compile(
+    r'-?(?:\d+(?:[.,]\d{1,2})?|\d+\.\d+|\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?|\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?)'
+)
+SENSE_MONEDA_RE = re.compile(r'[€$£\s]|EUR|USD|GBP', re.I)
+
+
+def normalitza_producte(nom):
+    # Clau de l'índex de productes: minúscules, sense accents i amb espais col·lapsats
+    text = unicodedata.normalize('NFKD', str(nom or ''))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def parse_llista(valor):
+    # Accepta llistes, cadenes tipus "['a', 'b']" (camí LLM) i cadenes separades per comes (camí TXT)
+    if isinstance(valor, (list, tuple)):
+        return [str(v).strip() for v in valor]
+    if valor is None or (isinstance(valor, float) and pd.isna(valor)):
+        return []
+    text = str(valor).strip()
+    if not text:
+        return []
+    if text.startswith('['):
+        for parser in (json.loads, ast.literal_eval):
+            try:
+                return [str(v).strip() for v in parser(text)]
+            except Exception:
+                continue
+    return [p.strip() for p in SEPARADOR_LLISTA.split(text) if p.strip()]
+
+
+def _import_sol(text):
+    return IMPORT_SOL_RE.fullmatch(SENSE_MONEDA_RE.sub('', text)) is not None
+
+
+def parse_imports(valor, n=None):
+    # Llista d'imports i si la separació és segura. En text, una coma entre dues xifres pot ser decimal o separador
+    # ("10,20" són 10,20 € o 10 € i 20 €): es tria l'única manera de fer n imports vàlids, on n és el nombre de
+    # productes. Si no n'hi ha exactament una (o no se sap n), no s'endevina: es retorna False per revisar-la.
+    if not isinstance(valor, str) or valor.strip().startswith('['):
+        return parse_llista(valor), True
+    trossos = [t.strip() for t in valor.strip().strip(',').split(',')]
+    opcionals = [bool(re.search(r'\d$', a)) and bool(re.match(r'\d', b)) for a, b in zip(trossos, trossos[1:])]
+    if not any(opcionals):
+        return parse_llista(valor), True
+    if not n:
+        return parse_llista(valor), False
+    maneres = {}
+
+    def parteix(i, k):
+        # (maneres fins a 2, final del primer import) de partir trossos[i:] en k imports vàlids
+        if (i, k) in maneres:
+            return maneres[(i, k)]
+        resultat = (int(i == len(trossos) and k == 0), None)
+        if i < len(trossos) and k > 0:
+            total, primer = 0, None
+            for j in range(i + 1, len(trossos) + 1):
+                if _import_sol(','.join(trossos[i:j])):
+                    resta, _ = parteix(j, k - 1)
+                    if resta:
+                        total, primer = total + resta, j
+                if (j < len(trossos) and not opcionals[j - 1]) or total > 1:
+                    break
+            resultat = (min(total, 2), primer)
+        maneres[(i, k)] = resultat
+        return resultat
+
+    if parteix(0, n)[0] != 1:
+        return parse_llista(valor), False
+    imports, i = [], 0
+    while i < len(trossos):
+        j = parteix(i, n - len(imports))[1]
+        imports.append(','.join(trossos[i:j]))
+        i = j
+    return imports, True
+
+
+def linies_de_factures(df, ids):
+    # Normalitza les columnes Productes/Imports de cada factura en una fila per línia
+    factures, posicions, productes, imports, revisar = [], [], [], [], []
+    col_productes = df['Productes'] if 'Productes' in df.columns else [None] * len(df)
+    col_imports = df['Imports'] if 'Imports' in df.columns else [None] * len(df)
+    for factura_id, prods, imps in zip(ids, col_productes, col_imports):
+        prods = parse_llista(prods)
+        imps, segur = parse_imports(imps, len(prods))
+        # Imports ambigus: no es desa cap import (la factura no compta als totals) fins que es corregeixi
+        if not segur:
+            imps = [''] * len(imps)
+        cal_revisar = int(not segur or bool(prods) and len(prods) != len(imps))
+        for posicio, (producte, imp) in enumerate(zip_longest(prods, imps, fillvalue='')):
+            factures.append(int(factura_id))
+            posicions.append(posicio)
+            productes.append(producte)
+            imports.append(imp)
+            revisar.append(cal_revisar)
+    # Els imports es parsegen tots alhora amb operacions vectoritzades
+    valors = parse_amounts(pd.Series(imports, dtype=object))
+    return pd.DataFrame({
+        'factura_id': factures,
+        'posicio': posicions,
+        'Producte': productes,
+        'ProducteNorm': [normalitza_producte(p) for p in productes],
+        'Import': valors['Import'].to_numpy(),
+        'Moneda': valors['Moneda'].to_numpy(),
+        'Revisar': revisar,
+    }, columns=LINE_COLUMNS)
+
+
+def converteix_linies(linies, dates, taxes):
+    # Omple ImportBase de totes les línies alhora; dates: data ISO de cada factura indexada per factura_id
+    linies['ImportBase'] = taxes.converteix(linies['Import'], linies['Moneda'], linies['factura_id'].map(dates))
+    return linies
+
+
+def totals_per_factura(linies, ids, columna='ImportBase'):
+    # Suma dels imports de cada factura, en l'ordre dels ids donats (NaN si no té cap import vàlid)
+    return linies.groupby('factura_id')[columna].sum(min_count=1).reindex(list(ids))
+
+
+def revisar_per_factura(linies, ids):
+    # 1 si alguna línia de la factura s'ha de revisar, en l'ordre dels ids donats
+    return linies.groupby('factura_id')['Revisar'].max().reindex(list(ids)).fillna(0).astype(int)
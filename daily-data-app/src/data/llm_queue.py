@@ -0,0 +1,138 @@
+import asyncio
+import functools
+import itertools
+import threading
+import time
+
+import pandas as pd
+
+from data.extraction import ErrorExtraccio
+from utils import llm
+from utils.telemetria import span
+
+
+class ExtractionJob:
+    def __init__(self, job_id, nom, text, sha=None):
+        self.id = job_id
+        self.nom = nom
+        self.text = text
+        self.sha = sha
+        self.estat = "en cua"
+        self.intents = 0
+        self.error = None
+        self.fields = None
+        # 'plantilla' si l'han extret les plantilles apreses, 'llm' si ha calgut el model
+        self.metode = None
+        self.creat = time.time()
+        self.acabat = None
+
+    def as_dict(self):
+        durada = (self.acabat or time.time()) - self.creat
+        return {"Id": self.id, "Fitxer": self.nom, "Estat": self.estat, "Intents": self.intents,
+                "Segons": round(durada, 1), "Metode": self.metode or "", "Error": self.error or ""}
+
+
+class ExtractionQueue:
+    # Cua d'extracció LLM asíncrona: un bucle asyncio en un fil de fons envia les peticions a
+    # Ollama amb un límit de concurrència, temps màxim per petició i reintents amb espera exponencial.
+    # La UI hi afegeix feines amb submit() i en consulta l'estat amb jobs(); els resultats vàlids
+    # es desen al magatzem del data_manager a mesura que acaben.
+    def __init__(self, data_manager, concurrency=2, timeout=300, retries=2, backoff=2.0, host=None):
+        self.data_manager = data_manager
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        # host=None fa servir OLLAMA_HOST o el servidor local per defecte (es pot apuntar a un servidor fals)
+        self.host = host
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True, name="llm-queue")
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._inicia(), self._loop).result()
+
+    async def _inicia(self):
+        # El semàfor s'ha de crear dins del bucle que el farà servir; el client, a la primera petició
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._client = None
+
+    def submit(self, text, nom=None, sha=None):
+        with self._lock:
+            # Si el mateix fitxer ja és a la cua, no s'hi torna a afegir
+            for job in self._jobs.values():
+                if sha and job.sha == sha and job.estat in ("en cua", "processant"):
+                    return job.id
+            job = ExtractionJob(next(self._ids), nom or "", text, sha)
+            self._jobs[job.id] = job
+        asyncio.run_coroutine_threadsafe(self._run(job), self._loop)
+        return job.id
+
+    def job(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return [job.as_dict() for job in self._jobs.values()]
+
+    def pending(self):
+        return sum(1 for job in list(self._jobs.values()) if job.estat in ("en cua", "processant"))
+
+    def clear_finished(self):
+        with self._lock:
+            for job_id in [j.id for j in self._jobs.values() if j.estat in ("fet", "error")]:
+                del self._jobs[job_id]
+
+    async def _crida(self, request):
+        with span("llm_peticio", model=request['model'], cua=True,
+                  bytes_prompt=sum(len(m['content']) for m in request['messages'])) as atributs:
+            if self._client is None:
+                self._client = llm.client_asincron(self.host)
+            response = await asyncio.wait_for(self._client.chat(**request), timeout=self.timeout)
+            atributs.update(tokens_prompt=response.get('prompt_eval_count'), tokens_resposta=response.get('eval_count'))
+        return response['message']['content']
+
+    async def _run(self, job):
+        # Qualsevol error (plantilles, memòria cau, LLM o magatzem) acaba la feina en estat "error": mai queda en cua
+        try:
+            await self._processa(job)
+            job.estat, job.error = "fet", None
+        except Exception as e:
+            job.estat, job.error = "error", job.error or f"{type(e).__name__}: {e}"
+        job.acabat = time.time()
+
+    async def _processa(self, job):
+        dm = self.data_manager
+        # Les crides bloquejants (SQLite de plantilles, memòria cau i magatzem) es fan fora del bucle
+        executa = functools.partial(self._loop.run_in_executor, None)
+        # La plantilla de l'emissor no ocupa cap plaça del semàfor: és local i no passa pel LLM
+        fields = await executa(dm.extract_fields_template, job.text)
+        job.metode = 'plantilla' if fields is not None else 'llm'
+        clau = dm.llm_cache_key(job.text)
+        if fields is None:
+            fields = await executa(dm.cache.get, 'llm', clau)
+        while fields is None:
+            job.intents += 1
+            try:
+                # La plaça del semàfor només es té durant l'intent: l'espera abans de reintentar la deixa lliure
+                async with self._semaphore:
+                    job.estat = "processant"
+                    fields, falten = dm.parse_llm_response(await self._crida(dm.llm_request(job.text)))
+                    if falten:
+                        # Només es tornen a demanar els camps que falten
+                        extra, _ = dm.parse_llm_response(await self._crida(dm.llm_request(job.text, falten)), falten)
+                        dm.merge_missing(fields, extra)
+                await executa(dm.cache_fields, clau, fields)
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                if job.intents > self.retries:
+                    raise
+                await asyncio.sleep(self.backoff * 2 ** (job.intents - 1))
+        if not any(fields.values()):
+            # Sense cap camp no es desa res, ni es registra el fitxer: es pot tornar a enviar
+            raise ErrorExtraccio("El model no ha retornat cap camp de la factura.")
+        job.fields, job.error = fields, None
+        fitxers = [(job.sha, job.nom)] if job.sha else None
+        origens = [{'text': job.text, 'metode': job.metode}]
+        await executa(lambda: dm.append_data(pd.DataFrame([fields]), fitxers=fitxers, origens=origens))
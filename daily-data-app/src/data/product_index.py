@@ -0,0 +1,31 @@
+from collections import defaultdict
+
+
+class InvertedIndex:
+    # Índex invertit clau -> conjunt d'ids de factura, amb el nom a mostrar de cada clau.
+    # Es construeix a partir de parelles (clau, id) i s'amplia incrementalment amb add().
+    def __init__(self):
+        self.ids = defaultdict(set)
+        self.noms = {}
+
+    def add(self, claus, ids, noms=None):
+        noms = claus if noms is None else noms
+        for clau, factura_id, nom in zip(claus, ids, noms):
+            if not clau:
+                continue
+            self.ids[clau].add(int(factura_id))
+            self.noms.setdefault(clau, nom)
+
+    def lookup(self, claus):
+        # Unió dels ids de totes les claus demanades
+        resultat = set()
+        for clau in claus:
+            resultat |= self.ids.get(clau, set())
+        return resultat
+
+    def labels(self, claus=None):
+        claus = self.noms if claus is None else claus
+        return sorted(self.noms[c] for c in claus if c in self.noms)
+
+    def __len__(self):
+        return len(self.ids)
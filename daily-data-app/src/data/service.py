@@ -0,0 +1,272 @@
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from utils.lazy import ModulLazy
+
+
+# El client HTTP només el necessiten la UI en mode servei i la CLI remota
+requests = ModulLazy("requests")
+
+
+# El servei només escolta a la màquina local: no té autenticació
+HOST = "127.0.0.1"
+PORT = 8765
+# Directori del servidor d'on /batch pot llegir fitxers; sense definir, /batch està desactivat
+INGEST_DIR = os.environ.get("FACTURES_INGEST_DIR")
+IMAGE_TYPES = ("png", "jpg", "jpeg")
+
+
+class ServiceError(RuntimeError):
+    pass
+
+
+class FitxerPujat(io.BytesIO):
+    # Cos d'una petició com a objecte tipus fitxer amb nom (la mateixa interfície que l'UploadedFile de Streamlit)
+    def __init__(self, dades, name):
+        super().__init__(dades)
+        self.name = name
+
+
+class IngestService:
+    # Servei local d'ingesta i extracció sense Streamlit. Endpoints:
+    #   GET  /health            estat, versió de les dades i feines pendents
+    #   POST /ingest?nom=X      cos = contingut del fitxer; TXT es desa ara, PDF/imatges van a la cua LLM
+    #                           (amb &espera=1 l'extracció es fa dins de la petició)
+    #   POST /batch             {"rutes": [...], "workers": N}: ingesta per lots de fitxers locals del servidor,
+    #                           només de dins d'ingest_dir (FACTURES_INGEST_DIR)
+    #   GET  /jobs, /jobs/<id>  estat de les feines de la cua d'extracció
+    #   POST /jobs/neteja       esborra les feines acabades
+    def __init__(self, data_manager=None, queue=None, port=PORT, concurrency=2, ingest_dir=INGEST_DIR):
+        if data_manager is None:
+            from data.data_manager import DataManager
+            data_manager = DataManager()
+        if queue is None:
+            from data.llm_queue import ExtractionQueue
+            queue = ExtractionQueue(data_manager, concurrency=concurrency)
+        self.data_manager = data_manager
+        self.queue = queue
+        self.ingest_dir = os.path.realpath(ingest_dir) if ingest_dir else None
+        self.inici = time.time()
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                service._atendre(self, "GET")
+
+            def do_POST(self):
+                service._atendre(self, "POST")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((HOST, port), Handler)
+        if self.server.server_address[0] != HOST:
+            self.server.server_close()
+            raise ServiceError(f"El servei només pot escoltar a {HOST}, no a {self.server.server_address[0]}")
+        self.server.daemon_threads = True
+        self.url = f"http://{HOST}:{self.server.server_address[1]}"
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True, name="ingest-service").start()
+        return self
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _respon(self, handler, codi, cos):
+        dades = json.dumps(cos, ensure_ascii=False, default=str).encode('utf-8')
+        handler.send_response(codi)
+        handler.send_header('Content-Type', 'application/json; charset=utf-8')
+        handler.send_header('Content-Length', str(len(dades)))
+        handler.end_headers()
+        handler.wfile.write(dades)
+
+    def _atendre(self, handler, metode):
+        from data.data_manager import FitxerDuplicat
+
+        url = urlparse(handler.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            cos = handler.rfile.read(int(handler.headers.get('Content-Length', 0) or 0)) if metode == "POST" else b''
+            if metode == "GET" and url.path == "/health":
+                codi, resposta = 200, self.health()
+            elif metode == "GET" and url.path == "/jobs":
+                codi, resposta = 200, {"jobs": self.queue.jobs(), "pendents": self.queue.pending()}
+            elif metode == "GET" and url.path.startswith("/jobs/"):
+                job = self.queue.job(int(url.path.rsplit('/', 1)[1]))
+                codi, resposta = (200, job.as_dict()) if job else (404, {"error": "Feina inexistent"})
+            elif metode == "POST" and url.path == "/jobs/neteja":
+                self.queue.clear_finished()
+                codi, resposta = 200, {"pendents": self.queue.pending()}
+            elif metode == "POST" and url.path == "/ingest":
+                codi, resposta = self.ingest(cos, params.get("nom", "fitxer"), params.get("espera") == "1")
+            elif metode == "POST" and url.path == "/batch":
+                codi, resposta = self.batch(json.loads(cos or b'{}'))
+            else:
+                codi, resposta = 404, {"error": f"Ruta desconeguda: {metode} {url.path}"}
+        except FitxerDuplicat as e:
+            codi, resposta = 409, {"estat": "duplicat", "error": str(e)}
+        except Exception as e:
+            codi, resposta = 500, {"estat": "error", "error": f"{type(e).__name__}: {e}"}
+        self._respon(handler, codi, resposta)
+
+    def health(self):
+        versio, _ = self.data_manager.store.version()
+        return {"estat": "ok", "versio": versio, "pendents": self.queue.pending(),
+                "segons_actiu": round(time.time() - self.inici, 1)}
+
+    def ingest(self, dades, nom, espera=False):
+        tipus = nom.rsplit('.', 1)[-1].lower() if '.' in nom else ''
+        fitxer = FitxerPujat(dades, nom)
+        dm = self.data_manager
+        if tipus == "txt" or (espera and (tipus == "pdf" or tipus in IMAGE_TYPES)):
+            abans = dm.store.count()
+            resultat = dm.load_data_from_any(fitxer, tipus)
+            resposta = {"estat": "ok", "factures": dm.store.count() - abans}
+            if hasattr(resultat, "rebutjades_df"):
+                resposta.update(informe=resultat.as_dict(), rebutjades=resultat.exemples)
+            return 200, resposta
+        if tipus == "pdf" or tipus in IMAGE_TYPES:
+            return 202, {"estat": "en cua", "job": dm.enqueue_extraction(fitxer, tipus, self.queue)}
+        return 400, {"estat": "error", "error": f"Tipus de fitxer no suportat: {tipus}"}
+
+    def _dins_ingest_dir(self, ruta):
+        ruta = os.path.realpath(os.path.join(self.ingest_dir, ruta))
+        return os.path.commonpath([ruta, self.ingest_dir]) == self.ingest_dir
+
+    def batch(self, peticio):
+        from data.ingest import BatchIngestor, recull_fitxers
+
+        # Qualsevol procés local pot cridar el servei: només es llegeixen fitxers de dins del directori d'ingesta
+        # (les rutes relatives hi són relatives, i els enllaços simbòlics que en surten es descarten)
+        if self.ingest_dir is None:
+            return 403, {"estat": "error", "error": "La ingesta per lots està desactivada (cal FACTURES_INGEST_DIR)."}
+        rutes = [os.path.join(self.ingest_dir, ruta) for ruta in peticio.get("rutes", [])]
+        fora = [ruta for ruta in rutes if not self._dins_ingest_dir(ruta)]
+        if fora:
+            return 403, {"estat": "error", "error": f"Rutes fora de {self.ingest_dir}: {', '.join(fora)}"}
+        fitxers = [ruta for ruta in recull_fitxers(rutes) if self._dins_ingest_dir(ruta)]
+        if not fitxers:
+            return 400, {"estat": "error", "error": "No s'ha trobat cap fitxer compatible."}
+        informe = BatchIngestor(self.data_manager, max_workers=peticio.get("workers")).run(fitxers)
+        return 200, {"estat": "ok", "fitxers": informe}
+
+
+class ServiceClient:
+    # Client del servei d'ingesta per a la UI de Streamlit, l'embolcall d'escriptori i la CLI
+    def __init__(self, url=None, timeout=600):
+        self.url = (url or f"http://{HOST}:{PORT}").rstrip('/')
+        self.timeout = timeout
+
+    def _peticio(self, metode, ruta, **kwargs):
+        # Els errors de xarxa (servei aturat, temps esgotat...) arriben com a ServiceError, igual que els HTTP
+        try:
+            resposta = requests.request(metode, self.url + ruta, **kwargs)
+        except requests.RequestException as e:
+            raise ServiceError(f"El servei d'ingesta no respon a {self.url}: {e}") from e
+        return self._resposta(resposta)
+
+    def _resposta(self, resposta):
+        try:
+            cos = resposta.json()
+        except ValueError:
+            cos = {"error": resposta.text}
+        if resposta.status_code >= 400:
+            raise ServiceError(cos.get("error") or f"HTTP {resposta.status_code}")
+        return cos
+
+    def health(self, timeout=2):
+        return self._peticio("GET", "/health", timeout=timeout)
+
+    def is_up(self):
+        try:
+            return self.health().get("estat") == "ok"
+        except ServiceError:
+            return False
+
+    def wait_until_up(self, timeout=60, interval=0.2):
+        limit = time.monotonic() + timeout
+        while time.monotonic() < limit:
+            if self.is_up():
+                return True
+            time.sleep(interval)
+        return False
+
+    def ingest(self, nom, dades, espera=False):
+        params = {"nom": nom, **({"espera": "1"} if espera else {})}
+        return self._peticio("POST", "/ingest", params=params, data=dades, timeout=self.timeout)
+
+    def ingest_path(self, ruta, espera=False):
+        with open(ruta, 'rb') as f:
+            return self.ingest(os.path.basename(ruta), f, espera)
+
+    def batch(self, rutes, workers=None):
+        return self._peticio("POST", "/batch", json={"rutes": list(rutes), "workers": workers}, timeout=None)
+
+    def jobs(self):
+        return self._peticio("GET", "/jobs", timeout=10)["jobs"]
+
+    def pending(self):
+        return self._peticio("GET", "/jobs", timeout=10)["pendents"]
+
+    def clear_finished(self):
+        return self._peticio("POST", "/jobs/neteja", timeout=10)
+
+
+def main(argv=None):
+    # Ús (des de daily-data-app/src):
+    #   python -m data.service serve [--port 8765]   (sempre a 127.0.0.1; /batch llegeix de FACTURES_INGEST_DIR)
+    #   python -m data.service ingest <fitxers o directoris...> [--url http://host:port] [--workers N] [--espera]
+    parser = argparse.ArgumentParser(description="Servei i CLI d'ingesta de factures sense navegador")
+    ordres = parser.add_subparsers(dest="ordre", required=True)
+    serve = ordres.add_parser("serve", help="Arrenca el servei HTTP local")
+    serve.add_argument("--port", type=int, default=int(os.environ.get("FACTURES_SERVICE_PORT", PORT)))
+    serve.add_argument("--concurrency", type=int, default=int(os.environ.get("LLM_CONCURRENCY", 2)))
+    ingest = ordres.add_parser("ingest", help="Ingesta fitxers, localment o a través d'un servei")
+    ingest.add_argument("rutes", nargs="+")
+    ingest.add_argument("--url", default=os.environ.get("FACTURES_SERVICE_URL"),
+                        help="Servei remot; sense URL, la ingesta es fa en aquest procés")
+    ingest.add_argument("--workers", type=int, default=None)
+    ingest.add_argument("--espera", action="store_true", help="Amb --url, extreu cada fitxer dins de la petició")
+    args = parser.parse_args(argv)
+
+    if args.ordre == "serve":
+        service = IngestService(port=args.port, concurrency=args.concurrency)
+        print(f"Servei d'ingesta escoltant a {service.url}")
+        try:
+            service.serve_forever()
+        except KeyboardInterrupt:
+            service.shutdown()
+        return 0
+
+    if not args.url:
+        from data.ingest import main as ingest_local
+        return ingest_local(args.rutes + (["--workers", str(args.workers)] if args.workers else []))
+
+    from data.ingest import recull_fitxers
+
+    client = ServiceClient(args.url)
+    errors = 0
+    for ruta in recull_fitxers(args.rutes):
+        try:
+            resposta = client.ingest_path(ruta, espera=args.espera)
+            print(f"{ruta}: {resposta.get('estat')} {resposta.get('job') or resposta.get('factures', '')}")
+        except ServiceError as e:
+            errors += 1
+            print(f"{ruta}: ERROR {e}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
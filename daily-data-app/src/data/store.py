@@ -0,0 +1,551 @@
+import argparse
+import contextlib
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+import pandas as pd
+
+from data.line_items import LINE_COLUMNS, converteix_linies, linies_de_factures, revisar_per_factura, totals_per_factura
+from utils.currency import taxes_per_defecte
+from utils.dates import normalitza_dates
+from utils.telemetria import span
+
+log = logging.getLogger(__name__)
+
+COLUMNES = [
+    "NumeroFactura", "TipusFactura", "Pagador",
+    "DadesPagador", "AdrecaPagador", "EmailPagador",
+    "Emisor", "DadesEmisor", "AdrecaEmisor", "EmailEmisor",
+    "Data", "Productes", "Imports"
+]
+# Versió de l'esquema de la taula de línies; si canvia, les línies es regeneren en obrir el magatzem
+LINIES_VERSIO = 6
+# Versió de la normalització de dates; si canvia, DataISO i DataRevisar es recalculen en obrir el magatzem
+DATES_VERSIO = 2
+# Columnes calculades pel magatzem en el moment d'inserir o editar
+# (ImportsRevisar = 1 si els imports no s'han pogut separar sense ambigüitat o no quadren amb els productes)
+COLUMNES_DERIVADES = {"TotalFactura": "REAL", "DataISO": "TEXT", "DataRevisar": "INTEGER", "ImportsRevisar": "INTEGER"}
+# Versió de cada fila: augmenta a cada edició i permet detectar edicions concurrents (concurrència optimista)
+COLUMNA_VERSIO = "VersioFila"
+# Claus del resum persistent (Mes × TipusFactura × Emisor -> total i nombre de factures)
+CLAUS_RESUM = ["Mes", "TipusFactura", "Emisor"]
+# Versió del resum; si canvia, es reconstrueix en obrir el magatzem
+RESUM_VERSIO = 1
+# Marge per a la diferència entre totals en verificar el resum (sumes i restes successives de REAL)
+TOLERANCIA_RESUM = 1e-6
+
+
+class ConflicteEdicio(RuntimeError):
+    # Les files s'han modificat o esborrat des que es van llegir; no s'ha desat cap canvi
+    def __init__(self, ids):
+        self.ids = sorted(ids)
+        super().__init__(f"Les factures {', '.join(map(str, self.ids))} s'han modificat en una altra sessió. "
+                         "Recarrega les dades i torna a aplicar els canvis.")
+
+
+class InvoiceStore:
+    # Interfície del magatzem de factures. Les files s'identifiquen per un id estable
+    # que s'exposa com a índex del DataFrame retornat per read().
+    def read(self):
+        raise NotImplementedError
+
+    def append(self, df):
+        raise NotImplementedError
+
+    def append_many(self, lots):
+        # lots = [(df, fitxers)] desats en una sola transacció; retorna una llista d'ids per lot
+        raise NotImplementedError
+
+    def append_stream(self, blocs, fitxers=None):
+        # Tots els blocs d'un iterador en una sola transacció; retorna el nombre de files desades
+        raise NotImplementedError
+
+    def update(self, df):
+        # Si df porta COLUMNA_VERSIO, llença ConflicteEdicio quan alguna fila ha canviat des de la lectura
+        raise NotImplementedError
+
+    def delete(self, ids, versions=None):
+        raise NotImplementedError
+
+    def apply_edits(self, esborrats=(), actualitzades=None, noves=None, versions=None):
+        # Esborrats, actualitzacions i insercions de l'editor com una sola operació atòmica
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def known_files(self, hashes):
+        raise NotImplementedError
+
+    def read_lines(self):
+        raise NotImplementedError
+
+    def read_summary(self, mes_inici=None, mes_final=None):
+        # Totals per Mes (AAAA-MM) × TipusFactura × Emisor, mantinguts a cada escriptura
+        raise NotImplementedError
+
+    def version(self):
+        # Retorna (versio, versio_destructiva): la primera augmenta a cada escriptura; la segona
+        # només quan s'actualitzen o s'esborren files (si no ha canviat, només hi ha hagut insercions)
+        raise NotImplementedError
+
+
+class SQLiteInvoiceStore(InvoiceStore):
+    # Magatzem SQLite: insercions i actualitzacions per fila, sense reescriure el registre sencer
+    table = "factures"
+
+    def __init__(self, db_path, columns=None, taxes=None):
+        self.db_path = db_path
+        self.columns = list(columns or COLUMNES)
+        # Tipus de canvi per convertir les línies a la moneda base (TotalFactura i ImportBase)
+        self.taxes = taxes if taxes is not None else taxes_per_defecte()
+        self._init_db()
+        self.migrate_dates()
+        self.migrate_lines()
+        self.migrate_summary()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextlib.contextmanager
+    def _escriptura(self):
+        # Transacció d'escriptura amb el bloqueig d'escriptor pres d'entrada (BEGIN IMMEDIATE): les escriptures
+        # de sessions, fils i processos diferents es serialitzen (esperen fins al timeout) en lloc d'intercalar-se,
+        # i una transacció que ha llegit no pot fallar en passar a escriure
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            cols = ", ".join(f'"{c}" TEXT' for c in self.columns)
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (id INTEGER PRIMARY KEY AUTOINCREMENT, {cols})")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (clau TEXT PRIMARY KEY, valor TEXT)")
+            # Taula normalitzada de línies de factura (un producte i import per fila)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS linies ("
+                "factura_id INTEGER NOT NULL, posicio INTEGER NOT NULL, Producte TEXT, ProducteNorm TEXT, "
+                "Import REAL, Moneda TEXT, "
+                "PRIMARY KEY (factura_id, posicio))"
+            )
+            columnes_linies = {r[1] for r in conn.execute("PRAGMA table_info(linies)")}
+            if "ProducteNorm" not in columnes_linies:
+                conn.execute("ALTER TABLE linies ADD COLUMN ProducteNorm TEXT")
+            if "ImportBase" not in columnes_linies:
+                conn.execute("ALTER TABLE linies ADD COLUMN ImportBase REAL")
+            if "Revisar" not in columnes_linies:
+                conn.execute("ALTER TABLE linies ADD COLUMN Revisar INTEGER NOT NULL DEFAULT 0")
+            # Índex invertit persistent: producte normalitzat -> factures
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_linies_producte ON linies (ProducteNorm, factura_id)")
+            # Empremta (SHA-256) dels fitxers ja ingerits, per detectar duplicats
+            conn.execute("CREATE TABLE IF NOT EXISTS fitxers (sha256 TEXT PRIMARY KEY, nom TEXT, ts REAL)")
+            # Afegeix columnes noves si l'esquema ha crescut des de l'última execució
+            existents = {r[1] for r in conn.execute(f"PRAGMA table_info({self.table})")}
+            for c in self.columns:
+                if c not in existents:
+                    conn.execute(f'ALTER TABLE {self.table} ADD COLUMN "{c}" TEXT')
+            for c, tipus in COLUMNES_DERIVADES.items():
+                if c not in existents:
+                    conn.execute(f'ALTER TABLE {self.table} ADD COLUMN "{c}" {tipus}')
+            if COLUMNA_VERSIO not in existents:
+                conn.execute(f'ALTER TABLE {self.table} ADD COLUMN "{COLUMNA_VERSIO}" INTEGER NOT NULL DEFAULT 0')
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_data ON {self.table} (DataISO)")
+            # Resum materialitzat per al RESUM GENERAL del Dashboard; els NULL de les claus es desen com ''
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS resum_mensual ("
+                "Mes TEXT NOT NULL, TipusFactura TEXT NOT NULL, Emisor TEXT NOT NULL, "
+                "TotalFactura REAL NOT NULL, Factures INTEGER NOT NULL, "
+                "PRIMARY KEY (Mes, TipusFactura, Emisor))"
+            )
+
+    def _all_columns(self):
+        return self.columns + list(COLUMNES_DERIVADES)
+
+    def _prepara(self, df, ids=None):
+        # Calcula les línies i les columnes derivades; sense ids, les línies es numeren per posició
+        posicions = range(len(df)) if ids is None else ids
+        files = []
+        net = df.reindex(columns=self.columns)
+        net = net.astype(object).where(pd.notnull(net), None)
+        dates = normalitza_dates(net['Data'] if 'Data' in net.columns else [None] * len(net))
+        linies = converteix_linies(linies_de_factures(df, posicions), dict(zip(posicions, dates['DataISO'])), self.taxes)
+        totals = totals_per_factura(linies, posicions)
+        imports_revisar = revisar_per_factura(linies, posicions)
+        for fila, total, iso, revisar, revisar_imports in zip(net.itertuples(index=False, name=None), totals,
+                                                              dates['DataISO'], dates['DataRevisar'], imports_revisar):
+            fila = tuple(None if v is None else str(v) for v in fila)
+            files.append(fila + (None if pd.isna(total) else float(total), iso, int(revisar), int(revisar_imports)))
+        return files, linies
+
+    def get_meta(self, clau, default=None):
+        with self._connect() as conn:
+            row = conn.execute("SELECT valor FROM meta WHERE clau = ?", (clau,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, clau, valor):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (clau, valor) VALUES (?, ?)", (clau, str(valor)))
+
+    def _bump(self, conn, destructiva=False):
+        conn.execute("INSERT OR IGNORE INTO meta (clau, valor) VALUES ('versio', '0')")
+        conn.execute("UPDATE meta SET valor = CAST(valor AS INTEGER) + 1 WHERE clau = 'versio'")
+        if destructiva:
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (clau, valor) "
+                "SELECT 'versio_destructiva', valor FROM meta WHERE clau = 'versio'"
+            )
+
+    def version(self):
+        with self._connect() as conn:
+            valors = dict(conn.execute("SELECT clau, valor FROM meta WHERE clau IN ('versio', 'versio_destructiva')"))
+        return int(valors.get('versio', 0)), int(valors.get('versio_destructiva', 0))
+
+    def read(self, since_id=None):
+        # since_id: només les files amb id més gran (lectura incremental després d'insercions)
+        cols = ", ".join(f'"{c}"' for c in self._all_columns() + [COLUMNA_VERSIO])
+        with self._connect() as conn:
+            df = pd.read_sql_query(
+                f"SELECT id, {cols} FROM {self.table} WHERE id > ? ORDER BY id", conn,
+                index_col="id", params=(since_id or 0,)
+            )
+        return df
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def append(self, df, fitxers=None):
+        # Retorna els ids assignats a les files noves; fitxers = [(sha256, nom)] d'on provenen
+        return self.append_many([(df, fitxers)])[0]
+
+    def append_many(self, lots):
+        # Desa diversos lots (df, fitxers) en una sola transacció (un sol commit). Un lot amb fitxers que ja
+        # s'han ingerit tots (abans o en un lot anterior de la mateixa crida) s'omet i retorna []: la comprovació
+        # es fa amb el bloqueig d'escriptura pres, de manera que dues sessions no poden desar el mateix fitxer.
+        lots = [(df, fitxers) for df, fitxers in lots]
+        resultats = [[] for _ in lots]
+        preparats = [(i, *self._prepara(df), fitxers) for i, (df, fitxers) in enumerate(lots) if df is not None and not df.empty]
+        if not preparats:
+            return resultats
+        n_files = sum(len(files) for _, files, _, _ in preparats)
+        n_linies = sum(len(linies) for _, _, linies, _ in preparats)
+        with span("escriptura", operacio="append", files=n_files, linies=n_linies, lots=len(preparats)) as atributs, \
+                self._escriptura() as conn:
+            tots = []
+            omesos = 0
+            for i, files, linies, fitxers in preparats:
+                if fitxers:
+                    hashes = {sha for sha, _ in fitxers}
+                    if hashes <= self._coneguts(conn, hashes):
+                        omesos += 1
+                        continue
+                ids = self._insereix(conn, files, linies)
+                if fitxers:
+                    self._registra_fitxers(conn, fitxers)
+                resultats[i] = ids
+                tots.extend(ids)
+            atributs["omesos"] = omesos
+            if tots:
+                self._ajusta_resum(conn, tots, 1)
+                self._bump(conn)
+        return resultats
+
+    def append_stream(self, blocs, fitxers=None):
+        # Desa tots els DataFrames d'un iterador en una sola transacció (tot o res): si un bloc falla, no en queda
+        # cap de desat ni el fitxer registrat. Els blocs es preparen i s'insereixen d'un en un (la memòria no creix).
+        # Retorna el nombre de files desades; 0 sense llegir cap bloc si els fitxers ja s'havien ingerit.
+        with span("escriptura", operacio="append_stream") as atributs, self._escriptura() as conn:
+            if fitxers:
+                hashes = {sha for sha, _ in fitxers}
+                if hashes <= self._coneguts(conn, hashes):
+                    atributs["omesos"] = 1
+                    return 0
+            n_files = n_linies = 0
+            for df in blocs:
+                if df is None or df.empty:
+                    continue
+                files, linies = self._prepara(df)
+                ids = self._insereix(conn, files, linies)
+                self._ajusta_resum(conn, ids, 1)
+                n_files, n_linies = n_files + len(ids), n_linies + len(linies)
+            if n_files:
+                if fitxers:
+                    self._registra_fitxers(conn, fitxers)
+                self._bump(conn)
+            atributs.update(files=n_files, linies=n_linies)
+        return n_files
+
+    def _registra_fitxers(self, conn, fitxers):
+        ara = time.time()
+        conn.executemany(
+            "INSERT OR IGNORE INTO fitxers (sha256, nom, ts) VALUES (?, ?, ?)",
+            [(sha, nom, ara) for sha, nom in fitxers],
+        )
+
+    def _insereix(self, conn, files, linies):
+        columnes = self._all_columns()
+        cols = ", ".join(f'"{c}"' for c in columnes)
+        marques = ", ".join("?" * len(columnes))
+        cur = conn.cursor()
+        ids = []
+        for fila in files:
+            cur.execute(f"INSERT INTO {self.table} ({cols}) VALUES ({marques})", fila)
+            ids.append(cur.lastrowid)
+        linies['factura_id'] = linies['factura_id'].map(dict(enumerate(ids)))
+        self._insert_lines(conn, linies)
+        return ids
+
+    def _coneguts(self, conn, hashes):
+        hashes = list(hashes)
+        trobats = set()
+        for i in range(0, len(hashes), 500):
+            bloc = hashes[i:i + 500]
+            marques = ",".join("?" * len(bloc))
+            trobats.update(r[0] for r in conn.execute(f"SELECT sha256 FROM fitxers WHERE sha256 IN ({marques})", bloc))
+        return trobats
+
+    def known_files(self, hashes):
+        # Retorna el subconjunt de hashes que ja s'han ingerit
+        with self._connect() as conn:
+            return self._coneguts(conn, hashes)
+
+    def _insert_lines(self, conn, linies):
+        linies = linies.astype(object).where(pd.notnull(linies), None)
+        conn.executemany(
+            f"INSERT OR REPLACE INTO linies ({', '.join(LINE_COLUMNS)}) VALUES ({', '.join('?' * len(LINE_COLUMNS))})",
+            list(linies.itertuples(index=False, name=None)),
+        )
+
+    def _comprova_versions(self, conn, versions):
+        # versions = {id: versió llegida}; llença ConflicteEdicio si alguna fila ha canviat o ja no existeix
+        ids = list(versions)
+        actuals = {}
+        for i in range(0, len(ids), 500):
+            bloc = ids[i:i + 500]
+            marques = ",".join("?" * len(bloc))
+            actuals.update(conn.execute(f'SELECT id, "{COLUMNA_VERSIO}" FROM {self.table} WHERE id IN ({marques})', bloc))
+        conflictes = [i for i, versio in versions.items() if actuals.get(i) != versio]
+        if conflictes:
+            raise ConflicteEdicio(conflictes)
+
+    def _versions(self, df):
+        if COLUMNA_VERSIO not in df.columns:
+            return None
+        return {int(i): int(v) for i, v in zip(df.index, pd.to_numeric(df[COLUMNA_VERSIO], errors='coerce').fillna(-1))}
+
+    def update(self, df):
+        # Actualitza in situ les files indicades per l'índex (id) del DataFrame. Amb la columna COLUMNA_VERSIO
+        # (la que retorna read()), només es desa si cap fila ha canviat des de la lectura; sense, l'última escriptura guanya.
+        self.apply_edits(actualitzades=df)
+
+    def delete(self, ids, versions=None):
+        # versions = {id: versió llegida}: si s'indiquen, no s'esborra res si alguna fila ha canviat
+        self.apply_edits(esborrats=ids, versions=versions)
+
+    def apply_edits(self, esborrats=(), actualitzades=None, noves=None, versions=None):
+        # Desa els canvis d'una edició en una sola transacció: si hi ha un conflicte de versió no es desa res.
+        # Retorna els ids de les files noves.
+        esborrats = [int(i) for i in esborrats]
+        if actualitzades is None or actualitzades.empty:
+            actualitzades = None
+        if noves is None or noves.empty:
+            noves = None
+        if not esborrats and actualitzades is None and noves is None:
+            return []
+        comprovar = {i: int(versions[i]) for i in esborrats} if versions is not None else {}
+        if actualitzades is not None:
+            comprovar.update(self._versions(actualitzades) or {})
+            files, linies = self._prepara(actualitzades, actualitzades.index)
+            ids_act = [int(i) for i in actualitzades.index]
+            files = [fila + (i,) for fila, i in zip(files, ids_act)]
+        if noves is not None:
+            files_noves, linies_noves = self._prepara(noves)
+        assignacions = ", ".join(f'"{c}" = ?' for c in self._all_columns())
+        ids_nous = []
+        with span("escriptura", operacio="edicio", esborrades=len(esborrats),
+                  actualitzades=0 if actualitzades is None else len(actualitzades),
+                  noves=0 if noves is None else len(noves)), self._escriptura() as conn:
+            if comprovar:
+                self._comprova_versions(conn, comprovar)
+            if esborrats:
+                self._ajusta_resum(conn, esborrats, -1)
+                conn.executemany(f"DELETE FROM {self.table} WHERE id = ?", [(i,) for i in esborrats])
+                conn.executemany("DELETE FROM linies WHERE factura_id = ?", [(i,) for i in esborrats])
+            if actualitzades is not None:
+                # El resum es corregeix restant les files tal com eren i sumant-les un cop actualitzades
+                self._ajusta_resum(conn, ids_act, -1)
+                conn.executemany(
+                    f'UPDATE {self.table} SET {assignacions}, "{COLUMNA_VERSIO}" = "{COLUMNA_VERSIO}" + 1 WHERE id = ?', files
+                )
+                self._ajusta_resum(conn, ids_act, 1)
+                conn.executemany("DELETE FROM linies WHERE factura_id = ?", [(i,) for i in ids_act])
+                self._insert_lines(conn, linies)
+            if noves is not None:
+                ids_nous = self._insereix(conn, files_noves, linies_noves)
+                self._ajusta_resum(conn, ids_nous, 1)
+            self._bump(conn, destructiva=bool(esborrats) or actualitzades is not None)
+        return ids_nous
+
+    def read_lines(self, since_id=None):
+        with self._connect() as conn:
+            return pd.read_sql_query(
+                f"SELECT {', '.join(LINE_COLUMNS)} FROM linies WHERE factura_id > ? ORDER BY factura_id, posicio",
+                conn, params=(since_id or 0,)
+            )
+
+    def migrate_lines(self):
+        # Regenera línies i totals dels registres anteriors a la taula de línies o a TotalFactura,
+        # o convertits amb una altra taula de tipus de canvi o moneda base
+        if self.get_meta("linies_migrades") == str(LINIES_VERSIO) and self.get_meta("linies_taxes") == self.taxes.empremta():
+            return 0
+        with self._escriptura() as conn:
+            df = pd.read_sql_query(f'SELECT id, "Productes", "Imports", DataISO FROM {self.table}', conn, index_col="id")
+            linies = converteix_linies(linies_de_factures(df, df.index), df['DataISO'], self.taxes)
+            totals = totals_per_factura(linies, df.index)
+            revisar = revisar_per_factura(linies, df.index)
+            conn.execute("DELETE FROM linies")
+            self._insert_lines(conn, linies)
+            self._bump(conn, destructiva=True)
+            conn.executemany(
+                f'UPDATE {self.table} SET "TotalFactura" = ?, "ImportsRevisar" = ? WHERE id = ?',
+                [(None if pd.isna(t) else float(t), int(r), int(i)) for i, t, r in zip(df.index, totals, revisar)],
+            )
+            self._reconstrueix_resum(conn)
+        self.set_meta("linies_migrades", LINIES_VERSIO)
+        self.set_meta("linies_taxes", self.taxes.empremta())
+        return len(df)
+
+    def migrate_dates(self):
+        # Normalitza la data dels registres desats abans de DataISO (o amb una versió anterior de les regles)
+        if self.get_meta("dates_versio") == str(DATES_VERSIO):
+            return 0
+        with self._escriptura() as conn:
+            df = pd.read_sql_query(f'SELECT id, "Data" FROM {self.table}', conn, index_col="id")
+            dates = normalitza_dates(df['Data'])
+            conn.executemany(
+                f'UPDATE {self.table} SET "DataISO" = ?, "DataRevisar" = ? WHERE id = ?',
+                [(iso, int(revisar), int(i)) for i, iso, revisar in
+                 zip(dates.index, dates['DataISO'], dates['DataRevisar'])],
+            )
+            self._reconstrueix_resum(conn)
+            self._bump(conn, destructiva=True)
+            # La conversió de moneda de les línies depèn de la data: es refà a migrate_lines
+            conn.execute("DELETE FROM meta WHERE clau = 'linies_migrades'")
+        self.set_meta("dates_versio", DATES_VERSIO)
+        return len(df)
+
+    def _select_resum(self, condicio="1"):
+        # Agregat de les factures amb data vàlida amb les mateixes columnes que resum_mensual
+        return (
+            "SELECT substr(DataISO, 1, 7) AS Mes, COALESCE(\"TipusFactura\", '') AS TipusFactura, "
+            "COALESCE(\"Emisor\", '') AS Emisor, COALESCE(SUM(\"TotalFactura\"), 0) AS TotalFactura, "
+            f"COUNT(*) AS Factures FROM {self.table} WHERE DataISO IS NOT NULL AND {condicio} GROUP BY 1, 2, 3"
+        )
+
+    def _ajusta_resum(self, conn, ids, signe):
+        # Suma (signe=1) o resta (signe=-1) al resum les factures indicades, tal com són ara a la taula
+        ids = [int(i) for i in ids]
+        for i in range(0, len(ids), 500):
+            bloc = ids[i:i + 500]
+            agregat = self._select_resum(f"id IN ({','.join('?' * len(bloc))})")
+            conn.execute(
+                "INSERT INTO resum_mensual (Mes, TipusFactura, Emisor, TotalFactura, Factures) "
+                f"SELECT Mes, TipusFactura, Emisor, ? * TotalFactura, ? * Factures FROM ({agregat}) WHERE 1 "
+                "ON CONFLICT (Mes, TipusFactura, Emisor) DO UPDATE SET "
+                "TotalFactura = TotalFactura + excluded.TotalFactura, Factures = Factures + excluded.Factures",
+                [signe, signe] + bloc,
+            )
+        if signe < 0:
+            conn.execute("DELETE FROM resum_mensual WHERE Factures <= 0")
+
+    def _reconstrueix_resum(self, conn):
+        conn.execute("DELETE FROM resum_mensual")
+        conn.execute(f"INSERT INTO resum_mensual (Mes, TipusFactura, Emisor, TotalFactura, Factures) {self._select_resum()}")
+
+    def read_summary(self, mes_inici=None, mes_final=None):
+        # La mida del resum depèn de mesos × categories × emissors, no del nombre de factures
+        with self._connect() as conn:
+            df = pd.read_sql_query(
+                "SELECT Mes, TipusFactura, Emisor, TotalFactura, Factures FROM resum_mensual "
+                "WHERE Mes >= ? AND Mes <= ? ORDER BY Mes, TipusFactura, Emisor",
+                conn, params=(mes_inici or '', mes_final or '9999-99'),
+            )
+        for c in ("TipusFactura", "Emisor"):
+            df[c] = df[c].where(df[c] != '', None)
+        return df
+
+    def verify_summary(self, rebuild=False):
+        # Compara el resum desat amb un recompte des de zero i retorna les claus que no quadren;
+        # amb rebuild=True, si n'hi ha, el reconstrueix
+        with self._escriptura() as conn:
+            desat = pd.read_sql_query("SELECT Mes, TipusFactura, Emisor, TotalFactura, Factures FROM resum_mensual", conn)
+            esperat = pd.read_sql_query(self._select_resum(), conn)
+            diff = esperat.merge(desat, on=CLAUS_RESUM, how="outer", suffixes=("_esperat", "_desat"))
+            totals = diff[["TotalFactura_esperat", "TotalFactura_desat"]].fillna(0)
+            factures = diff[["Factures_esperat", "Factures_desat"]].fillna(0).astype(int)
+            diff[totals.columns] = totals
+            diff[factures.columns] = factures
+            diff = diff[
+                ((totals["TotalFactura_esperat"] - totals["TotalFactura_desat"]).abs() > TOLERANCIA_RESUM)
+                | (factures["Factures_esperat"] != factures["Factures_desat"])
+            ].reset_index(drop=True)
+            if rebuild and not diff.empty:
+                self._reconstrueix_resum(conn)
+                self._bump(conn, destructiva=True)
+        return diff
+
+    def migrate_summary(self):
+        # Omple el resum dels magatzems creats abans de resum_mensual (o amb una versió anterior)
+        if self.get_meta("resum_versio") == str(RESUM_VERSIO):
+            return 0
+        with self._escriptura() as conn:
+            self._reconstrueix_resum(conn)
+            n = conn.execute("SELECT COUNT(*) FROM resum_mensual").fetchone()[0]
+        self.set_meta("resum_versio", RESUM_VERSIO)
+        return n
+
+    def migrate_csv(self, csv_path):
+        # Migració única del registre CSV antic; no torna a importar-lo si ja s'ha fet
+        if self.get_meta("csv_migrat") or not os.path.exists(csv_path):
+            return 0
+        df = pd.read_csv(csv_path, dtype=str)
+        ids = self.append(df)
+        self.set_meta("csv_migrat", csv_path)
+        log.info("Migrades %d factures des de %s", len(ids), csv_path)
+        return len(ids)
+
+
+def main(argv=None):
+    # Ús (des de daily-data-app/src):  python -m data.store verifica-resum [--db ruta] [--reconstrueix]
+    parser = argparse.ArgumentParser(description="Manteniment del magatzem de factures")
+    ordres = parser.add_subparsers(dest="ordre", required=True)
+    verifica = ordres.add_parser("verifica-resum", help="Recalcula el resum mensual des de zero i el compara amb el desat")
+    verifica.add_argument("--db", default=os.path.join(os.path.dirname(__file__), '../registro_total.db'))
+    verifica.add_argument("--reconstrueix", action="store_true", help="Si hi ha diferències, substitueix el resum desat")
+    args = parser.parse_args(argv)
+
+    store = SQLiteInvoiceStore(args.db)
+    diff = store.verify_summary(rebuild=args.reconstrueix)
+    if diff.empty:
+        print("El resum mensual quadra amb les factures.")
+        return 0
+    print(diff.to_string(index=False))
+    print(f"{len(diff)} claus del resum no quadren" + ("; s'ha reconstruït." if args.reconstrueix else "."))
+    return 0 if args.reconstrueix else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+import functools
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+from data.extraction import CAMPS_LLISTA, valida_camps
+from data.line_items import parse_llista
+from data.store import COLUMNES
+from utils.amounts import MONEDA_RE, parse_amounts
+from utils.currency import simbol_moneda
+from utils.dates import normalitza_dates
+
+
+# Plantilles apreses per emissor: àncores de text (etiqueta abans/després del valor o línia anterior) per als
+# camps escalars i un patró de fila per a les línies de producte. Es treballa sobre el text extret (capa de text
+# o OCR), de manera que la mateixa plantilla serveix per a PDF amb text i escanejats.
+PLANTILLA_VERSIO = 1
+CAMPS_ESCALARS = [c for c in COLUMNES if c not in CAMPS_LLISTA]
+# Camps propis de l'emissor: si el text no els porta amb una etiqueta reconeixible, es fa servir el valor après
+CAMPS_CONSTANTS = ["TipusFactura", "Emisor", "DadesEmisor", "AdrecaEmisor", "EmailEmisor"]
+# Camps amb forma fixa (xifres i separadors): el valor extret ha de tenir la mateixa forma que l'après
+CAMPS_FORMA = ["NumeroFactura", "Data"]
+NIF_RE = re.compile(r'\b(?:[A-HJNP-SUVW]-?\d{7}-?[0-9A-J]|\d{8}-?[A-Z]|[XYZ]-?\d{7}-?[A-Z])\b')
+IMPORT_RE = r'(?:[€$£][ \t]*)?-?\d[\d.,]*(?:[ \t]*(?:€|\$|£|EUR|USD|GBP))?'
+# Línies de capçalera que formen l'empremta de disseny de les factures sense NIF
+LINIES_EMPREMTA = 4
+# Diferència màxima entre l'import après i el trobat al text
+TOLERANCIA_IMPORT = 0.005
+
+
+def nifs(text):
+    return [n.replace('-', '') for n in NIF_RE.findall((text or '').upper())]
+
+
+def empremta_disseny(text):
+    # Hash de les primeres línies amb les xifres esborrades: igual per a totes les factures d'un mateix model
+    linies = []
+    for linia in (text or '').splitlines():
+        linia = re.sub(r'\s+', ' ', re.sub(r'\d+', '#', linia.lower())).strip()
+        if linia:
+            linies.append(linia)
+        if len(linies) == LINIES_EMPREMTA:
+            break
+    return hashlib.sha256("\n".join(linies).encode('utf-8')).hexdigest()[:16]
+
+
+def claus_candidates(text):
+    # Primer els NIF que apareixen al text, després l'empremta de disseny
+    return [f"nif:{n}" for n in dict.fromkeys(nifs(text))] + [f"disseny:{empremta_disseny(text)}"]
+
+
+def _te_xifra(text):
+    return any(c.isdigit() for c in text)
+
+
+def _patro(text):
+    # Etiqueta com a regex: espais flexibles i xifres genèriques (números de pàgina, anys...)
+    return r'[ \t]+'.join(re.sub(r'\d+', r'\\d+', re.escape(t)) for t in text.split())
+
+
+def _patro_generic(text):
+    # Tros variable d'una fila de producte: els mots amb xifres (quantitats, preus unitaris) s'accepten amb qualsevol valor
+    return r'[ \t]+'.join(r'\S*\d\S*' if _te_xifra(t) else re.escape(t) for t in text.split())
+
+
+def forma(valor):
+    return '^' + re.sub(r'\d+', r'\\d+', re.escape(valor.strip())) + '$'
+
+
+def _etiqueta_final(text):
+    # Mots finals abans d'un valor, a partir de l'últim que porta xifres (probablement un altre valor)
+    tokens = text.split()
+    ultim = max((i for i, t in enumerate(tokens) if _te_xifra(t)), default=-1)
+    return ' '.join(tokens[ultim + 1:])
+
+
+def _etiqueta_inicial(text):
+    tokens = text.split()
+    primer = next((i for i, t in enumerate(tokens) if _te_xifra(t)), len(tokens))
+    return ' '.join(tokens[:primer])
+
+
+def _apren_camp(linies, valor):
+    # Àncora d'un camp escalar: l'etiqueta que el precedeix a la mateixa línia o, si el valor obre la línia, la línia anterior
+    for n, linia in enumerate(linies):
+        pos = linia.find(valor)
+        if pos < 0:
+            continue
+        despres = linia[pos + len(valor):]
+        ancora = {"despres": _etiqueta_inicial(despres) or despres.strip()}
+        abans = _etiqueta_final(linia[:pos])
+        if any(c.isalpha() for c in abans):
+            return dict(ancora, abans=abans)
+        anterior = next((l.strip() for l in reversed(linies[:n]) if l.strip()), None)
+        if not linia[:pos].strip() and anterior:
+            return dict(ancora, anterior=anterior)
+    return None
+
+
+def _regex_camp(ancora):
+    final = rf"[ \t]*{_patro(ancora['despres'])}" if ancora.get('despres') else r"[ \t]*$"
+    if 'abans' in ancora:
+        return re.compile(rf"{_patro(ancora['abans'])}[ \t]*(?P<valor>\S.*?){final}", re.M)
+    return re.compile(rf"^[ \t]*{_patro(ancora['anterior'])}[ \t]*\n[ \t]*(?P<valor>\S.*?){final}", re.M)
+
+
+def _import(text):
+    valor = parse_amounts([text])['Import'].iloc[0]
+    return None if valor != valor else float(valor)
+
+
+def _apren_linies(linies, productes, imports):
+    # Cada producte a la seva línia, en ordre, amb el seu import com a últim import de la línia.
+    # Retorna el patró de fila (après de la primera) i les línies que delimiten la taula.
+    esperats = [_import(i) for i in imports]
+    trobades = []
+    inici = 0
+    for producte, esperat in zip(productes, esperats):
+        for n in range(inici, len(linies)):
+            linia = linies[n]
+            pos = linia.find(producte)
+            if pos < 0 or esperat is None:
+                continue
+            fi_producte = pos + len(producte)
+            imports_linia = list(re.finditer(IMPORT_RE, linia[fi_producte:]))
+            if not imports_linia:
+                continue
+            m = imports_linia[-1]
+            valor = _import(m.group(0))
+            if valor is None or abs(valor - esperat) > TOLERANCIA_IMPORT:
+                continue
+            trobades.append((n, pos, fi_producte, fi_producte + m.start(), fi_producte + m.end()))
+            inici = n + 1
+            break
+        else:
+            return None
+    n, pos, fi_producte, inici_import, fi_import = trobades[0]
+    linia = linies[n]
+    fila = (rf"^[ \t]*{_patro_generic(linia[:pos])}[ \t]*(?P<producte>\S.*?)[ \t]*{_patro_generic(linia[fi_producte:inici_import])}"
+            rf"[ \t]*(?P<import>{IMPORT_RE})[ \t]*{_patro_generic(linia[fi_import:])}[ \t]*$")
+    primera, ultima = trobades[0][0], trobades[-1][0]
+    capcalera = next((l.strip() for l in reversed(linies[:primera]) if l.strip()), None)
+    peu = next((l.strip() for l in linies[ultima + 1:] if l.strip()), None)
+    return {"fila": fila, "capcalera": capcalera, "peu": peu}
+
+
+class Plantilla:
+    def __init__(self, dades):
+        self.dades = dades
+        self.camps = {camp: _regex_camp(ancora) for camp, ancora in dades.get("ancores", {}).items()}
+        self.formes = {camp: re.compile(f) for camp, f in dades.get("formes", {}).items()}
+        linies = dades.get("linies")
+        self.fila = re.compile(linies["fila"]) if linies else None
+        self.capcalera = re.compile(rf"^{_patro(linies['capcalera'])}$") if linies and linies.get("capcalera") else None
+        self.peu = re.compile(rf"^{_patro(linies['peu'])}$") if linies and linies.get("peu") else None
+
+    def _linies(self, text):
+        productes, imports = [], []
+        dins = self.capcalera is None
+        for linia in text.splitlines():
+            net = linia.strip()
+            if not dins:
+                dins = bool(self.capcalera.match(net))
+                continue
+            if self.peu is not None and self.peu.match(net):
+                break
+            m = self.fila.match(linia)
+            if m:
+                import_ = m.group('import').strip()
+                if not re.search(MONEDA_RE, import_.upper()):
+                    import_ = self.dades.get("simbol", "") + import_
+                productes.append(m.group('producte').strip())
+                imports.append(import_)
+        return productes, imports
+
+    def extreu(self, text):
+        # Camps en el format de la resposta del LLM (llistes per a Productes/Imports), sense validar
+        obj = {}
+        for camp in CAMPS_ESCALARS:
+            regex = self.camps.get(camp)
+            m = regex.search(text) if regex is not None else None
+            obj[camp] = m.group('valor').strip() if m else self.dades.get("constants", {}).get(camp, '')
+        obj["Productes"], obj["Imports"] = self._linies(text) if self.fila is not None else ([], [])
+        return obj
+
+    def valida(self, obj):
+        # Retorna els camps validats (com valida_camps) o None si la plantilla no encaixa amb aquest text
+        registre, falten = valida_camps(obj)
+        if falten or len(obj["Productes"]) != len(obj["Imports"]):
+            return None
+        if any(not f.match(registre.get(camp, '')) for camp, f in self.formes.items()):
+            return None
+        if normalitza_dates([registre["Data"]])['DataRevisar'].iloc[0]:
+            return None
+        return registre
+
+
+@functools.lru_cache(maxsize=256)
+def _compila(text_plantilla):
+    return Plantilla(json.loads(text_plantilla))
+
+
+def apren(text, registre):
+    # Plantilla a partir del text d'una factura i dels seus camps confirmats; None si no reprodueix la factura
+    linies = (text or '').splitlines()
+    ancores, constants, formes = {}, {}, {}
+    for camp in CAMPS_ESCALARS:
+        valor = str(registre.get(camp) or '').strip()
+        if not valor or valor.lower() == 'nan':
+            continue
+        ancora = _apren_camp(linies, valor)
+        if ancora is not None:
+            m = _regex_camp(ancora).search(text)
+            if m and m.group('valor').strip() == valor:
+                ancores[camp] = ancora
+        if camp in CAMPS_CONSTANTS:
+            constants[camp] = valor
+        if camp in CAMPS_FORMA:
+            formes[camp] = forma(valor)
+    productes = parse_llista(registre.get("Productes"))
+    imports = parse_llista(registre.get("Imports"))
+    if not productes or len(productes) != len(imports):
+        return None
+    monedes = parse_amounts(imports)['Moneda']
+    dades = {
+        "versio": PLANTILLA_VERSIO, "ancores": ancores, "constants": constants, "formes": formes,
+        "linies": _apren_linies(linies, productes, imports), "simbol": simbol_moneda(monedes.iloc[0]),
+    }
+    if dades["linies"] is None:
+        return None
+    plantilla = Plantilla(dades)
+    obj = plantilla.extreu(text)
+    if obj["Productes"] != productes or plantilla.valida(obj) is None:
+        return None
+    return dades
+
+
+class TemplateStore:
+    # Plantilles per emissor (clau 'nif:...' o 'disseny:...') en SQLite, amb comptadors d'encerts i fallades,
+    # i el text d'origen de les factures extretes pendents de confirmar a l'editor (d'on s'aprenen les plantilles)
+    def __init__(self, path=None):
+        self.path = path or os.path.join(os.path.dirname(__file__), '../plantilles.sqlite')
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS plantilles ("
+                "clau TEXT PRIMARY KEY, emisor TEXT, plantilla TEXT NOT NULL, "
+                "encerts INTEGER NOT NULL DEFAULT 0, fallades INTEGER NOT NULL DEFAULT 0, actualitzada REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS origens ("
+                "factura_id INTEGER PRIMARY KEY, text TEXT NOT NULL, metode TEXT, ts REAL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS comptadors (resultat TEXT PRIMARY KEY, n INTEGER NOT NULL DEFAULT 0)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _compta(self, conn, resultat, clau=None):
+        conn.execute("INSERT OR IGNORE INTO comptadors (resultat) VALUES (?)", (resultat,))
+        conn.execute("UPDATE comptadors SET n = n + 1 WHERE resultat = ?", (resultat,))
+        if clau is not None:
+            camp = "encerts" if resultat == "encert" else "fallades"
+            conn.execute(f"UPDATE plantilles SET {camp} = {camp} + 1 WHERE clau = ?", (clau,))
+
+    def extract(self, text):
+        # Retorna (camps, clau) si alguna plantilla de l'emissor extreu una factura vàlida; (None, None) si no.
+        # Cada crida compta un sol resultat: encert (a la plantilla que ha encaixat), fallada o sense_plantilla.
+        claus = claus_candidates(text)
+        with self._connect() as conn:
+            marques = ",".join("?" * len(claus))
+            trobades = dict(conn.execute(f"SELECT clau, plantilla FROM plantilles WHERE clau IN ({marques})", claus))
+            if not trobades:
+                self._compta(conn, "sense_plantilla")
+                return None, None
+            for clau in [c for c in claus if c in trobades]:
+                plantilla = _compila(trobades[clau])
+                registre = plantilla.valida(plantilla.extreu(text))
+                if registre is not None:
+                    self._compta(conn, "encert", clau)
+                    return registre, clau
+            # Cap plantilla ha validat: la fallada s'atribueix a la primera candidata (la del NIF, si n'hi ha)
+            self._compta(conn, "fallada", next(c for c in claus if c in trobades))
+        return None, None
+
+    def learn(self, text, registre):
+        # Aprèn (o substitueix) la plantilla de l'emissor; retorna la clau o None si no se n'ha pogut fer cap
+        dades = apren(text, registre)
+        if dades is None:
+            return None
+        propis = [n for n in nifs(str(registre.get("DadesEmisor") or '')) if n in nifs(text)]
+        clau = f"nif:{propis[0]}" if propis else f"disseny:{empremta_disseny(text)}"
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO plantilles (clau, emisor, plantilla, actualitzada) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (clau) DO UPDATE SET emisor = excluded.emisor, plantilla = excluded.plantilla, "
+                "actualitzada = excluded.actualitzada",
+                (clau, str(registre.get("Emisor") or ''), json.dumps(dades, ensure_ascii=False), time.time()),
+            )
+        return clau
+
+    def record_origins(self, ids, origens):
+        # origens: [{'text', 'metode'} o None] alineat amb els ids de les factures desades
+        files = [(int(i), o["text"], o.get("metode"), time.time()) for i, o in zip(ids, origens) if o and o.get("text")]
+        if files:
+            with self._connect() as conn:
+                conn.executemany("INSERT OR REPLACE INTO origens (factura_id, text, metode, ts) VALUES (?, ?, ?, ?)", files)
+
+    def take_origins(self, ids):
+        # {factura_id: {'text', 'metode'}} de les factures indicades, que deixen d'estar pendents
+        ids = [int(i) for i in ids]
+        origens = {}
+        with self._connect() as conn:
+            for i in range(0, len(ids), 500):
+                bloc = ids[i:i + 500]
+                marques = ",".join("?" * len(bloc))
+                for factura_id, text, metode in conn.execute(
+                        f"SELECT factura_id, text, metode FROM origens WHERE factura_id IN ({marques})", bloc):
+                    origens[factura_id] = {"text": text, "metode": metode}
+                conn.execute(f"DELETE FROM origens WHERE factura_id IN ({marques})", bloc)
+        return origens
+
+    def stats(self):
+        # {'encerts', 'fallades', 'sense_plantilla', 'taxa_encert', 'plantilles'} de totes les extraccions
+        with self._connect() as conn:
+            resultat = {r: 0 for r in ("encert", "fallada", "sense_plantilla")}
+            resultat.update(conn.execute("SELECT resultat, n FROM comptadors"))
+            n = conn.execute("SELECT COUNT(*) FROM plantilles").fetchone()[0]
+        total = sum(resultat.values())
+        return {"encerts": resultat["encert"], "fallades": resultat["fallada"],
+                "sense_plantilla": resultat["sense_plantilla"], "plantilles": n,
+                "taxa_encert": round(resultat["encert"] / total, 3) if total else None}
+
+    def per_template(self):
+        # Una fila (Clau, Emisor, Encerts, Fallades) per plantilla, per a la taula de diagnòstic
+        with self._connect() as conn:
+            return [
+                {"Clau": clau, "Emisor": emisor, "Encerts": encerts, "Fallades": fallades}
+                for clau, emisor, encerts, fallades in
+                conn.execute("SELECT clau, emisor, encerts, fallades FROM plantilles ORDER BY encerts DESC")
+            ]
@@ -0,0 +1,109 @@
+import itertools
+import json
+import re
+
+import pandas as pd
+
+from data.store import COLUMNES
+from utils.file_parser import CHUNK_ROWS, obre_text
+
+
+CAPCALERA_FACTURA = 'Numero de Factura'
+EMAIL_RE = re.compile(r'[\w\.-]+@[\w\.-]+')
+# 'Producte 3' / 'Import 3': camps de línia, seguits del seu número de posició
+CAMPS_LINIA = ('Producte', 'Import')
+# Codificador reutilitzat: json.dumps amb opcions en crea un de nou a cada crida
+_JSON = json.JSONEncoder(ensure_ascii=False)
+
+
+def _camp(nom):
+    def assigna(registre, valor):
+        registre[nom] = valor
+    return assigna
+
+
+def _dades(sufix):
+    # 'Dades_X: adreça i correu' -> AdrecaX i EmailX
+    def assigna(registre, valor):
+        email = EMAIL_RE.search(valor)
+        registre['Adreca' + sufix] = EMAIL_RE.sub('', valor).strip() if email else valor
+        registre['Email' + sufix] = email.group(0) if email else ''
+    return assigna
+
+
+# Taula de dispatx: etiqueta de la línia -> funció que en desa el valor al registre
+CAMPS_TXT = {
+    CAPCALERA_FACTURA: _camp('NumeroFactura'),
+    'Tipus Factura': _camp('TipusFactura'),
+    'Pagador': _camp('Pagador'),
+    'Dades_Pagador': _dades('Pagador'),
+    'Emisor': _camp('Emisor'),
+    'Dades_Emisor': _dades('Emisor'),
+    'Data': _camp('Data'),
+}
+
+
+def _tanca(registre, linies):
+    # Productes i Imports s'alineen pel número de línia i es desen com a llistes JSON
+    productes, imports = linies
+    posicions = sorted(productes.keys() | imports.keys())
+    if not posicions:
+        registre['Productes'] = registre['Imports'] = ''
+        return registre
+    registre['Productes'] = _JSON.encode([productes.get(p, '') for p in posicions])
+    registre['Imports'] = _JSON.encode([imports.get(p, '') for p in posicions])
+    return registre
+
+
+def itera_factures(linies):
+    # Parser d'una sola passada: cada capçalera 'Numero de Factura:' obre una factura nova
+    # i es retorna un registre (dict) per factura. Les línies sense etiqueta coneguda s'ignoren.
+    registre, posicions = None, ({}, {})
+    for linia in linies:
+        clau, sep, valor = linia.partition(':')
+        if not sep:
+            continue
+        clau = clau.strip()
+        assigna = CAMPS_TXT.get(clau)
+        if assigna is not None:
+            if clau == CAPCALERA_FACTURA:
+                if registre is not None:
+                    yield _tanca(registre, posicions)
+                registre, posicions = {}, ({}, {})
+            elif registre is None:
+                continue
+            assigna(registre, valor.strip())
+            continue
+        if registre is None:
+            continue
+        camp, _, posicio = clau.partition(' ')
+        if posicio.isdigit() and camp in CAMPS_LINIA:
+            posicions[camp == 'Import'][int(posicio)] = valor.strip()
+    if registre is not None:
+        yield _tanca(registre, posicions)
+
+
+def es_txt_factura(text):
+    return (CAPCALERA_FACTURA + ':') in text
+
+
+def parse_factures_txt(font):
+    # Llegeix en streaming una ruta o un fitxer binari (UploadedFile) amb una o més factures
+    f = obre_text(font)
+    try:
+        yield from itera_factures(f)
+    finally:
+        if isinstance(font, str):
+            f.close()
+        else:
+            f.detach()
+
+
+def blocs_factures(font, chunksize=CHUNK_ROWS):
+    # DataFrames de com a màxim chunksize factures, per desar-les al magatzem per blocs
+    factures = parse_factures_txt(font)
+    while True:
+        bloc = list(itertools.islice(factures, chunksize))
+        if not bloc:
+            return
+        yield pd.DataFrame(bloc).reindex(columns=COLUMNES)
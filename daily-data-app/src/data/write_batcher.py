@@ -0,0 +1,72 @@
+import threading
+from concurrent.futures import Future
+
+
+class WriteBatcher:
+    # Escriptura diferida amb un sol fil escriptor per procés: les insercions petites que arriben de diversos fils
+    # (cua LLM, servei d'ingesta, sessions de Streamlit) s'agrupen en un sol store.append_many, és a dir, una sola
+    # transacció i un sol commit per lot. No hi ha cap espera artificial: mentre s'escriu un lot, les peticions
+    # noves s'acumulen i surten juntes al següent, de manera que com més càrrega, més grans són els lots.
+    def __init__(self, store, max_lots=256):
+        self.store = store
+        self.max_lots = max_lots
+        self._pendents = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._tancat = False
+        # Lots escrits i peticions que contenien (per a la telemetria i el benchmark)
+        self.commits = 0
+        self.peticions = 0
+
+    def submit(self, df, fitxers=None):
+        # Retorna un Future amb els ids de les files noves ([] si el fitxer ja s'havia ingerit)
+        futur = Future()
+        with self._cond:
+            if self._tancat:
+                raise RuntimeError("L'escriptor del magatzem ja s'ha tancat.")
+            self._pendents.append((df, fitxers, futur))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="write-batcher")
+                self._thread.start()
+            self._cond.notify()
+        return futur
+
+    def append(self, df, fitxers=None):
+        return self.submit(df, fitxers).result()
+
+    def flush(self):
+        # Espera que s'hagin escrit totes les peticions enviades fins ara
+        self.submit(None).result()
+
+    def close(self):
+        with self._cond:
+            self._tancat = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pendents and not self._tancat:
+                    self._cond.wait()
+                if not self._pendents:
+                    return
+                lot, self._pendents = self._pendents[:self.max_lots], self._pendents[self.max_lots:]
+            self._escriu(lot)
+
+    def _escriu(self, lot):
+        try:
+            resultats = self.store.append_many([(df, fitxers) for df, fitxers, _ in lot])
+        except Exception as e:
+            if len(lot) > 1:
+                # Una petició defectuosa no ha de fer fallar les altres del mateix lot
+                for peticio in lot:
+                    self._escriu([peticio])
+            else:
+                lot[0][2].set_exception(e)
+            return
+        self.commits += 1
+        self.peticions += len(lot)
+        for (_, _, futur), ids in zip(lot, resultats):
+            futur.set_result(ids)
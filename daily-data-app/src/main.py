@@ -1,15 +1,57 @@
 import streamlit as st
+from data.csv_import import InformeImportacio
 from data.data_manager import DataManager
+from data.ingest import BatchIngestor
+from data.llm_queue import ExtractionQueue
+from data.service import ServiceClient
+from ui.charts import px
 from ui.dashboard import Dashboard
+from ui.dashboard_cache import DashboardCache
 import numpy as np
 import pandas as pd
 import os
+from utils import telemetria
+from utils.geocoding import Geocoder
+from utils.telemetria import perfila, resum, spans_recents
 
 
 st.set_page_config(page_title="APP DE MANAGEMENT DE FACTURES I GASTOS", layout="wide")
 
-data_manager = DataManager()
-dashboard = Dashboard(data_manager)
+@st.cache_resource
+def get_data_manager():
+    # Un sol DataManager per procés: les dades es rellegeixen només quan canvia la versió del magatzem
+    return DataManager()
+
+
+@st.cache_resource
+def get_dashboard_cache():
+    return DashboardCache()
+
+
+@st.cache_resource
+def get_geocoder():
+    # La memòria del geocodificador es conserva entre reruns i sessions
+    return Geocoder()
+
+
+@st.cache_resource
+def get_extraction_queue():
+    # Una sola cua d'extracció compartida entre reruns i sessions
+    return ExtractionQueue(get_data_manager(), concurrency=int(os.environ.get("LLM_CONCURRENCY", 2)))
+
+
+@st.cache_resource
+def get_service_client():
+    # Amb FACTURES_SERVICE_URL, la ingesta i l'extracció es deleguen al servei (python -m data.service serve)
+    # i aquesta UI només llegeix i edita el magatzem
+    url = os.environ.get("FACTURES_SERVICE_URL")
+    return ServiceClient(url) if url else None
+
+
+data_manager = get_data_manager()
+dashboard = Dashboard(data_manager, geocoder=get_geocoder(), cache=get_dashboard_cache())
+service = get_service_client()
+extraction_queue = service if service is not None else get_extraction_queue()
 
 st.title("APP DE MANAGEMENT DE FACTURES I GASTOS")
 
@@ -17,14 +59,114 @@ uploaded_file = st.file_uploader("Carrega un fitxer .txt, .pdf o imatge", type=[
 file_type = None
 if uploaded_file is not None:
     file_type = uploaded_file.name.split('.')[-1].lower()
+    perfilar = st.checkbox("Perfila aquesta càrrega (cProfile)", key="perfila_carrega")
     if st.button("Processa fitxer"):
+        perfil = None
         try:
-            data_manager.load_data_from_any(uploaded_file, file_type)
-            st.success(f"Fitxer {file_type.upper()} carregat i processat!")
-            # Després de processar, esborra el fitxer de la memòria per evitar reprocessament
-            uploaded_file = None
+            with perfila(uploaded_file.name, actiu=perfilar) as perfil:
+                if service is not None:
+                    resultat = service.ingest(uploaded_file.name, uploaded_file.getvalue())
+                    if resultat.get("estat") == "en cua":
+                        st.info(f"Fitxer {file_type.upper()} enviat a la cua d'extracció del servei.")
+                    else:
+                        st.success(f"{resultat.get('factures', 0)} factures carregades pel servei.")
+                    for fila in resultat.get("rebutjades", []):
+                        st.warning(f"Línia {fila[0]} rebutjada: {fila[1]}")
+                elif file_type == "txt":
+                    resultat = data_manager.load_data_from_any(uploaded_file, file_type)
+                    if isinstance(resultat, InformeImportacio):
+                        st.success(f"Importades {resultat.importades} factures en {resultat.segons:.1f} s.")
+                        if resultat.rebutjades:
+                            st.warning(f"{resultat.rebutjades} línies rebutjades (es mostren les primeres {len(resultat.exemples)}).")
+                            st.dataframe(resultat.rebutjades_df(), use_container_width=True)
+                    else:
+                        st.success(f"Fitxer {file_type.upper()} carregat i processat!")
+                else:
+                    # L'extracció amb el LLM es fa en segon pla; la UI continua responent
+                    data_manager.enqueue_extraction(uploaded_file, file_type, extraction_queue)
+                    st.info(f"Fitxer {file_type.upper()} enviat a la cua d'extracció.")
+                # Després de processar, esborra el fitxer de la memòria per evitar reprocessament
+                uploaded_file = None
         except RuntimeError as e:
             st.error(str(e))
+        if perfil is not None and perfil.ruta:
+            with st.expander("Perfil de la càrrega (cProfile)"):
+                st.code(perfil.resum)
+                with open(perfil.ruta, 'rb') as f:
+                    st.download_button("Descarrega el .prof", f.read(), file_name=os.path.basename(perfil.ruta))
+
+# --- Estat de la cua d'extracció ---
+# Si el servei no respon es mostra l'error i la resta de la pàgina (dades i dashboard) continua funcionant
+try:
+    feines = extraction_queue.jobs()
+    if feines:
+        st.subheader(f"Extraccions en curs: {extraction_queue.pending()}")
+        st.dataframe(pd.DataFrame(feines), use_container_width=True)
+        col_actualitza, col_neteja = st.columns(2)
+        with col_actualitza:
+            st.button("Actualitza estat")
+        with col_neteja:
+            if st.button("Neteja feines acabades"):
+                extraction_queue.clear_finished()
+except RuntimeError as e:
+    st.error(str(e))
+
+# --- Càrrega per lots: diversos fitxers alhora amb OCR en paral·lel ---
+with st.expander("Càrrega per lots"):
+    uploaded_files = st.file_uploader("Carrega diversos fitxers", type=["txt", "pdf", "png", "jpg", "jpeg"],
+                                      accept_multiple_files=True, key="uploader_lots")
+    if uploaded_files and st.button("Processa lot"):
+        barra = st.progress(0.0)
+        estat = st.empty()
+
+        def progress(res, fets, total):
+            barra.progress(fets / total)
+            estat.text(f"[{fets}/{total}] {res.nom}: {res.estat}")
+
+        if service is not None:
+            informe = []
+            for fet, fitxer in enumerate(uploaded_files, start=1):
+                try:
+                    resposta = service.ingest(fitxer.name, fitxer.getvalue())
+                    informe.append({"Fitxer": fitxer.name, "Estat": resposta.get("estat"), "Error": ""})
+                except RuntimeError as e:
+                    informe.append({"Fitxer": fitxer.name, "Estat": "error", "Error": str(e)})
+                barra.progress(fet / len(uploaded_files))
+                estat.text(f"[{fet}/{len(uploaded_files)}] {fitxer.name}: {informe[-1]['Estat']}")
+        else:
+            informe = BatchIngestor(data_manager, progress=progress).run(uploaded_files)
+        errors = [r for r in informe if r["Estat"] == "error"]
+        if errors:
+            st.warning(f"{len(errors)} de {len(informe)} fitxers no s'han pogut processar.")
+        else:
+            st.success(f"{len(informe)} fitxers carregats i processats!")
+        st.dataframe(pd.DataFrame(informe), use_container_width=True)
+
+# --- Diagnòstic: latència per etapa de la ingesta (spans recents d'aquest procés) ---
+with st.expander("Diagnòstic"):
+    spans = spans_recents()
+    if not spans:
+        st.info("Encara no s'ha registrat cap etapa en aquest procés.")
+    else:
+        st.dataframe(pd.DataFrame.from_dict(resum(spans), orient='index').round(1), use_container_width=True)
+        df_spans = pd.DataFrame(spans)
+        etapes = sorted(df_spans['etapa'].unique())
+        seleccionades = st.multiselect("Etapes", etapes, default=etapes, key="diagnostic_etapes")
+        fig = px.histogram(df_spans[df_spans['etapa'].isin(seleccionades)], x='ms', color='etapa', log_y=True,
+                           nbins=50, barmode='overlay', title='Latència per etapa (ms)')
+        st.plotly_chart(fig, use_container_width=True)
+        st.caption(f"Històric complet a {os.path.abspath(os.path.join(telemetria.DIRECTORI, telemetria.FITXER))}")
+    # Extraccions resoltes amb les plantilles apreses (sense LLM)
+    estadistiques = data_manager.templates.stats()
+    c1, c2, c3, c4 = st.columns(4)
+    taxa = estadistiques['taxa_encert']
+    c1.metric("Encerts de plantilla", "-" if taxa is None else f"{taxa:.0%}")
+    c2.metric("Extraccions sense LLM", estadistiques['encerts'])
+    c3.metric("Fallades (LLM)", estadistiques['fallades'] + estadistiques['sense_plantilla'])
+    c4.metric("Plantilles", estadistiques['plantilles'])
+    plantilles = data_manager.templates.per_template()
+    if plantilles:
+        st.dataframe(pd.DataFrame(plantilles), use_container_width=True, hide_index=True)
 
 st.header("GESTIÓ I EDICIÓ DE DADES")
 data_manager.edit_data()
@@ -1,29 +1,73 @@
 import subprocess
 import time
-from streamlit_desktop_app import start_desktop_app
-import webview
+import urllib.request
 import sys
 import os
 
-# Llança el servidor Streamlit en segon pla
-streamlit_proc = subprocess.Popen([
-    sys.executable, '-m', 'streamlit', 'run', os.path.join(os.path.dirname(__file__), 'main.py')
-])
+from data.service import HOST, PORT
+
+STREAMLIT_PORT = int(os.environ.get("STREAMLIT_PORT", 8501))
+STREAMLIT_URL = f"http://localhost:{STREAMLIT_PORT}"
+SERVICE_URL = os.environ.get("FACTURES_SERVICE_URL") or f"http://{HOST}:{PORT}"
+# Temps màxim d'espera perquè els servidors responguin al health check
+TIMEOUT_ARRENCADA = 60
+
+
+def espera_health(url, timeout=TIMEOUT_ARRENCADA, interval=0.1):
+    # Consulta l'endpoint de salut fins que respon 200 (en lloc d'esperar un temps fix)
+    limit = time.monotonic() + timeout
+    while time.monotonic() < limit:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as resposta:
+                if resposta.status == 200:
+                    return True
+        except OSError:
+            pass
+        time.sleep(interval)
+    return False
+
 
-# Espera uns segons perquè el servidor arrenqui
-# (pots ajustar el temps si cal)
-time.sleep(3)
+directori = os.path.dirname(os.path.abspath(__file__))
+entorn = {k: v for k, v in os.environ.items() if k != "FACTURES_SERVICE_URL"}
+processos = []
+
+# Servei d'ingesta i extracció (si no n'hi ha cap ja en marxa, p. ex. en un altre node)
+if not espera_health(SERVICE_URL + "/health", timeout=0.5):
+    processos.append(subprocess.Popen([sys.executable, '-m', 'data.service', 'serve'], cwd=directori, env=entorn))
+    # La UI només delega en el servei si respon; si no, fa la ingesta i l'extracció en el seu propi procés
+    if espera_health(SERVICE_URL + "/health"):
+        entorn["FACTURES_SERVICE_URL"] = SERVICE_URL
+    else:
+        print(f"Avís: el servei d'ingesta no respon a {SERVICE_URL}; la UI el substitueix amb la cua local",
+              file=sys.stderr)
+        processos.pop().terminate()
+else:
+    entorn["FACTURES_SERVICE_URL"] = SERVICE_URL
+
+# La UI de Streamlit és un client prim del servei (o treballa sola si el servei no ha arrencat)
+processos.append(subprocess.Popen([
+    sys.executable, '-m', 'streamlit', 'run', os.path.join(directori, 'main.py'),
+    '--server.headless', 'true', '--server.port', str(STREAMLIT_PORT)
+], cwd=directori, env=entorn))
+
+# pywebview s'importa mentre els servidors arrenquen, no abans
+import webview
 
-# Crea la finestra webview apuntant a la URL local de Streamlit
-webview.create_window(
-    'APP DE MANAGEMENT DE FACTURES I GASTOS',
-    'http://localhost:8501',
-    width=1200,
-    height=800
-)
+try:
+    if not espera_health(STREAMLIT_URL + "/_stcore/health"):
+        sys.exit(f"Streamlit no ha respost a {STREAMLIT_URL} en {TIMEOUT_ARRENCADA} s")
 
-# Inicia pywebview sense forçar backend (Cocoa s'usarà automàticament si pyobjc està instal·lat)
-webview.start()
+    # Crea la finestra webview apuntant a la URL local de Streamlit
+    webview.create_window(
+        'APP DE MANAGEMENT DE FACTURES I GASTOS',
+        STREAMLIT_URL,
+        width=1200,
+        height=800
+    )
 
-# Quan tanquem la finestra, matem el procés Streamlit
-streamlit_proc.terminate()
+    # Inicia pywebview sense forçar backend (Cocoa s'usarà automàticament si pyobjc està instal·lat)
+    webview.start()
+finally:
+    # Quan tanquem la finestra, matem els processos fills
+    for proces in processos:
+        proces.terminate()
@@ -0,0 +1,60 @@
+import math
+
+import pandas as pd
+import pytest
+
+from data.line_items import linies_de_factures, parse_imports, parse_llista
+from utils.amounts import parse_amounts
+
+
+@pytest.mark.parametrize("text, esperat", [
+    ("1.234,56 €", ["1.234,56 €"]),
+    ("2,50 €, 1,20 €", ["2,50 €", "1,20 €"]),
+    ("1,50 €, 2", ["1,50 €", "2"]),
+    ("12,5", ["12,5"]),
+    ("€85.00,€34.00", ["€85.00", "€34.00"]),
+    ("['€85.00', '€34.00']", ["€85.00", "€34.00"]),
+])
+def test_parse_llista(text, esperat):
+    assert parse_llista(text) == esperat
+
+
+@pytest.mark.parametrize("text, productes, esperat", [
+    # Sense espais, el nombre de productes decideix on són els separadors
+    ("2,50,1,20", 2, ["2,50", "1,20"]),
+    ("10,20", 2, ["10", "20"]),
+    ("10,20", 1, ["10,20"]),
+    ("85.00,34.00", 2, ["85.00", "34.00"]),
+    ("1.234,56 €", 1, ["1.234,56 €"]),
+    ("2,50 €, 1,20 €", 2, ["2,50 €", "1,20 €"]),
+])
+def test_parse_imports_segons_productes(text, productes, esperat):
+    assert parse_imports(text, productes) == (esperat, True)
+
+
+@pytest.mark.parametrize("text, productes", [
+    ("85.00,34.00", 1),
+    ("1,2,3", 2),
+    ("12,5", None),
+])
+def test_parse_imports_ambigus(text, productes):
+    assert parse_imports(text, productes)[1] is False
+
+
+def test_parse_amounts():
+    valors = parse_amounts(["1.234,56 €", "£1,234.56", "$12", "12,5"])
+    assert valors['Import'].tolist() == [1234.56, 1234.56, 12.0, 12.5]
+    assert valors['Moneda'].tolist() == ["EUR", "GBP", "USD", "EUR"]
+
+
+def test_linies_de_factures():
+    df = pd.DataFrame({
+        "Productes": ["Cable, Ratolí", "Cable, Ratolí", "Teclat"],
+        "Imports": ["2,50,1,20", "1,2,3", "1.234,56 €"],
+    })
+    linies = linies_de_factures(df, [1, 2, 3])
+    per_factura = linies.groupby('factura_id')
+    assert per_factura['Import'].sum(min_count=1).tolist()[0] == pytest.approx(3.70)
+    assert math.isnan(per_factura['Import'].sum(min_count=1).tolist()[1])
+    assert per_factura['Revisar'].max().tolist() == [0, 1, 0]
+    assert linies.loc[linies['factura_id'] == 3, 'Import'].tolist() == [1234.56]
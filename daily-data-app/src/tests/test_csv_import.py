@@ -0,0 +1,41 @@
+import io
+
+import pytest
+
+from data.csv_import import importa_delimitat
+from data.store import SQLiteInvoiceStore
+
+BONA = "F{};Carn;Joan;;;;ACME;;;;12/03/2024;a, b;2,50, 1,20"
+
+
+def export(n):
+    linies = [BONA.format(i) for i in range(n)] + ["F99;Carn;Joan;;;;ACME;;;;13/03/2024;a;x", "mal"]
+    return io.BytesIO("\n".join(linies).encode())
+
+
+def test_rebutjades_amb_camps_buits(tmp_path):
+    store = SQLiteInvoiceStore(str(tmp_path / "f.db"))
+    informe = importa_delimitat(store, export(5), nom="x", fitxers=[("h", "x")], chunksize=2)
+    assert (informe.importades, informe.rebutjades) == (5, 2)
+    assert "F99;Carn;Joan;;;;ACME;;;;13/03/2024;a;x" in informe.rebutjades_df()["Contingut"].tolist()
+    assert len(store.read()) == 5
+
+
+def test_importacio_tot_o_res(tmp_path, monkeypatch):
+    store = SQLiteInvoiceStore(str(tmp_path / "f.db"))
+    prepara, crides = store._prepara, []
+
+    def falla_al_tercer(df, ids=None):
+        crides.append(1)
+        if len(crides) == 3:
+            raise RuntimeError("bloc")
+        return prepara(df, ids)
+
+    monkeypatch.setattr(store, "_prepara", falla_al_tercer)
+    with pytest.raises(RuntimeError):
+        importa_delimitat(store, export(10), nom="x", fitxers=[("h", "x")], chunksize=2)
+    monkeypatch.setattr(store, "_prepara", prepara)
+    assert len(store.read()) == 0
+    # El fitxer no ha quedat registrat: es pot tornar a importar sencer
+    assert importa_delimitat(store, export(10), nom="x", fitxers=[("h", "x")], chunksize=2).importades == 10
+    assert importa_delimitat(store, export(10), nom="x", fitxers=[("h", "x")], chunksize=2).importades == 0
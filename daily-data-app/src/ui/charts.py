@@ -0,0 +1,26 @@
+import pandas as pd
+
+from utils.lazy import ModulLazy
+
+
+# plotly.express es carrega quan es dibuixa el primer gràfic
+px = ModulLazy("plotly.express")
+# Nombre màxim de categories que s'envien a cada gràfic; la resta s'agrupa a 'Altres'
+TOP_N = 15
+ALTRES = 'Altres'
+
+
+def top_n(df, categoria, valor, n=TOP_N, altres=ALTRES):
+    # Agrega al servidor per categoria i conserva les n més grans; la resta se suma en una sola fila
+    agregat = df.groupby(categoria, as_index=False)[valor].sum().sort_values(valor, ascending=False)
+    if len(agregat) > n:
+        resta = pd.DataFrame({categoria: [altres], valor: [agregat[valor].iloc[n:].sum()]})
+        agregat = pd.concat([agregat.iloc[:n], resta], ignore_index=True)
+    return agregat.reset_index(drop=True)
+
+
+def amb_percentatge(df, valor):
+    total = df[valor].sum()
+    df = df.copy()
+    df['Percentatge'] = df[valor] / total * 100 if total else 0
+    return df
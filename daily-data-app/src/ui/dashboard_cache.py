@@ -0,0 +1,130 @@
+import threading
+
+import pandas as pd
+
+from data.product_index import InvertedIndex
+from utils.geocoding import normalitza_codi_postal
+
+
+# Tipus d'ubicació del mapa i columna d'adreça corresponent
+COLUMNES_UBICACIO = [("Pagador", "AdrecaPagador"), ("Emisor", "AdrecaEmisor")]
+# Noms que es mostren com a màxim a la finestra d'un marcador
+NOMS_MARCADOR = 3
+
+
+def prepara_factures(df):
+    # Columnes derivades que el Dashboard necessita: Data com a datetime, Mes i TotalFactura numèric.
+    # La data ja arriba normalitzada pel magatzem (DataISO), aquí només es converteix el tipus.
+    df = df.copy()
+    df['Data'] = pd.to_datetime(df['DataISO'], format='%Y-%m-%d', errors='coerce') if 'DataISO' in df.columns else pd.NaT
+    df['Mes'] = df['Data'].dt.to_period('M')
+    df['TotalFactura'] = pd.to_numeric(df['TotalFactura'], errors='coerce').fillna(0) if 'TotalFactura' in df.columns else 0.0
+    return df
+
+
+def prepara_ubicacions(df):
+    # Una fila per factura i tipus d'adreça amb el codi postal normalitzat (un sol cop per adreça diferent)
+    parts = []
+    for tipus, col in COLUMNES_UBICACIO:
+        if col not in df.columns:
+            continue
+        adreces = df[col].dropna().astype(str).str.strip()
+        adreces = adreces[(adreces != '') & (adreces.str.lower() != 'nan')]
+        codis = {a: normalitza_codi_postal(a) for a in adreces.unique()}
+        noms = df.loc[adreces.index, tipus].astype(str) if tipus in df.columns else pd.Series('', index=adreces.index)
+        parts.append(pd.DataFrame({'factura_id': adreces.index, 'Tipus': tipus,
+                                   'Nom': noms.to_numpy(), 'Codi': adreces.map(codis).to_numpy()}))
+    if not parts:
+        return pd.DataFrame(columns=['factura_id', 'Tipus', 'Nom', 'Codi'])
+    ubicacions = pd.concat(parts, ignore_index=True)
+    return ubicacions[ubicacions['Codi'] != '']
+
+
+def prepara_resum(resum):
+    # El resum persistent del magatzem (Mes × TipusFactura × Emisor) amb el mes com a període
+    resum = resum.copy()
+    resum['Mes'] = pd.PeriodIndex(resum['Mes'], freq='M')
+    return resum
+
+
+class DashboardCache:
+    # Càlculs derivats del Dashboard (dates parsejades i índex de productes), calculats un cop per
+    # versió de dades. Si des de l'última versió només hi ha hagut insercions, s'actualitzen
+    # incrementalment amb les files noves en lloc de recalcular-ho tot. Els agregats (cub) no es
+    # calculen aquí: es llegeixen del resum que el magatzem manté a cada escriptura.
+    def __init__(self):
+        self.versio = None
+        self.max_id = 0
+        self.df = None
+        # Índexs invertits producte normalitzat -> factures i emissor -> factures
+        self.index_productes = InvertedIndex()
+        self.index_emissors = InvertedIndex()
+        self.cub = None
+        # Adreces de pagadors i emissors per codi postal, i els últims marcadors calculats (versió i filtre)
+        self.ubicacions = None
+        self._marcadors = None
+        self._lock = threading.Lock()
+
+    @property
+    def productes(self):
+        return self.index_productes.labels()
+
+    @property
+    def mesos(self):
+        return sorted(self.cub['Mes'].dropna().unique()) if self.cub is not None else []
+
+    def refresh(self, data_manager):
+        with self._lock:
+            versio, versio_destructiva = data_manager.store.version()
+            if self.df is not None and versio == self.versio:
+                return self
+            dades = data_manager.get_data()
+            linies = data_manager.get_lines()
+            if self.df is not None and versio_destructiva <= self.versio:
+                self._afegeix(dades[dades.index > self.max_id], linies[linies['factura_id'] > self.max_id])
+            else:
+                self._reconstrueix(dades, linies)
+            self.cub = prepara_resum(data_manager.get_summary())
+            self.max_id = int(self.df.index.max()) if not self.df.empty else 0
+            self.versio = versio
+            return self
+
+    def marcadors(self, ids, geocoder):
+        # Un marcador per ubicació (tipus i codi postal) amb el nombre de factures del filtre actual.
+        # Es reutilitza mentre no canviïn ni les dades ni el filtre.
+        clau = (self.versio, frozenset(ids))
+        if self._marcadors is not None and self._marcadors[0] == clau:
+            return self._marcadors[1]
+        ubicacions = self.ubicacions[self.ubicacions['factura_id'].isin(ids)]
+        coordenades = geocoder.geocode_many(ubicacions['Codi'].unique())
+        grups = ubicacions.groupby(['Tipus', 'Codi'], sort=False).agg(
+            Factures=('factura_id', 'nunique'), Noms=('Nom', lambda noms: list(noms.unique())))
+        marcadors = []
+        for (tipus, codi), factures, noms in zip(grups.index, grups['Factures'], grups['Noms']):
+            lat, lon = coordenades.get(codi, (None, None))
+            if lat and lon:
+                text_noms = ', '.join(noms[:NOMS_MARCADOR]) + (f" i {len(noms) - NOMS_MARCADOR} més" if len(noms) > NOMS_MARCADOR else '')
+                marcadors.append((lat, lon, tipus, f"{tipus}: {text_noms}<br>Codi postal: {codi}<br>Factures: {factures}"))
+        self._marcadors = (clau, marcadors)
+        return marcadors
+
+    def _indexa(self, df, linies):
+        self.index_productes.add(linies['ProducteNorm'].fillna(''), linies['factura_id'], linies['Producte'])
+        if 'Emisor' in df.columns:
+            emissors = df['Emisor'].astype(str)
+            self.index_emissors.add(emissors, df.index, emissors)
+
+    def _reconstrueix(self, dades, linies):
+        self.df = prepara_factures(dades)
+        self.ubicacions = prepara_ubicacions(dades)
+        self.index_productes = InvertedIndex()
+        self.index_emissors = InvertedIndex()
+        self._indexa(self.df, linies)
+
+    def _afegeix(self, noves, linies_noves):
+        if noves.empty:
+            return
+        self.ubicacions = pd.concat([self.ubicacions, prepara_ubicacions(noves)], ignore_index=True)
+        noves = prepara_factures(noves)
+        self.df = pd.concat([self.df, noves])
+        self._indexa(noves, linies_noves)
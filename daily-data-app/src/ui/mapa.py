@@ -0,0 +1,17 @@
+from utils.lazy import ModulLazy
+
+
+# folium i streamlit_folium només es carreguen quan es pinta el mapa
+folium = ModulLazy("folium")
+streamlit_folium = ModulLazy("streamlit_folium")
+
+CENTRE = [41.4, 2.16]
+COLORS = {"Pagador": "blue", "Emisor": "green"}
+
+
+def mapa_ubicacions(marcadors, width=350, height=250, centre=CENTRE, zoom=6):
+    # marcadors: [(lat, lon, tipus, popup)]; pinta el mapa a Streamlit
+    m = folium.Map(location=centre, zoom_start=zoom, tiles='CartoDB positron', width=width, height=height)
+    for lat, lon, tipus, popup in marcadors:
+        folium.Marker(location=[lat, lon], popup=popup, icon=folium.Icon(color=COLORS.get(tipus, 'gray'))).add_to(m)
+    return streamlit_folium.st_folium(m, width=width, height=height, returned_objects=[])
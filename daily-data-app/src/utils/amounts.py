@@ -0,0 +1,35 @@
+import pandas as pd
+
+
+# Símbols i codis reconeguts -> codi ISO 4217
+ALIAS_MONEDA = {'€': 'EUR', 'EUR': 'EUR', '$': 'USD', 'USD': 'USD', '£': 'GBP', 'GBP': 'GBP'}
+MONEDA_DEFECTE = 'EUR'
+
+MONEDA_RE = r'(€|\$|£|EUR|USD|GBP)'
+# Un sol tipus de separador seguit sempre de grups de 3 xifres: són separadors de milers (1.234 / 1,234,567)
+MILERS_RE = r'-?[1-9]\d{0,2}(?:[.,]\d{3})+'
+
+
+def parse_amounts(valors, moneda_defecte=MONEDA_DEFECTE):
+    # Converteix una sèrie d'imports en text a dues columnes: Import (float) i Moneda (ISO).
+    # Regles deterministes per al separador decimal:
+    #  - si hi ha coma i punt, el decimal és el que apareix en últim lloc (1.234,56 / 1,234.56)
+    #  - si només n'hi ha un tipus i tots els grups són de 3 xifres, són milers (1.234 -> 1234)
+    #  - altrament, el separador és decimal (100,50 / 100.50)
+    text = pd.Series(valors, dtype=object).fillna('').astype(str).str.strip()
+    moneda = text.str.upper().str.extract(MONEDA_RE, expand=False).map(ALIAS_MONEDA).fillna(moneda_defecte)
+
+    num = text.str.replace(r'[^\d,.\-]', '', regex=True)
+    te_coma = num.str.contains(',', regex=False)
+    te_punt = num.str.contains('.', regex=False)
+    tots_dos = te_coma & te_punt
+    milers = num.str.fullmatch(MILERS_RE).fillna(False) & ~tots_dos
+
+    coma_decimal = (tots_dos & (num.str.rfind(',') > num.str.rfind('.'))) | (te_coma & ~te_punt & ~milers)
+    punt_decimal = (tots_dos & ~coma_decimal) | (te_punt & ~te_coma & ~milers)
+
+    net = num.where(~coma_decimal, num.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    net = net.where(~punt_decimal, net.str.replace(',', '', regex=False))
+    net = net.where(~milers, net.str.replace(r'[.,]', '', regex=True))
+
+    return pd.DataFrame({'Import': pd.to_numeric(net, errors='coerce'), 'Moneda': moneda}, index=text.index)
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+
+MAX_BYTES = 200 * 1024 * 1024
+
+
+def sha256_bytes(dades):
+    return hashlib.sha256(dades).hexdigest()
+
+
+def sha256_fitxer(font, bloc=1 << 20):
+    # Hash d'una ruta o objecte tipus fitxer llegint-lo per blocs (no el carrega sencer a memòria)
+    h = hashlib.sha256()
+    f = open(font, 'rb') if isinstance(font, str) else font
+    try:
+        if not isinstance(font, str):
+            f.seek(0)
+        for dades in iter(lambda: f.read(bloc), b''):
+            h.update(dades)
+    finally:
+        if isinstance(font, str):
+            f.close()
+        else:
+            f.seek(0)
+    return h.hexdigest()
+
+
+def clau_composta(*parts):
+    # Hash estable de diverses parts (p. ex. versió del prompt, model i text d'entrada)
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class DiskCache:
+    # Memòria cau en disc (SQLite) adreçada per contingut, amb espais de noms ('ocr', 'llm', ...),
+    # expulsió LRU quan se supera max_bytes i comptadors persistents d'encerts i fallades.
+    def __init__(self, path=None, max_bytes=MAX_BYTES):
+        self.path = path or os.path.join(os.path.dirname(__file__), '../cache.sqlite')
+        self.max_bytes = max_bytes
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entrades ("
+                "espai TEXT NOT NULL, clau TEXT NOT NULL, valor TEXT NOT NULL, mida INTEGER NOT NULL, "
+                "ultim_acces REAL NOT NULL, PRIMARY KEY (espai, clau))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entrades_acces ON entrades (ultim_acces)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS comptadors ("
+                "espai TEXT PRIMARY KEY, encerts INTEGER NOT NULL DEFAULT 0, fallades INTEGER NOT NULL DEFAULT 0)"
+            )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _compta(self, conn, espai, encert):
+        conn.execute("INSERT OR IGNORE INTO comptadors (espai) VALUES (?)", (espai,))
+        camp = "encerts" if encert else "fallades"
+        conn.execute(f"UPDATE comptadors SET {camp} = {camp} + 1 WHERE espai = ?", (espai,))
+
+    def get(self, espai, clau, default=None):
+        with self._connect() as conn:
+            row = conn.execute("SELECT valor FROM entrades WHERE espai = ? AND clau = ?", (espai, clau)).fetchone()
+            self._compta(conn, espai, row is not None)
+            if row is None:
+                return default
+            conn.execute("UPDATE entrades SET ultim_acces = ? WHERE espai = ? AND clau = ?", (time.time(), espai, clau))
+        return json.loads(row[0])
+
+    def set(self, espai, clau, valor):
+        text = json.dumps(valor, ensure_ascii=False)
+        mida = len(text.encode('utf-8'))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entrades (espai, clau, valor, mida, ultim_acces) VALUES (?, ?, ?, ?, ?)",
+                (espai, clau, text, mida, time.time()),
+            )
+            self._expulsa(conn)
+
+    def _expulsa(self, conn):
+        # Elimina les entrades menys usades recentment fins a tornar sota el límit
+        total = conn.execute("SELECT COALESCE(SUM(mida), 0) FROM entrades").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        esborrar = []
+        for espai, clau, mida in conn.execute("SELECT espai, clau, mida FROM entrades ORDER BY ultim_acces"):
+            if total <= self.max_bytes:
+                break
+            esborrar.append((espai, clau))
+            total -= mida
+        conn.executemany("DELETE FROM entrades WHERE espai = ? AND clau = ?", esborrar)
+
+    def stats(self):
+        # {espai: {'encerts', 'fallades', 'entrades', 'bytes'}}
+        resultat = {}
+        with self._connect() as conn:
+            for espai, encerts, fallades in conn.execute("SELECT espai, encerts, fallades FROM comptadors"):
+                resultat[espai] = {"encerts": encerts, "fallades": fallades, "entrades": 0, "bytes": 0}
+            for espai, n, mida in conn.execute("SELECT espai, COUNT(*), SUM(mida) FROM entrades GROUP BY espai"):
+                resultat.setdefault(espai, {"encerts": 0, "fallades": 0})
+                resultat[espai].update(entrades=n, bytes=mida)
+        return resultat
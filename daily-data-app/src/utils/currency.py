@@ -0,0 +1,106 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.amounts import ALIAS_MONEDA, MONEDA_DEFECTE
+
+
+# Taules de tipus de canvi locals (sense xarxa). Dos formats acceptats:
+#  - llarg: data,moneda,taxa (una fila per data i moneda)
+#  - ample del BCE (eurofxref-hist.csv): Date,USD,JPY,...,GBP (una columna per moneda)
+# La taxa són unitats de la moneda per 1 unitat de la moneda de referència del fitxer (EUR, convenció del BCE).
+FITXER_TAXES = os.environ.get("FX_RATES_PATH") or os.path.join(os.path.dirname(__file__), '../tipus_canvi.csv')
+MONEDA_REFERENCIA = 'EUR'
+# Moneda en què es desen TotalFactura i ImportBase i es mostren els totals del Dashboard
+MONEDA_BASE = os.environ.get("MONEDA_BASE", MONEDA_DEFECTE).upper()
+SIMBOLS = {codi: simbol for simbol, codi in ALIAS_MONEDA.items() if simbol != codi}
+
+
+def simbol_moneda(codi=MONEDA_BASE):
+    return SIMBOLS.get(codi, codi)
+
+
+def llegeix_taxes(ruta):
+    # DataFrame (Data, Moneda, Taxa) ordenat per data, en qualsevol dels dos formats
+    df = pd.read_csv(ruta, dtype=str, skipinitialspace=True)
+    columnes = {c.strip().lower(): c for c in df.columns}
+    if {'data', 'moneda', 'taxa'} <= set(columnes):
+        df = df.rename(columns={columnes['data']: 'Data', columnes['moneda']: 'Moneda', columnes['taxa']: 'Taxa'})
+    else:
+        data = df.columns[0]
+        df = df.melt(id_vars=[data], var_name='Moneda', value_name='Taxa').rename(columns={data: 'Data'})
+    df = pd.DataFrame({
+        'Data': pd.to_datetime(df['Data'], format='%Y-%m-%d', errors='coerce'),
+        'Moneda': df['Moneda'].astype(str).str.strip().str.upper(),
+        'Taxa': pd.to_numeric(df['Taxa'], errors='coerce'),
+    })
+    # El BCE marca amb N/A els dies sense cotització d'una moneda
+    df = df.dropna()
+    df = df[df['Taxa'] > 0]
+    return df.sort_values(['Data', 'Moneda'], kind='mergesort').reset_index(drop=True)
+
+
+class TaxesCanvi:
+    # Conversió vectoritzada d'imports a la moneda base amb la taxa vigent a la data de cada import
+    # (as-of: l'última cotització igual o anterior; si la data és anterior a tota la taula, la primera)
+    def __init__(self, taxes=None, base=MONEDA_BASE, ruta=None):
+        self.taxes = taxes if taxes is not None else pd.DataFrame(columns=['Data', 'Moneda', 'Taxa'])
+        self.base = base
+        self.ruta = ruta
+
+    @classmethod
+    def carrega(cls, ruta=None, base=MONEDA_BASE):
+        ruta = ruta or FITXER_TAXES
+        if not os.path.exists(ruta):
+            return cls(base=base)
+        return cls(llegeix_taxes(ruta), base=base, ruta=ruta)
+
+    def monedes(self):
+        return sorted(set(self.taxes['Moneda']) | {MONEDA_REFERENCIA})
+
+    def empremta(self):
+        # Canvia si canvien les taxes o la moneda base (els totals desats s'han de recalcular)
+        h = hashlib.sha256(self.base.encode())
+        h.update(pd.util.hash_pandas_object(self.taxes, index=False).to_numpy().tobytes())
+        return h.hexdigest()[:16]
+
+    def taxes_a(self, monedes, dates):
+        # Taxa (unitats de moneda per unitat de referència) de cada parell moneda/data, amb un sol merge_asof
+        monedes = pd.Series(monedes, dtype=object).reset_index(drop=True)
+        dates = pd.to_datetime(pd.Series(dates).reset_index(drop=True), errors='coerce')
+        taxa = pd.Series(np.nan, index=monedes.index)
+        if not self.taxes.empty and len(monedes):
+            # Sense data, la cotització més recent
+            consulta = pd.DataFrame({'Data': dates.fillna(self.taxes['Data'].iloc[-1]),
+                                     'Moneda': monedes.fillna('').astype(object)})
+            consulta['ordre'] = consulta.index
+            consulta = consulta.sort_values('Data', kind='mergesort').reset_index(drop=True)
+            # merge_asof exigeix claus del mateix tipus: amb pandas 3, astype(str) dona StringDtype i no object
+            taxes = self.taxes[['Data', 'Moneda', 'Taxa']].astype({'Moneda': object})
+            enrere = pd.merge_asof(consulta, taxes, on='Data', by='Moneda', direction='backward')
+            endavant = pd.merge_asof(consulta, taxes, on='Data', by='Moneda', direction='forward')
+            taxa = pd.Series(enrere['Taxa'].fillna(endavant['Taxa']).to_numpy(), index=consulta['ordre']).sort_index()
+        return taxa.where(monedes != MONEDA_REFERENCIA, 1.0).to_numpy()
+
+    def converteix(self, imports, monedes, dates):
+        # Import en moneda base; NaN si no hi ha taxa per a la moneda (o per a la base)
+        imports = pd.to_numeric(pd.Series(imports).reset_index(drop=True), errors='coerce')
+        monedes = pd.Series(monedes, dtype=object).reset_index(drop=True).fillna(self.base)
+        resultat = imports.to_numpy() / self.taxes_a(monedes, dates)
+        if self.base != MONEDA_REFERENCIA:
+            resultat = resultat * self.taxes_a([self.base] * len(imports), dates)
+        # Els imports que ja són en moneda base no depenen de la taula
+        return np.where(monedes.to_numpy() == self.base, imports.to_numpy(), resultat)
+
+
+_taxes = None
+
+
+def taxes_per_defecte():
+    # Taula de FITXER_TAXES carregada un sol cop per procés
+    global _taxes
+    if _taxes is None:
+        _taxes = TaxesCanvi.carrega()
+    return _taxes
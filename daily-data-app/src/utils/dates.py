@@ -0,0 +1,64 @@
+import re
+
+import pandas as pd
+
+
+# Formats provats en passades vectoritzades, per ordre, sobre el text ja normalitzat amb guions.
+# El format americà (MM-DD-AAAA) només s'aplica quan el dia primer no és una data vàlida.
+FORMATS_DATA = ("%d-%m-%Y", "%Y-%m-%d", "%d-%m-%y", "%m-%d-%Y")
+
+# Noms de mes en català, castellà i anglès (sense accents) i abreviatures habituals a l'OCR
+MESOS = {
+    'gener': 1, 'gen': 1, 'enero': 1, 'ene': 1, 'january': 1, 'jan': 1,
+    'febrer': 2, 'febrero': 2, 'febr': 2, 'feb': 2, 'february': 2,
+    'marc': 3, 'marzo': 3, 'mar': 3, 'march': 3,
+    'abril': 4, 'abr': 4, 'april': 4, 'apr': 4,
+    'maig': 5, 'mayo': 5, 'may': 5,
+    'juny': 6, 'junio': 6, 'jun': 6, 'june': 6,
+    'juliol': 7, 'julio': 7, 'jul': 7, 'july': 7,
+    'agost': 8, 'agosto': 8, 'ago': 8, 'ag': 8, 'august': 8, 'aug': 8,
+    'setembre': 9, 'septiembre': 9, 'setiembre': 9, 'sept': 9, 'sep': 9, 'set': 9, 'september': 9,
+    'octubre': 10, 'oct': 10, 'october': 10,
+    'novembre': 11, 'noviembre': 11, 'nov': 11, 'november': 11,
+    'desembre': 12, 'diciembre': 12, 'des': 12, 'dic': 12, 'december': 12, 'dec': 12,
+}
+# Alternativa ordenada de més llarg a més curt perquè 'setembre' no es quedi en 'set'
+MES_RE = re.compile(r'\b(' + '|'.join(sorted(MESOS, key=len, reverse=True)) + r')\b\.?')
+# Format anglès amb el mes davant del dia ('January 25, 2016', 'Mar 5th 2024'): es passa a dia-mes
+MES_DIA_RE = re.compile(MES_RE.pattern + r'\s+(\d{1,2})(?:st|nd|rd|th)?\b')
+# Hora al final (10:30, 10:30:00, T10:30:00) que s'ignora
+HORA_RE = r'[ t]\d{1,2}:\d{2}.*$'
+
+
+def normalitza_text_data(valors):
+    # Minúscules sense accents, sense hora ni preposicions ('15 de març del 2024', "3 d'abril"),
+    # noms de mes convertits a número i tots els separadors unificats en guions
+    text = pd.Series(valors, dtype=object).fillna('').astype(str).str.strip().str.lower()
+    text = text.str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+    text = text.str.replace(HORA_RE, '', regex=True)
+    text = text.str.replace(r"\bd'|\bdel?\b", ' ', regex=True)
+    text = text.str.replace(MES_DIA_RE, lambda m: f" {m.group(2)} {MESOS[m.group(1)]} ", regex=True)
+    text = text.str.replace(MES_RE, lambda m: f" {MESOS[m.group(1)]} ", regex=True)
+    return text.str.replace(r'[\s/.,\-]+', '-', regex=True).str.strip('-')
+
+
+def parse_dates(valors):
+    # Retorna una sèrie datetime; els valors que cap format reconeix queden com a NaT
+    text = normalitza_text_data(valors)
+    dates = pd.Series(pd.NaT, index=text.index, dtype='datetime64[ns]')
+    for fmt in FORMATS_DATA:
+        falten = dates.isna() & (text != '')
+        if not falten.any():
+            break
+        dates[falten] = pd.to_datetime(text[falten], format=fmt, errors='coerce')
+    return dates
+
+
+def normalitza_dates(valors):
+    # Columnes derivades per al magatzem: DataISO ('AAAA-MM-DD' o None) i DataRevisar (1 si no s'ha pogut interpretar)
+    dates = parse_dates(valors)
+    iso = dates.dt.strftime('%Y-%m-%d')
+    return pd.DataFrame({
+        'DataISO': iso.astype(object).where(dates.notna(), None),
+        'DataRevisar': dates.isna().astype(int),
+    }, index=dates.index)
@@ -1,8 +1,46 @@
-def parse_txt_file(file_path):
-    data = []
+import csv
+import io
+
+
+# Files per bloc en la lectura en streaming; la memòria depèn d'aquest valor, no de la mida del fitxer
+CHUNK_ROWS = 50_000
+
+
+def obre_text(font, encoding='utf-8'):
+    # Obre una ruta o un objecte tipus fitxer binari (p. ex. UploadedFile) com a text, sense llegir-lo sencer
+    if isinstance(font, str):
+        return open(font, 'r', encoding=encoding, errors='replace', newline='')
+    font.seek(0)
+    return io.TextIOWrapper(font, encoding=encoding, errors='replace', newline='')
+
+
+def parse_txt_file(file_path, sep=','):
+    # Generador: retorna cada línia com a llista de camps a mesura que es llegeix
     with open(file_path, 'r') as file:
         for line in file:
             # Assuming each line in the .txt file is a record
-            record = line.strip().split(',')
-            data.append(record)
-    return data
\ No newline at end of file
+            yield line.strip().split(sep)
+
+
+def blocs_delimitats(font, sep=';', chunksize=CHUNK_ROWS, encoding='utf-8'):
+    # Llegeix un fitxer delimitat en blocs de com a màxim chunksize files.
+    # Cada bloc és una llista de (num_linia, camps); les línies buides s'ometen.
+    f = obre_text(font, encoding)
+    try:
+        lector = csv.reader(f, delimiter=sep)
+        bloc = []
+        for camps in lector:
+            if not camps or not any(c.strip() for c in camps):
+                continue
+            bloc.append((lector.line_num, camps))
+            if len(bloc) >= chunksize:
+                yield bloc
+                bloc = []
+        if bloc:
+            yield bloc
+    finally:
+        # L'embolcall de text no ha de tancar l'UploadedFile original
+        if isinstance(font, str):
+            f.close()
+        else:
+            f.detach()
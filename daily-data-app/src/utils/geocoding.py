@@ -0,0 +1,163 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from utils.lazy import ModulLazy
+
+
+requests = ModulLazy("requests")
+
+log = logging.getLogger(__name__)
+
+
+# Temps de vida dels resultats negatius (codis que el proveïdor no troba)
+NEGATIVE_TTL = 7 * 24 * 3600
+
+CODI_POSTAL_RE = re.compile(r'\b\d{5}\b')
+
+
+def normalitza_codi_postal(adreca):
+    # Extreu el codi postal d'una adreça: primer un codi de 5 xifres, si no l'últim mot
+    if adreca is None:
+        return ''
+    adreca = str(adreca).strip()
+    if not adreca or adreca.lower() == 'nan':
+        return ''
+    trobats = CODI_POSTAL_RE.findall(adreca)
+    if trobats:
+        return trobats[-1]
+    return adreca.split()[-1].strip(' ,.;').upper()
+
+
+class NominatimProvider:
+    # Proveïdor per defecte: API de Nominatim (OpenStreetMap), màxim 1 petició per segon
+    url = "https://nominatim.openstreetmap.org/search"
+
+    def __init__(self, min_interval=1.0, timeout=10, user_agent="streamlit-app"):
+        self.min_interval = min_interval
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self._last_request = 0.0
+        self._lock = threading.Lock()
+
+    def _espera_torn(self):
+        with self._lock:
+            espera = self._last_request + self.min_interval - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+            self._last_request = time.monotonic()
+
+    def geocode(self, postal_code, country):
+        # Retorna (lat, lon) o (None, None) si no es troba; llença excepció si hi ha error de xarxa
+        self._espera_torn()
+        response = requests.get(
+            self.url,
+            params={"postalcode": postal_code, "country": country, "format": "json", "limit": 1},
+            headers={"User-Agent": self.user_agent},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        data = response.json()
+        if data:
+            return float(data[0]['lat']), float(data[0]['lon'])
+        return None, None
+
+
+class Geocoder:
+    # Geocodificació amb memòria cau persistent (SQLite) per codi postal + país.
+    # El proveïdor és qualsevol objecte amb un mètode geocode(postal_code, country).
+    def __init__(self, provider=None, cache_path=None, country="Spain", negative_ttl=NEGATIVE_TTL):
+        self.provider = provider if provider is not None else NominatimProvider()
+        self.cache_path = cache_path or os.path.join(os.path.dirname(__file__), '../geocache.sqlite')
+        self.country = country
+        self.negative_ttl = negative_ttl
+        # Memòria del procés: (codi, país) -> (lat, lon, ts); els negatius caduquen com a la memòria cau
+        self._memo = {}
+        self._init_cache()
+
+    def _connect(self):
+        return sqlite3.connect(self.cache_path, timeout=30)
+
+    def _init_cache(self):
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocodes ("
+                "codi TEXT NOT NULL, pais TEXT NOT NULL, lat REAL, lon REAL, ts REAL NOT NULL, "
+                "PRIMARY KEY (codi, pais))"
+            )
+
+    def _llegeix_cache(self, codis, country):
+        ara = time.time()
+        trobats = {}
+        codis = list(codis)
+        with self._connect() as conn:
+            # Consulta per blocs per no superar el límit de paràmetres de SQLite
+            for i in range(0, len(codis), 500):
+                bloc = codis[i:i + 500]
+                marques = ','.join('?' * len(bloc))
+                rows = conn.execute(
+                    f"SELECT codi, lat, lon, ts FROM geocodes WHERE pais = ? AND codi IN ({marques})",
+                    [country] + bloc,
+                ).fetchall()
+                for codi, lat, lon, ts in rows:
+                    if lat is None and ara - ts > self.negative_ttl:
+                        # Resultat negatiu caducat: es tornarà a consultar
+                        continue
+                    trobats[codi] = (lat, lon, ts)
+        return trobats
+
+    def _desa_cache(self, resultats, country):
+        if not resultats:
+            return
+        ara = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO geocodes (codi, pais, lat, lon, ts) VALUES (?, ?, ?, ?, ?)",
+                [(codi, country, lat, lon, ara) for codi, (lat, lon) in resultats.items()],
+            )
+
+    def geocode_many(self, adreces, country=None):
+        # Retorna {codi_postal: (lat, lon)} per a totes les adreces, consultant només els codis no cachejats
+        country = country or self.country
+        codis = {normalitza_codi_postal(a) for a in adreces}
+        codis.discard('')
+        resultat = {}
+        pendents = set()
+        ara = time.time()
+        # Data de cada resultat, per fer caducar els negatius també a la memòria del procés
+        dates = dict.fromkeys(codis, ara)
+        for codi in codis:
+            memo = self._memo.get((codi, country))
+            if memo is not None and (memo[0] is not None or ara - memo[2] <= self.negative_ttl):
+                resultat[codi], dates[codi] = memo[:2], memo[2]
+            else:
+                pendents.add(codi)
+        if pendents:
+            de_cache = self._llegeix_cache(pendents, country)
+            for codi, (lat, lon, ts) in de_cache.items():
+                resultat[codi], dates[codi] = (lat, lon), ts
+            pendents -= set(de_cache)
+        nous = {}
+        fallits = set()
+        for codi in sorted(pendents):
+            try:
+                nous[codi] = self.provider.geocode(codi, country)
+            except Exception as e:
+                # Error de xarxa: no es desa, es tornarà a provar al següent rerun
+                log.warning("Error geocodificant %s: %s", codi, e)
+                fallits.add(codi)
+                resultat[codi] = (None, None)
+        self._desa_cache(nous, country)
+        resultat.update(nous)
+        for codi in codis - fallits:
+            self._memo[(codi, country)] = (*resultat[codi], dates[codi])
+        return resultat
+
+    def geocode(self, adreca, country=None):
+        codi = normalitza_codi_postal(adreca)
+        if not codi:
+            return None, None
+        return self.geocode_many([adreca], country).get(codi, (None, None))
@@ -0,0 +1,23 @@
+import importlib
+
+
+class ModulLazy:
+    # Substitut d'un mòdul que només s'importa el primer cop que se'n fa servir un atribut.
+    # Manté fora de l'arrencada les dependències pesades (OCR, LLM, mapes, gràfics) que moltes sessions no arriben a usar.
+    def __init__(self, nom):
+        self._nom = nom
+        self._modul = None
+
+    def carrega(self):
+        if self._modul is None:
+            self._modul = importlib.import_module(self._nom)
+        return self._modul
+
+    def carregat(self):
+        return self._modul is not None
+
+    def __getattr__(self, atribut):
+        return getattr(self.carrega(), atribut)
+
+    def __repr__(self):
+        return f"<ModulLazy {self._nom} ({'carregat' if self.carregat() else 'pendent'})>"
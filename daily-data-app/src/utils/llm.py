@@ -0,0 +1,13 @@
+from utils.lazy import ModulLazy
+
+
+# El client d'ollama (i httpx/pydantic) es carrega a la primera petició al LLM, no en arrencar la UI
+ollama = ModulLazy("ollama")
+
+
+def chat(**request):
+    return ollama.chat(**request)
+
+
+def client_asincron(host=None):
+    return ollama.AsyncClient(host=host)
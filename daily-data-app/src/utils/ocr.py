@@ -0,0 +1,308 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from utils.lazy import ModulLazy
+from utils.telemetria import registra, span
+
+# Els motors d'OCR i de PDF es carreguen en el primer ús, no en importar el gestor de dades
+pdf2image = ModulLazy("pdf2image")
+pdfplumber = ModulLazy("pdfplumber")
+pytesseract = ModulLazy("pytesseract")
+Image = ModulLazy("PIL.Image")
+ImageOps = ModulLazy("PIL.ImageOps")
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+OCR_LANG = 'cat+spa+eng'
+# Mínim de caràcters útils perquè la capa de text d'una pàgina es consideri vàlida
+MIN_CARACTERS_TEXT = 20
+# Rang i pas (graus) de la cerca de l'angle d'inclinació
+MAX_INCLINACIO = 5.0
+PAS_INCLINACIO = 0.5
+
+
+def _env_bool(nom, defecte):
+    valor = os.environ.get(nom)
+    return defecte if valor is None else valor.strip().lower() in ('1', 'true', 'si', 'sí', 'yes')
+
+
+class OcrConfig:
+    # Paràmetres de l'etapa d'OCR. Els valors per defecte es poden canviar amb variables d'entorn
+    # (OCR_DPI, OCR_LANG, OCR_GRAYSCALE, OCR_BINARIZE, OCR_DESKEW, OCR_TEXT_REGIONS, OCR_THREADS, OCR_PSM).
+    def __init__(self, dpi=300, lang=OCR_LANG, grayscale=True, binarize=False, deskew=False,
+                 text_regions=False, thread_count=1, psm=None):
+        self.dpi = dpi
+        # Cada idioma afegit és un model més que Tesseract carrega a cada crida
+        self.lang = lang
+        self.grayscale = grayscale
+        self.binarize = binarize
+        self.deskew = deskew
+        # Retalla la pàgina a la zona amb contingut abans de l'OCR (sense marges ni vores buides)
+        self.text_regions = text_regions
+        # Fils de pdftoppm: també és el nombre de pàgines rasteritzades que hi ha alhora en memòria
+        self.thread_count = max(1, thread_count)
+        self.psm = psm
+
+    @classmethod
+    def from_env(cls):
+        env = os.environ
+        return cls(
+            dpi=int(env.get('OCR_DPI', 300)),
+            lang=env.get('OCR_LANG', OCR_LANG),
+            grayscale=_env_bool('OCR_GRAYSCALE', True),
+            binarize=_env_bool('OCR_BINARIZE', False),
+            deskew=_env_bool('OCR_DESKEW', False),
+            text_regions=_env_bool('OCR_TEXT_REGIONS', False),
+            thread_count=int(env.get('OCR_THREADS', 1)),
+            psm=int(env['OCR_PSM']) if env.get('OCR_PSM') else None,
+        )
+
+    def clau(self):
+        # Part de la clau de memòria cau: el text OCR depèn d'aquests paràmetres (no dels fils)
+        return f"{self.dpi}|{self.lang}|{int(self.grayscale)}{int(self.binarize)}{int(self.deskew)}{int(self.text_regions)}|{self.psm}"
+
+    def tesseract_args(self):
+        return f"--psm {self.psm}" if self.psm else ''
+
+    def __repr__(self):
+        return (f"OcrConfig(dpi={self.dpi}, lang={self.lang!r}, grayscale={self.grayscale}, binarize={self.binarize}, "
+                f"deskew={self.deskew}, text_regions={self.text_regions}, thread_count={self.thread_count}, psm={self.psm})")
+
+
+CONFIG = OcrConfig.from_env()
+
+
+def llegeix_font(font):
+    # Una font pot ser una ruta, bytes o un objecte tipus fitxer (p. ex. UploadedFile de Streamlit)
+    if isinstance(font, (bytes, bytearray)):
+        return bytes(font)
+    if isinstance(font, str):
+        with open(font, 'rb') as f:
+            return f.read()
+    font.seek(0)
+    return font.read()
+
+
+@contextlib.contextmanager
+def _ruta_pdf(font):
+    # pdftoppm treballa amb rutes: les fonts en memòria s'escriuen un sol cop a un fitxer temporal
+    if isinstance(font, str):
+        yield font
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = os.path.join(tmp, 'document.pdf')
+        with open(ruta, 'wb') as f:
+            f.write(llegeix_font(font))
+        yield ruta
+
+
+def pdf_num_pagines(font):
+    if isinstance(font, str):
+        return pdf2image.pdfinfo_from_path(font)['Pages']
+    return pdf2image.pdfinfo_from_bytes(llegeix_font(font))['Pages']
+
+
+def _memoria_max_mb():
+    # Memòria màxima (RSS) del procés fins ara; ru_maxrss és en KB a Linux i en bytes a macOS
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def pagines_pdf(font, config=None, primera=1, ultima=None):
+    # Generador de (num_pagina, imatge, segons_rasteritzacio). Les pàgines es rasteritzen en grups de
+    # thread_count (un fil de pdftoppm per pàgina), de manera que mai n'hi ha més en memòria.
+    config = config or CONFIG
+    with _ruta_pdf(font) as ruta:
+        ultima = ultima or pdf2image.pdfinfo_from_path(ruta)['Pages']
+        for inici in range(primera, ultima + 1, config.thread_count):
+            final = min(ultima, inici + config.thread_count - 1)
+            t0 = time.perf_counter()
+            imatges = pdf2image.convert_from_path(
+                ruta, dpi=config.dpi, grayscale=config.grayscale, first_page=inici, last_page=final,
+                thread_count=final - inici + 1,
+            )
+            segons = (time.perf_counter() - t0) / max(1, len(imatges))
+            while imatges:
+                yield inici, imatges.pop(0), segons
+                inici += 1
+
+
+def llindar_otsu(imatge):
+    # Llindar de binarització d'Otsu a partir de l'histograma d'una imatge en escala de grisos
+    hist = imatge.histogram()[:256]
+    total = sum(hist)
+    suma = sum(i * h for i, h in enumerate(hist))
+    suma_fons = pes_fons = 0
+    millor, llindar = -1.0, 127
+    for t, h in enumerate(hist):
+        pes_fons += h
+        pes_tinta = total - pes_fons
+        if pes_fons == 0:
+            continue
+        if pes_tinta == 0:
+            break
+        suma_fons += t * h
+        diferencia = suma_fons / pes_fons - (suma - suma_fons) / pes_tinta
+        variancia = pes_fons * pes_tinta * diferencia * diferencia
+        if variancia > millor:
+            millor, llindar = variancia, t
+    return llindar
+
+
+def binaritza(imatge):
+    llindar = llindar_otsu(imatge)
+    return imatge.point(lambda v: 255 if v > llindar else 0)
+
+
+def angle_inclinacio(imatge, max_angle=MAX_INCLINACIO, pas=PAS_INCLINACIO):
+    # Perfil de projecció horitzontal: amb l'angle correcte les files de text queden alineades
+    # i la variància de la suma de tinta per fila és màxima. Es calcula sobre una còpia reduïda.
+    escala = min(1.0, 1000 / max(imatge.size))
+    petita = imatge.resize((max(1, int(imatge.width * escala)), max(1, int(imatge.height * escala))))
+    tinta = ImageOps.invert(petita)
+    millor, angle = -1.0, 0.0
+    for candidat in np.arange(-max_angle, max_angle + pas / 2, pas):
+        perfil = np.asarray(tinta.rotate(float(candidat), fillcolor=0), dtype=np.float32).sum(axis=1)
+        puntuacio = float(np.var(perfil))
+        if puntuacio > millor:
+            millor, angle = puntuacio, float(candidat)
+    return angle
+
+
+def endreca(imatge):
+    angle = angle_inclinacio(imatge)
+    if abs(angle) < PAS_INCLINACIO:
+        return imatge
+    return imatge.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+
+def retalla_text(imatge, marge=20):
+    # Retalla a la caixa que conté tota la tinta (ignora marges buits i vores clares de l'escàner)
+    tinta = ImageOps.invert(imatge).point(lambda v: 255 if v > 64 else 0)
+    caixa = tinta.getbbox()
+    if caixa is None:
+        return imatge
+    esq, dalt, dreta, baix = caixa
+    return imatge.crop((max(0, esq - marge), max(0, dalt - marge),
+                        min(imatge.width, dreta + marge), min(imatge.height, baix + marge)))
+
+
+def preprocessa(imatge, config=None):
+    # Grisos -> endreçament -> binarització -> retall, segons la configuració
+    config = config or CONFIG
+    if config.grayscale or config.binarize or config.deskew or config.text_regions:
+        imatge = ImageOps.grayscale(imatge) if imatge.mode != 'L' else imatge
+    if config.deskew:
+        imatge = endreca(imatge)
+    if config.binarize:
+        imatge = binaritza(imatge)
+    if config.text_regions:
+        imatge = retalla_text(imatge)
+    return imatge
+
+
+def _ocr(imatge, config):
+    return pytesseract.image_to_string(imatge, lang=config.lang, config=config.tesseract_args())
+
+
+def ocr_pdf(font, config=None, metriques=None, primera=1, ultima=None):
+    # OCR de les pàgines [primera, ultima] d'una en una (la imatge s'allibera abans de la següent).
+    # Si es passa una llista a metriques, s'hi afegeix el temps i la memòria de cada pàgina.
+    config = config or CONFIG
+    textos = []
+    for num, imatge, segons_raster in pagines_pdf(font, config, primera, ultima):
+        t0 = time.perf_counter()
+        imatge = preprocessa(imatge, config)
+        t1 = time.perf_counter()
+        textos.append(_ocr(imatge, config))
+        t2 = time.perf_counter()
+        registra("rasteritzacio", segons_raster * 1000, pagina=num, dpi=config.dpi)
+        registra("ocr_pagina", (t2 - t0) * 1000, pagina=num, preproces_ms=round((t1 - t0) * 1000, 3),
+                 caracters=len(textos[-1]), lang=config.lang)
+        if metriques is not None:
+            metriques.append({
+                "Pagina": num, "Raster_s": round(segons_raster, 3), "Preproces_s": round(t1 - t0, 3),
+                "OCR_s": round(t2 - t1, 3), "Imatge_MB": round(imatge.width * imatge.height * len(imatge.getbands()) / 1e6, 1),
+                "RSS_max_MB": None if resource is None else round(_memoria_max_mb(), 1),
+            })
+        del imatge
+    return "\n".join(textos)
+
+
+def ocr_pagina_pdf(font, pagina, config=None):
+    # Rasteritza i fa OCR d'una sola pàgina (numerada des d'1); pensat per executar-se en un procés del pool
+    return ocr_pdf(font, config, primera=pagina, ultima=pagina)
+
+
+def _obre_pdf(font):
+    if isinstance(font, str):
+        return pdfplumber.open(font)
+    return pdfplumber.open(io.BytesIO(llegeix_font(font)))
+
+
+def _text_de_pagina(page):
+    # Text incrustat de la pàgina més les taules (línies de producte) en format 'cel | cel'
+    text = page.extract_text() or ''
+    taules = []
+    for taula in page.extract_tables() or []:
+        for fila in taula:
+            celes = [str(c).strip() for c in fila if c is not None and str(c).strip()]
+            if celes:
+                taules.append(' | '.join(celes))
+    if taules:
+        text = text + "\n[TAULA]\n" + "\n".join(taules)
+    return text
+
+
+def text_pagina_pdf(font, pagina, config=None):
+    # Retorna (text, metode) d'una pàgina: 'text' si té capa de text utilitzable, si no 'ocr'
+    with span("capa_text", pagina=pagina), _obre_pdf(font) as pdf:
+        text = _text_de_pagina(pdf.pages[pagina - 1])
+    if len(text.strip()) >= MIN_CARACTERS_TEXT:
+        return text, 'text'
+    return ocr_pagina_pdf(font, pagina, config), 'ocr'
+
+
+def text_pdf(font, config=None):
+    # Extreu el text de totes les pàgines; només rasteritza les que no tenen text incrustat.
+    # Retorna (text, [metode de cada pàgina])
+    textos, metodes = [], []
+    dades = font if isinstance(font, str) else llegeix_font(font)
+    with span("capa_text") as atributs, _obre_pdf(dades) as pdf:
+        pagines = [_text_de_pagina(page) for page in pdf.pages]
+        atributs["pagines"] = len(pagines)
+    if all(len(text.strip()) >= MIN_CARACTERS_TEXT for text in pagines):
+        return "\n".join(pagines), ['text'] * len(pagines)
+    with _ruta_pdf(dades) as ruta:
+        for num, text in enumerate(pagines, start=1):
+            if len(text.strip()) >= MIN_CARACTERS_TEXT:
+                metodes.append('text')
+            else:
+                text = ocr_pagina_pdf(ruta, num, config)
+                metodes.append('ocr')
+            textos.append(text)
+    return "\n".join(textos), metodes
+
+
+def ocr_imatge(font, config=None):
+    config = config or CONFIG
+    if isinstance(font, Image.Image):
+        imatge = font
+    else:
+        imatge = Image.open(io.BytesIO(llegeix_font(font)))
+    with span("ocr_pagina", pagina=1, lang=config.lang) as atributs:
+        text = _ocr(preprocessa(imatge, config), config)
+        atributs["caracters"] = len(text)
+    return text
@@ -0,0 +1,125 @@
+import collections
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import pstats
+import threading
+import time
+
+
+DIRECTORI = os.environ.get("TELEMETRIA_DIR") or os.path.join(os.path.dirname(__file__), '../logs')
+FITXER = "etapes.jsonl"
+MAX_BYTES = 5 * 1024 * 1024
+COPIES = 5
+# Spans recents en memòria per al panell de diagnòstic
+MAX_RECENTS = 5000
+
+logger = logging.getLogger("factures.etapes")
+logger.propagate = False
+_recents = collections.deque(maxlen=MAX_RECENTS)
+_lock = threading.Lock()
+_configurat = False
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(getattr(record, "span", {"missatge": record.getMessage()}), ensure_ascii=False, default=str)
+
+
+def configura(directori=None):
+    # El fitxer JSON-lines el rota només el procés principal; els processos del pool d'OCR hi afegeixen
+    # línies sense rotar-lo (dues rotacions simultànies perdrien dades)
+    global _configurat
+    with _lock:
+        if _configurat:
+            return
+        directori = directori or DIRECTORI
+        os.makedirs(directori, exist_ok=True)
+        ruta = os.path.join(directori, FITXER)
+        if multiprocessing.current_process().name == "MainProcess":
+            handler = logging.handlers.RotatingFileHandler(ruta, maxBytes=MAX_BYTES, backupCount=COPIES, encoding='utf-8')
+        else:
+            handler = logging.FileHandler(ruta, encoding='utf-8')
+        handler.setFormatter(JsonLinesFormatter())
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        _configurat = True
+
+
+def registra(etapa, ms, **atributs):
+    if not _configurat:
+        configura()
+    span = {"ts": round(time.time(), 3), "etapa": etapa, "ms": round(ms, 3), **atributs}
+    _recents.append(span)
+    logger.info(etapa, extra={"span": span})
+    return span
+
+
+@contextlib.contextmanager
+def span(etapa, **atributs):
+    # Mesura la durada d'una etapa; el bloc pot afegir atributs (bytes, tokens, model...) al dict retornat
+    t0 = time.perf_counter()
+    try:
+        yield atributs
+    except Exception as e:
+        atributs["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        registra(etapa, (time.perf_counter() - t0) * 1000, **atributs)
+
+
+def spans_recents(etapa=None):
+    return [s for s in list(_recents) if etapa is None or s["etapa"] == etapa]
+
+
+def resum(spans=None):
+    # {etapa: {'n', 'p50_ms', 'p95_ms', 'max_ms', 'errors'}} dels spans recents
+    per_etapa = collections.defaultdict(list)
+    errors = collections.Counter()
+    for s in spans if spans is not None else spans_recents():
+        per_etapa[s["etapa"]].append(s["ms"])
+        errors[s["etapa"]] += "error" in s
+    resultat = {}
+    for etapa, valors in per_etapa.items():
+        valors.sort()
+        resultat[etapa] = {
+            "n": len(valors), "p50_ms": valors[(len(valors) - 1) // 2],
+            "p95_ms": valors[min(len(valors) - 1, int(0.95 * len(valors)))], "max_ms": valors[-1],
+            "errors": errors[etapa],
+        }
+    return resultat
+
+
+class Perfil:
+    # Resultat d'una captura de cProfile: ruta del .prof i les funcions amb més temps acumulat
+    def __init__(self, ruta=None, resum=""):
+        self.ruta = ruta
+        self.resum = resum
+
+
+@contextlib.contextmanager
+def perfila(nom, actiu=True, directori=None, linies=25):
+    # Captura opcional de cProfile (p. ex. per a una sola càrrega); desa el .prof per obrir-lo amb snakeviz o pstats
+    perfil = Perfil()
+    if not actiu:
+        yield perfil
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield perfil
+    finally:
+        profiler.disable()
+        directori = os.path.join(directori or DIRECTORI, "perfils")
+        os.makedirs(directori, exist_ok=True)
+        net = "".join(c if c.isalnum() or c in "-_." else "_" for c in nom)
+        perfil.ruta = os.path.join(directori, f"{time.strftime('%Y%m%d_%H%M%S')}_{net}.prof")
+        profiler.dump_stats(perfil.ruta)
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(linies)
+        perfil.resum = text.getvalue()